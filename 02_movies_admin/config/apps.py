@@ -0,0 +1,9 @@
+"""Project applications configurations."""
+
+from django.contrib.admin.apps import AdminConfig
+
+
+class MoviesAdminConfig(AdminConfig):
+    """Admin application with the project admin site."""
+
+    default_site = 'movies.sites.MoviesAdminSite'
@@ -5,3 +5,12 @@ from config.components.base import INSTALLED_APPS
 INSTALLED_APPS += (
     'movies',
 )
+
+# Admin autocomplete results (see 'movies.autocomplete')
+MOVIES_AUTOCOMPLETE_LIMIT = 20
+MOVIES_AUTOCOMPLETE_CACHE_SECONDS = 30
+MOVIES_AUTOCOMPLETE_TRIGRAM_MIN_LENGTH = 3
+
+# Changelist counts (see 'movies.paginators')
+MOVIES_ESTIMATED_COUNT_THRESHOLD = 100000
+MOVIES_EXACT_COUNT_TIMEOUT_MS = 200
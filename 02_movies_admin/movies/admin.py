@@ -1,25 +1,40 @@
 """Admin panel models."""
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
 from django.utils.translation import gettext_lazy as _
 
 from movies import models as mov_model
+from movies.keyset import KeysetChangeList
+from movies.paginators import EstimatedCountPaginator
+
+# Text search configurations of the project languages
+_SEARCH_CONFIGS = ('russian', 'english')
 
 
 @admin.register(mov_model.Genre)
 class GenreAdmin(admin.ModelAdmin):
     """Admin model for ORM model "Genre"."""
 
+    search_fields = ['name']
+    trigram_search_field = 'name'
+
 
 @admin.register(mov_model.Person)
 class PersonAdmin(admin.ModelAdmin):
     """Admin model for ORM model "Person"."""
     ordering = ['full_name']
     search_fields = ['full_name']
+    trigram_search_field = 'full_name'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class _GenreFilmWorkInline(admin.TabularInline):
     model = mov_model.GenreFilmWork
+    autocomplete_fields = ['genre']
 
 
 class _PersonFilmWorkInline(admin.TabularInline):
@@ -27,6 +42,15 @@ class _PersonFilmWorkInline(admin.TabularInline):
     autocomplete_fields = ['person']
 
 
+class _FilmWorkChangeList(KeysetChangeList):
+    def get_ordering(self, request, queryset):
+        ordering = super().get_ordering(request, queryset)
+        # The best search matches go first, unless a column is sorted
+        if self.query and ORDER_VAR not in self.params:
+            return ['-search_rank', *ordering]
+        return ordering
+
+
 @admin.register(mov_model.FilmWork)
 class FilmWorkAdmin(admin.ModelAdmin):
     """Admin model for ORM model "FilmWork"."""
@@ -39,16 +63,33 @@ class FilmWorkAdmin(admin.ModelAdmin):
         'rating',
         'get_genres',
     )
+    # Searched by the full text 'search_vector' (see 'get_search_results')
     search_fields = ('title', 'description')
     list_filter = ('type',)
-    # optimize many-to-many queries with 'prefetch_related'
-    list_prefetch_related = ('genres', 'person')
+    # Seeked by the '(field, id)' indexes (see 'movies.keyset')
+    keyset_fields = ('title', 'creation_date', 'rating')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related(
-            *self.list_prefetch_related
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        query = SearchQuery(
+            search_term, config=_SEARCH_CONFIGS[0], search_type='websearch',
+        )
+        for config in _SEARCH_CONFIGS[1:]:
+            query |= SearchQuery(
+                search_term, config=config, search_type='websearch',
+            )
+        queryset = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query),
         )
+        return queryset, False
+
+    def get_changelist(self, request, **kwargs):
+        return _FilmWorkChangeList
 
     @admin.display(description=_('genre'))
     def get_genres(self, obj):
-        return ','.join([genre.name for genre in obj.genres.all()])
+        # Denormalized by DB triggers: no queries per changelist page
+        return obj.genre_names
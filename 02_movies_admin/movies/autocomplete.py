@@ -0,0 +1,82 @@
+"""Trigram similarity autocomplete of the admin panel."""
+
+import hashlib
+
+from django.conf import settings
+from django.contrib.admin.views.autocomplete import AutocompleteJsonView
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+
+_DEFAULT_LIMIT = 20
+_DEFAULT_CACHE_SECONDS = 30
+# pg_trgm similarity of a shorter term hardly reaches the threshold
+_DEFAULT_TRIGRAM_MIN_LENGTH = 3
+_CACHE_PREFIX = 'movies:autocomplete:'
+
+
+class TrigramAutocompleteJsonView(AutocompleteJsonView):
+    """Autocomplete by a trigram index of 'trigram_search_field'.
+
+    Models whose admin has no 'trigram_search_field' are searched by
+    'search_fields' as usual. Terms shorter than
+    'MOVIES_AUTOCOMPLETE_TRIGRAM_MIN_LENGTH' are matched by the prefix of
+    the field. The results are limited to one page and cached for a short
+    time.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.paginate_by = getattr(
+            settings, 'MOVIES_AUTOCOMPLETE_LIMIT', _DEFAULT_LIMIT,
+        )
+
+    def get(self, request, *args, **kwargs):
+        # Permissions are checked before the cache is used
+        self.term, self.model_admin, self.source_field, _ = (
+            self.process_request(request)
+        )
+        if not self.has_perm(request):
+            raise PermissionDenied
+        # Sites may register different admins of the same model
+        cache_key = _CACHE_PREFIX + hashlib.md5('\n'.join((
+            self.admin_site.name,
+            self.model_admin.model._meta.label,
+            request.GET.urlencode(),
+        )).encode()).hexdigest()
+        content = cache.get(cache_key)
+        if content is None:
+            content = super().get(request, *args, **kwargs).content
+            cache.set(cache_key, content, getattr(
+                settings,
+                'MOVIES_AUTOCOMPLETE_CACHE_SECONDS',
+                _DEFAULT_CACHE_SECONDS,
+            ))
+        return HttpResponse(content, content_type='application/json')
+
+    def get_queryset(self):
+        field = getattr(self.model_admin, 'trigram_search_field', None)
+        if field is None or not self.term:
+            return super().get_queryset()
+        queryset = self.model_admin.get_queryset(self.request)
+        queryset = queryset.complex_filter(
+            self.source_field.get_limit_choices_to(),
+        )
+        min_length = getattr(
+            settings,
+            'MOVIES_AUTOCOMPLETE_TRIGRAM_MIN_LENGTH',
+            _DEFAULT_TRIGRAM_MIN_LENGTH,
+        )
+        if len(self.term) < min_length:
+            queryset = queryset.filter(
+                **{'{0}__istartswith'.format(field): self.term},
+            ).order_by(field)
+            return queryset[:self.paginate_by]
+        # '%>' operator of the lookup is served by the trigram index
+        queryset = queryset.filter(
+            **{'{0}__trigram_word_similar'.format(field): self.term},
+        ).annotate(
+            similarity=TrigramWordSimilarity(self.term, field),
+        ).order_by('-similarity', field)
+        return queryset[:self.paginate_by]
@@ -0,0 +1,161 @@
+"""Keyset (seek) pagination of admin changelists."""
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import F, Func, Q, Value
+from django.db.models.lookups import GreaterThan, LessThan
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+_PK_NAMES = frozenset(('pk', 'id'))
+_SALT = 'movies.keyset'
+
+
+class _Row(Func):
+    """Row constructor, e.g. '(title, id)', compared as a whole."""
+
+    template = '(%(expressions)s)'
+    output_field = models.Field()
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist, which seeks on '(ordering field, id)' instead of OFFSET.
+
+    A page is the next 'list_per_page' rows after (or before) the cursor
+    of the previous page, so with an index on '(field, id)' every page
+    costs the same. The mode is used for an ordering by one of the
+    admin 'keyset_fields' (or by the primary key only), otherwise,
+    e.g. for the search rank ordering, pages are numbered as usual.
+    'keyset' tells the templates to show previous and next links.
+    """
+
+    keyset = None
+    keyset_previous_url = None
+    keyset_next_url = None
+
+    def get_queryset(self, request):
+        # Like the page number, a cursor isn't a filter and isn't kept in
+        # the links
+        for name in (AFTER_VAR, BEFORE_VAR):
+            self.params.pop(name, None)
+        return super().get_queryset(request)
+
+    def get_ordering(self, request, queryset):
+        ordering = super().get_ordering(request, queryset)
+        # '(field, id)' rows are compared in a single direction
+        if len(ordering) == 2 and ordering[1] in {'pk', '-pk'}:
+            lead = ordering[0]
+            if isinstance(lead, str):
+                ordering[1] = '-pk' if lead.startswith('-') else 'pk'
+        return ordering
+
+    def get_results(self, request):
+        super().get_results(request)
+        if self.show_all and self.can_show_all or not self.multi_page:
+            return
+        self.keyset = self._get_keyset()
+        if self.keyset is None:
+            return
+        after = request.GET.get(AFTER_VAR)
+        before = request.GET.get(BEFORE_VAR)
+        queryset = self.queryset
+        if before is not None:
+            queryset = self._seek(
+                queryset.reverse(), self._load_cursor(before), backward=True,
+            )
+        elif after is not None:
+            queryset = self._seek(queryset, self._load_cursor(after))
+        rows = list(queryset[:self.list_per_page + 1])
+        more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if before is not None:
+            rows.reverse()
+            has_previous, has_next = more, True
+        else:
+            has_previous, has_next = after is not None, more
+        if has_previous:
+            self.keyset_previous_url = self.get_query_string(
+                {BEFORE_VAR: self._dump_cursor(rows[0])} if rows else {},
+            )
+        if has_next and rows:
+            self.keyset_next_url = self.get_query_string(
+                {AFTER_VAR: self._dump_cursor(rows[-1])},
+            )
+        self.result_list = rows
+
+    def _get_keyset(self):
+        """'(field name or None, descending)' of a seekable ordering."""
+        if self.list_editable:
+            # The changelist formset needs a queryset of the page
+            return None
+        ordering = self.queryset.query.order_by
+        if not all(isinstance(part, str) for part in ordering):
+            return None
+        names = [part.lstrip('-') for part in ordering]
+        descending = ordering[0].startswith('-') if ordering else False
+        if any(part.startswith('-') != descending for part in ordering):
+            return None
+        keyset_fields = getattr(self.model_admin, 'keyset_fields', ())
+        if len(names) == 1 and names[0] in _PK_NAMES:
+            return None, descending
+        if (
+            len(names) == 2 and names[0] in keyset_fields and
+            names[1] in _PK_NAMES
+        ):
+            return names[0], descending
+        return None
+
+    def _dump_cursor(self, obj):
+        field_name, _ = self.keyset
+        value = None
+        if field_name is not None:
+            value = getattr(obj, field_name)
+        return signing.dumps(
+            [None if value is None else str(value), str(obj.pk)], salt=_SALT,
+        )
+
+    def _load_cursor(self, token):
+        """'(field value, pk)' of a cursor."""
+        field_name, _ = self.keyset
+        try:
+            value, pk = signing.loads(token, salt=_SALT)
+            pk = self.lookup_opts.pk.to_python(pk)
+            if field_name is not None and value is not None:
+                value = self.lookup_opts.get_field(field_name).to_python(value)
+        except (signing.BadSignature, ValidationError, TypeError, ValueError):
+            raise IncorrectLookupParameters
+        return value, pk
+
+    def _seek(self, queryset, cursor, backward=False):
+        field_name, descending = self.keyset
+        value, pk = cursor
+        descending = descending != backward
+        lookup = LessThan if descending else GreaterThan
+        pk_field = self.lookup_opts.pk
+        if field_name is None:
+            return queryset.filter(
+                lookup(F('pk'), Value(pk, output_field=pk_field)),
+            )
+        field = self.lookup_opts.get_field(field_name)
+        if value is None:
+            seek = Q(**{'{0}__isnull'.format(field_name): True}) & Q(
+                lookup(F('pk'), Value(pk, output_field=pk_field)),
+            )
+            # NULLs are first in a descending PostgreSQL order
+            if descending:
+                seek |= Q(**{'{0}__isnull'.format(field_name): False})
+        else:
+            seek = Q(lookup(
+                _Row(F(field_name), F('pk')),
+                _Row(
+                    Value(value, output_field=field),
+                    Value(pk, output_field=pk_field),
+                ),
+            ))
+            # and last in an ascending one
+            if field.null and not descending:
+                seek |= Q(**{'{0}__isnull'.format(field_name): True})
+        return queryset.filter(seek)
@@ -0,0 +1,44 @@
+"""Recompute denormalized genre names of all film works."""
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+_DEFAULT_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """Repair 'FilmWork.genre_names', e.g. after a load without triggers.
+
+    Film works are updated by batches in separate transactions, so the
+    table is never locked for long.
+    """
+
+    help = 'Recompute genre names of all film works.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=_DEFAULT_BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        last_id = None
+        updated = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT array_agg(id ORDER BY id) FROM ('
+                    'SELECT id FROM content.film_work '
+                    'WHERE %s::uuid IS NULL OR id > %s::uuid '
+                    'ORDER BY id LIMIT %s) AS batch;',
+                    [last_id, last_id, options['batch_size']],
+                )
+                film_ids = cursor.fetchone()[0]
+                if not film_ids:
+                    break
+                cursor.execute(
+                    "SELECT content.refresh_genre_names('', %s::uuid[]);",
+                    [film_ids],
+                )
+            last_id = film_ids[-1]
+            updated += len(film_ids)
+        self.stdout.write(f'Genre names of {updated} film works updated')
@@ -0,0 +1,125 @@
+"""Denormalized genre names of a film work.
+
+'film_work.genre_names' is maintained by statement level triggers with
+transition tables, so a bulk COPY or INSERT updates every film once.
+Names of the tables are derived from the trigger table name, so copies
+of the triggers on suffixed tables (e.g. '__new' shadow tables of the
+loader) update the suffixed film works.
+"""
+
+from django.db import migrations, models
+
+_DB_DEFAULT_SQL = (
+    "ALTER TABLE content.film_work ALTER COLUMN genre_names SET DEFAULT '';"
+)
+
+_TRIGGERS_SQL = """
+CREATE FUNCTION content.refresh_genre_names(suffix text, film_ids uuid[])
+RETURNS void LANGUAGE plpgsql AS $$
+BEGIN
+    EXECUTE format(
+        'UPDATE content.%1$I AS fw SET genre_names = coalesce(('
+        '    SELECT string_agg(g.name, '','' ORDER BY g.name)'
+        '    FROM content.%2$I AS gfw'
+        '    JOIN content.%3$I AS g ON g.id = gfw.genre_id'
+        '    WHERE gfw.film_work_id = fw.id), '''')'
+        ' WHERE fw.id = ANY($1)',
+        'film_work' || suffix, 'genre_film_work' || suffix, 'genre' || suffix)
+    USING film_ids;
+END
+$$;
+
+CREATE FUNCTION content.genre_film_work_genre_names()
+RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    film_ids uuid[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT film_work_id) INTO film_ids FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT film_work_id) INTO film_ids FROM old_rows;
+    ELSE
+        SELECT array_agg(film_work_id) INTO film_ids FROM (
+            SELECT film_work_id FROM old_rows
+            UNION
+            SELECT film_work_id FROM new_rows
+        ) AS changed;
+    END IF;
+    PERFORM content.refresh_genre_names(
+        substr(TG_TABLE_NAME, length('genre_film_work') + 1), film_ids);
+    RETURN NULL;
+END
+$$;
+
+CREATE FUNCTION content.genre_genre_names()
+RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    suffix text := substr(TG_TABLE_NAME, length('genre') + 1);
+    film_ids uuid[];
+BEGIN
+    EXECUTE format(
+        'SELECT array_agg(DISTINCT gfw.film_work_id)'
+        ' FROM old_rows AS o'
+        ' JOIN new_rows AS n ON n.id = o.id AND n.name <> o.name'
+        ' JOIN content.%I AS gfw ON gfw.genre_id = n.id',
+        'genre_film_work' || suffix)
+    INTO film_ids;
+    PERFORM content.refresh_genre_names(suffix, film_ids);
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER genre_names_insert
+    AFTER INSERT ON content.genre_film_work
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION content.genre_film_work_genre_names();
+
+CREATE TRIGGER genre_names_delete
+    AFTER DELETE ON content.genre_film_work
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION content.genre_film_work_genre_names();
+
+CREATE TRIGGER genre_names_update
+    AFTER UPDATE ON content.genre_film_work
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION content.genre_film_work_genre_names();
+
+CREATE TRIGGER genre_names_update
+    AFTER UPDATE ON content.genre
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION content.genre_genre_names();
+"""
+
+_DROP_TRIGGERS_SQL = """
+DROP TRIGGER genre_names_update ON content.genre;
+DROP TRIGGER genre_names_update ON content.genre_film_work;
+DROP TRIGGER genre_names_delete ON content.genre_film_work;
+DROP TRIGGER genre_names_insert ON content.genre_film_work;
+DROP FUNCTION content.genre_genre_names();
+DROP FUNCTION content.genre_film_work_genre_names();
+DROP FUNCTION content.refresh_genre_names(text, uuid[]);
+"""
+
+_BACKFILL_SQL = (
+    "SELECT content.refresh_genre_names("
+    "'', array(SELECT id FROM content.film_work));"
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filmwork',
+            name='genre_names',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='genres'),
+        ),
+        # Rows inserted without Django (e.g. by the SQLite loader)
+        migrations.RunSQL(_DB_DEFAULT_SQL, migrations.RunSQL.noop),
+        migrations.RunSQL(_TRIGGERS_SQL, _DROP_TRIGGERS_SQL),
+        migrations.RunSQL(_BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,68 @@
+"""Full text search vector of a film work.
+
+'film_work.search_vector' holds 'title' (weight A) and 'description'
+(weight B) lexemes of both 'russian' and 'english' configurations, the
+languages of the project. It's computed by a row trigger, so rows loaded
+by COPY get it as well.
+"""
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+_TRIGGER_SQL = """
+CREATE FUNCTION content.film_work_search_vector(title text, description text)
+RETURNS tsvector LANGUAGE sql IMMUTABLE AS $$
+    SELECT
+        setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+$$;
+
+CREATE FUNCTION content.film_work_search_vector_trigger()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := content.film_work_search_vector(
+        NEW.title, NEW.description);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER search_vector_update
+    BEFORE INSERT OR UPDATE OF title, description ON content.film_work
+    FOR EACH ROW EXECUTE FUNCTION content.film_work_search_vector_trigger();
+"""
+
+_DROP_TRIGGER_SQL = """
+DROP TRIGGER search_vector_update ON content.film_work;
+DROP FUNCTION content.film_work_search_vector_trigger();
+DROP FUNCTION content.film_work_search_vector(text, text);
+"""
+
+# Before the index: a single pass is faster than the index updates
+_BACKFILL_SQL = (
+    'UPDATE content.film_work '
+    'SET search_vector = content.film_work_search_vector(title, description);'
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_film_work_genre_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filmwork',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='search vector'),
+        ),
+        migrations.RunSQL(_TRIGGER_SQL, _DROP_TRIGGER_SQL),
+        migrations.RunSQL(_BACKFILL_SQL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='filmwork',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='film_work_search_vector'),
+        ),
+    ]
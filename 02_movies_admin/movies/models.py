@@ -2,6 +2,8 @@
 
 import uuid
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.utils.translation import gettext_lazy as _
@@ -10,6 +12,8 @@ _PERSON_NAME_MAX_LEN = 200
 _FILM_NAME_MAX_LEN = 200
 _FILM_TYPE_NAME_MAX_LEN = 15
 _ROLE_MAX_LEN = 15
+# Filled by DB triggers, Django must not write them
+_DB_MAINTAINED_FIELDS = frozenset(('genre_names', 'search_vector'))
 
 
 class TimeStampedMixin(models.Model):
@@ -39,6 +43,14 @@ class Genre(UUIDMixin, TimeStampedMixin):
         db_table = 'content"."genre'
         verbose_name = _('genre')
         verbose_name_plural = _('genres')
+        indexes = [
+            # Autocomplete (see 'movies.autocomplete')
+            GinIndex(
+                fields=['name'],
+                name='genre_name_trgm',
+                opclasses=['gin_trgm_ops']
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.name
@@ -51,6 +63,14 @@ class Person(UUIDMixin, TimeStampedMixin):
         db_table = 'content\".\"person'
         verbose_name = _('person')
         verbose_name_plural = _('persons')
+        indexes = [
+            # Autocomplete (see 'movies.autocomplete')
+            GinIndex(
+                fields=['full_name'],
+                name='person_full_name_trgm',
+                opclasses=['gin_trgm_ops']
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.full_name
@@ -79,16 +99,57 @@ class FilmWork(UUIDMixin, TimeStampedMixin):
     )
     genres = models.ManyToManyField(Genre, through='GenreFilmWork')
     person = models.ManyToManyField(Person, through='PersonFilmWork')
+    # Comma separated genre names, maintained by DB triggers (see migration
+    # 0002_film_work_genre_names)
+    genre_names = models.TextField(
+        _('genres'), blank=True, default='', editable=False,
+    )
+    # Weighted 'title' and 'description' lexemes of russian and english
+    # configurations (see migration 0003_film_work_search_vector)
+    search_vector = SearchVectorField(
+        _('search vector'), null=True, editable=False,
+    )
 
     # If DB should check a field value, add "models.CheckConstraint" in "Meta"
     class Meta:
         db_table = 'content"."film_work'
         verbose_name = _('film work')
         verbose_name_plural = _('film works')
+        indexes = [
+            GinIndex(
+                fields=['search_vector'],
+                name='film_work_search_vector'
+            ),
+            # Keyset pagination of the changelist (see 'movies.keyset')
+            models.Index(
+                fields=['title', 'id'],
+                name='film_work_title_id'
+            ),
+            models.Index(
+                fields=['creation_date', 'id'],
+                name='film_work_creation_date_id'
+            ),
+            models.Index(
+                fields=['rating', 'id'],
+                name='film_work_rating_id'
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.title + ' ({0})'.format(self.creation_date.year)
 
+    def save(self, *args, **kwargs):
+        # Loaded values of the DB maintained fields may be outdated, they
+        # must not overwrite the values set by the triggers
+        updating = not (self._state.adding or kwargs.get('force_insert'))
+        if updating and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in _DB_MAINTAINED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class GenreFilmWork(UUIDMixin):
     """Many To Many for "FilmWork" and "Genre"."""
@@ -0,0 +1,89 @@
+"""Paginators of large admin changelists."""
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import OperationalError, connections, transaction
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+_DEFAULT_THRESHOLD = 100000
+_DEFAULT_COUNT_TIMEOUT_MS = 200
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator, which doesn't count large querysets exactly.
+
+    Rows of a whole table are estimated by 'pg_class.reltuples', rows of
+    a filtered queryset by the planner ('EXPLAIN'). An estimate above
+    'MOVIES_ESTIMATED_COUNT_THRESHOLD' is used as the count, a smaller
+    one is replaced by an exact count, which is limited by
+    'MOVIES_EXACT_COUNT_TIMEOUT_MS' and falls back to the estimate.
+    'estimated' tells the templates, that the count is approximate.
+    """
+
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        estimate = self._estimate(queryset)
+        threshold = getattr(
+            settings, 'MOVIES_ESTIMATED_COUNT_THRESHOLD', _DEFAULT_THRESHOLD,
+        )
+        if estimate is not None and estimate >= threshold:
+            self.estimated = True
+            return estimate
+        try:
+            return self._timed_count(queryset)
+        except OperationalError:
+            # 'statement_timeout' is hit
+            if estimate is None:
+                raise
+        self.estimated = True
+        return estimate
+
+    def _timed_count(self, queryset):
+        timeout = getattr(
+            settings,
+            'MOVIES_EXACT_COUNT_TIMEOUT_MS',
+            _DEFAULT_COUNT_TIMEOUT_MS,
+        )
+        with transaction.atomic(using=queryset.db):
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute('SHOW statement_timeout;')
+                previous = cursor.fetchone()[0]
+                cursor.execute('SET LOCAL statement_timeout = %s;', [timeout])
+                count = queryset.count()
+                # In an outer transaction the setting outlives a released
+                # savepoint, so the value of the caller is restored
+                cursor.execute(
+                    "SELECT set_config('statement_timeout', %s, true);",
+                    [previous],
+                )
+        return count
+
+    def _estimate(self, queryset):
+        connection = connections[queryset.db]
+        query = queryset.query
+        whole_table = not (
+            query.where or query.distinct or query.low_mark or
+            query.high_mark is not None
+        )
+        table = connection.ops.quote_name(queryset.model._meta.db_table)
+        with connection.cursor() as cursor:
+            if whole_table:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass;',
+                    [table],
+                )
+                row = cursor.fetchone()
+                # -1: the table has never been analyzed
+                if row and row[0] >= 0:
+                    return row[0]
+            sql, params = query.sql_with_params()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        return int(plan[0]['Plan']['Plan Rows'])
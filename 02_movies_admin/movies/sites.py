@@ -0,0 +1,12 @@
+"""Admin site of the project."""
+
+from django.contrib import admin
+
+from movies.autocomplete import TrigramAutocompleteJsonView
+
+
+class MoviesAdminSite(admin.AdminSite):
+    """Default admin site with the trigram autocomplete."""
+
+    def autocomplete_view(self, request):
+        return TrigramAutocompleteJsonView.as_view(admin_site=self)(request)
@@ -0,0 +1,114 @@
+"""Keyset pagination of the film work changelist."""
+
+from datetime import date
+import uuid
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR
+from django.contrib.auth.models import User
+from django.core import signing
+from django.test import RequestFactory, TestCase
+
+from movies import keyset
+from movies.admin import FilmWorkAdmin
+from movies.models import FilmWork
+
+_URL = '/admin/movies/filmwork/'
+# NULLs and ties of every ordering column
+_RATINGS = (None, 5.0, None, 5.0, 7.5, 5.0, None)
+_TITLES = ('Alien', 'Brazil', 'Alien', 'Alien', 'Brazil', 'Cube', 'Alien')
+_YEARS = (2001, 2001, 1999, 2001, 2001, 1999, 2001)
+
+
+class KeysetChangeListTest(TestCase):
+    """Pages seeked by cursors, compared with the whole ordered table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', '', 'admin')
+        FilmWork.objects.bulk_create(
+            FilmWork(
+                title=title,
+                description='',
+                creation_date=date(year, 1, 1),
+                rating=rating,
+            )
+            for rating, title, year in zip(_RATINGS, _TITLES, _YEARS)
+        )
+
+    def setUp(self):
+        self.model_admin = FilmWorkAdmin(FilmWork, admin.site)
+        self.model_admin.list_per_page = 2
+
+    def _changelist(self, query_string=''):
+        request = RequestFactory().get(_URL + query_string)
+        request.user = self.user
+        return self.model_admin.get_changelist_instance(request)
+
+    def _forward_pages(self, query_string):
+        changelist = self._changelist(query_string)
+        pages = [[obj.pk for obj in changelist.result_list]]
+        while changelist.keyset_next_url:
+            changelist = self._changelist(changelist.keyset_next_url)
+            pages.append([obj.pk for obj in changelist.result_list])
+        return pages, changelist
+
+    def _assert_pages(self, order, ordering):
+        query_string = '?{0}={1}'.format(ORDER_VAR, order) if order else ''
+        pages, changelist = self._forward_pages(query_string)
+        self.assertIsNotNone(changelist.keyset)
+        expected = list(
+            FilmWork.objects.order_by(*ordering).values_list('pk', flat=True),
+        )
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+
+        backward = []
+        while changelist.keyset_previous_url:
+            changelist = self._changelist(changelist.keyset_previous_url)
+            backward.append([obj.pk for obj in changelist.result_list])
+        self.assertEqual(backward[::-1], pages[:-1])
+
+    def test_primary_key(self):
+        self._assert_pages('', ['-pk'])
+
+    def test_nulls_ascending(self):
+        # NULLs are last in an ascending PostgreSQL order
+        self._assert_pages('4', ['rating', 'pk'])
+
+    def test_nulls_descending(self):
+        # and first in a descending one
+        self._assert_pages('-4', ['-rating', '-pk'])
+
+    def test_ties(self):
+        self._assert_pages('1', ['title', 'pk'])
+        self._assert_pages('-3', ['-creation_date', '-pk'])
+
+    def test_other_ordering_is_numbered(self):
+        changelist = self._changelist('?{0}=2'.format(ORDER_VAR))
+        self.assertIsNone(changelist.keyset)
+        self.assertEqual(len(changelist.result_list), 2)
+
+    def test_cursor(self):
+        changelist = self._changelist('?{0}=4'.format(ORDER_VAR))
+        for obj in FilmWork.objects.all():
+            self.assertEqual(
+                changelist._load_cursor(changelist._dump_cursor(obj)),
+                (obj.rating, obj.pk),
+            )
+
+    def test_wrong_cursors(self):
+        pk = str(uuid.uuid4())
+        token = signing.dumps(['5.0', pk], salt=keyset._SALT)
+        for cursor in (
+            token[:-1] + ('A' if token[-1] != 'A' else 'B'),
+            signing.dumps(['5.0', pk]),
+            signing.dumps(['5.0', 'not a uuid'], salt=keyset._SALT),
+            signing.dumps(['not a rating', pk], salt=keyset._SALT),
+            signing.dumps(['5.0'], salt=keyset._SALT),
+        ):
+            with self.assertRaises(IncorrectLookupParameters):
+                self._changelist('?{0}=4&{1}={2}'.format(
+                    ORDER_VAR, keyset.AFTER_VAR, cursor,
+                ))
@@ -0,0 +1,93 @@
+"""Estimated counts of the changelist paginator."""
+
+from datetime import date
+from unittest import mock
+
+from django.db import OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from movies.models import FilmWork, Genre
+from movies.paginators import EstimatedCountPaginator
+
+
+def _paginator(estimate):
+    paginator = EstimatedCountPaginator(Genre.objects.order_by('pk'), 10)
+    paginator._estimate = mock.Mock(return_value=estimate)
+    paginator._timed_count = mock.Mock(return_value=42)
+    return paginator
+
+
+@override_settings(MOVIES_ESTIMATED_COUNT_THRESHOLD=1000)
+class ThresholdTest(SimpleTestCase):
+    """Estimate or exact count around the threshold."""
+
+    def test_large_estimate_is_the_count(self):
+        for estimate in (1000, 5000):
+            paginator = _paginator(estimate)
+            self.assertEqual(paginator.count, estimate)
+            self.assertTrue(paginator.estimated)
+            paginator._timed_count.assert_not_called()
+
+    def test_small_estimate_is_counted(self):
+        paginator = _paginator(999)
+        self.assertEqual(paginator.count, 42)
+        self.assertFalse(paginator.estimated)
+
+    def test_timed_out_count_is_the_estimate(self):
+        paginator = _paginator(999)
+        paginator._timed_count.side_effect = OperationalError
+        self.assertEqual(paginator.count, 999)
+        self.assertTrue(paginator.estimated)
+
+    def test_timed_out_count_without_estimate(self):
+        paginator = _paginator(None)
+        paginator._timed_count.side_effect = OperationalError
+        with self.assertRaises(OperationalError):
+            paginator.count
+
+    def test_list_is_counted(self):
+        paginator = EstimatedCountPaginator(list(range(5)), 2)
+        self.assertEqual(paginator.count, 5)
+        self.assertFalse(paginator.estimated)
+
+
+class CountTest(TestCase):
+    """Queries of the estimate and of the exact count."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Genre.objects.bulk_create(
+            Genre(name='Genre {0}'.format(number)) for number in range(3)
+        )
+        FilmWork.objects.create(
+            title='Alien', description='', creation_date=date(1979, 1, 1),
+        )
+
+    def _statement_timeout(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW statement_timeout;')
+            return cursor.fetchone()[0]
+
+    @override_settings(MOVIES_EXACT_COUNT_TIMEOUT_MS=1000)
+    def test_timeout_of_the_caller_is_restored(self):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = '7s';")
+            queryset = Genre.objects.order_by('pk')
+            paginator = EstimatedCountPaginator(queryset, 10)
+            self.assertEqual(paginator._timed_count(queryset), 3)
+            self.assertEqual(self._statement_timeout(), '7s')
+
+    def test_filtered_estimate(self):
+        queryset = Genre.objects.filter(
+            name__startswith='Genre',
+        ).order_by('pk')
+        paginator = EstimatedCountPaginator(queryset, 10)
+        self.assertIsInstance(paginator._estimate(queryset), int)
+
+    def test_small_table_is_counted(self):
+        paginator = EstimatedCountPaginator(
+            FilmWork.objects.order_by('pk'), 10,
+        )
+        self.assertEqual(paginator.count, 1)
+        self.assertFalse(paginator.estimated)
@@ -0,0 +1,219 @@
+""" asyncio loader engine.
+
+All tables are copied concurrently inside one event loop, every table
+on its own asyncpg connection with 'copy_to_table'. SQLite fetch and
+conversion of a batch are offloaded to a thread ('asyncio.to_thread'),
+so COPY of one table overlaps with reading of another without a thread
+per job. As in 'parallel', the tables are loaded into UNLOGGED staging
+tables with the keys of the tables first and published in a single
+transaction. A link table waits for its parent tables, so its orphan rows
+are quarantined like in the serial load. Failed COPY batches are bisected
+in nested transactions like in 'bisect_copy', rows PostgreSQL refuses are
+quarantined too.
+
+Tables share the process, so a profiler ('LOAD_PROFILE') covers the whole
+load ('async.*' files) instead of every table, and cProfile sees the event
+loop thread only. Seconds of the tables overlap ('concurrent' stats).
+
+The engine can be embedded into an asyncio service:
+    await aioload.load_async(sqlite_path, dsl, batch_size)
+"""
+
+import asyncio
+import io
+import logging
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import asyncpg
+
+import bisect_copy
+import load_data
+import metrics
+import parallel
+import pgbinary
+from quarantine import Quarantine
+import references
+import tables
+
+logger = logging.getLogger(__name__)
+
+
+class _Target:
+    """Staging table of a table and its COPY options."""
+
+    def __init__(self, conv: load_data.Convertor, binary: bool):
+        self.conv = conv
+        self.binary = binary
+        self.schema, self.table = parallel.staging_name(
+            conv.psql_table).split('.')
+        if binary:
+            self.options = {'format': 'binary'}
+        else:
+            self.options = {'format': 'csv',
+                            'delimiter': tables.DELIMITER,
+                            'null': tables.NULL_SYMBOL,
+                            'quote': tables.QUOTE_SYMBOL}
+
+    async def copy(self, pg_conn: asyncpg.Connection, lines: list):
+        if self.binary:
+            data = b''.join([pgbinary.HEADER, *lines, pgbinary.TRAILER])
+        else:
+            data = ''.join(lines).encode('utf-8')
+        await pg_conn.copy_to_table(
+            self.table,
+            schema_name=self.schema,
+            source=io.BytesIO(data),
+            columns=list(self.conv.columns),
+            **self.options)
+
+
+async def _copy_or_bisect(pg_conn: asyncpg.Connection,
+                          target: _Target,
+                          entries: List[tuple],
+                          lines: list,
+                          reject: Callable[[tuple, Exception], None]) -> int:
+    """'bisect_copy' in an event loop: number of the copied rows."""
+    try:
+        # A nested transaction is a savepoint
+        async with pg_conn.transaction():
+            await target.copy(pg_conn, lines)
+    except (asyncpg.exceptions.DataError,
+            asyncpg.exceptions.IntegrityConstraintViolationError) as exp:
+        if len(lines) == 1:
+            logger.error(f'Can\'t copy entry({entries[0]}): {exp}')
+            reject(entries[0], exp)
+            return 0
+        middle = len(lines) // 2
+        return (
+            await _copy_or_bisect(pg_conn, target, entries[:middle],
+                                  lines[:middle], reject) +
+            await _copy_or_bisect(pg_conn, target, entries[middle:],
+                                  lines[middle:], reject))
+    return len(lines)
+
+
+async def _copy_batches(pg_conn: asyncpg.Connection,
+                        target: _Target,
+                        batches: Iterator[Tuple[List[tuple], list]],
+                        stats: metrics.TableStats,
+                        reject: Callable[[tuple, Exception], None],
+                        batch_rows: int = bisect_copy.DEFAULT_BATCH_ROWS):
+    """'bisect_copy.copy_batches' of batches fetched by a thread."""
+    entries: List[tuple] = []
+    lines: list = []
+
+    async def flush():
+        copied = await _copy_or_bisect(pg_conn, target, entries, lines,
+                                       reject)
+        stats.rows_failed += len(lines) - copied
+        entries.clear()
+        lines.clear()
+
+    while True:
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            break
+        entries += batch[0]
+        lines += batch[1]
+        if len(lines) >= batch_rows:
+            await flush()
+    if lines:
+        await flush()
+
+
+def _collect(sqlite_path: str,
+             checker: references.ReferenceChecker,
+             conv: load_data.Convertor):
+    """Thread: keep the loaded ids of a parent table."""
+    with load_data.sqlite_conn_context(sqlite_path) as sqlite:
+        checker.collect(sqlite.cursor(), conv)
+
+
+async def _stage_table(pool: asyncpg.Pool,
+                       sqlite_path: str,
+                       conv: load_data.Convertor,
+                       batch_size: int,
+                       binary: bool,
+                       stats: metrics.TableStats,
+                       checker: references.ReferenceChecker,
+                       parents: List[asyncio.Task]):
+    # Link rows are checked against the ids of the staged parents
+    await asyncio.gather(*parents)
+    encode = conv.layout.to_binary if binary else conv.layout.to_csv
+    # The connection is used by one thread at a time, not always the same
+    with load_data.sqlite_conn_context(sqlite_path,
+                                       check_same_thread=False) as sqlite:
+        batches = load_data.extract_batches(
+            sqlite.cursor(), conv, encode, batch_size, stats=stats,
+            row_filter=checker.row_filter(conv, stats),
+            on_reject=checker.on_reject(conv))
+        async with pool.acquire() as pg_conn:
+            async with pg_conn.transaction():
+                await pg_conn.execute(parallel.create_staging_query(conv))
+                with metrics.copy_timer(stats):
+                    await _copy_batches(pg_conn, _Target(conv, binary),
+                                        batches, stats,
+                                        checker.on_reject(conv, 'copy'))
+    await asyncio.to_thread(_collect, sqlite_path, checker, conv)
+    logger.debug(f'{conv.sqlite_table} staged')
+
+
+async def _execute(pg_conn: asyncpg.Connection, queries: list):
+    for query in queries:
+        await pg_conn.execute(query)
+
+
+async def load_async(sqlite_path: str,
+                     dsl: dict,
+                     batch_size: int,
+                     binary: bool = False,
+                     collector: Optional[metrics.Collector] = None,
+                     concurrency: int = len(load_data.CONVERTORS),
+                     quarantine: Optional[Quarantine] = None) -> bool:
+    """Same result as 'load_data.load_from_sqlite', in an event loop."""
+    collector = collector or metrics.Collector()
+    with collector.profiled_run('async'):
+        return await _load(sqlite_path, dsl, batch_size, binary, collector,
+                           concurrency, quarantine)
+
+
+async def _load(sqlite_path: str,
+                dsl: dict,
+                batch_size: int,
+                binary: bool,
+                collector: metrics.Collector,
+                concurrency: int,
+                quarantine: Optional[Quarantine]) -> bool:
+    checker = references.ReferenceChecker(quarantine)
+    async with asyncpg.create_pool(
+            database=dsl['dbname'], user=dsl['user'],
+            password=dsl['password'], host=dsl['host'], port=dsl['port'],
+            min_size=1, max_size=max(concurrency, 1),
+            server_settings={'TimeZone': 'UTC'}) as pool:
+        # Parent tables go first in 'CONVERTORS'
+        tasks = {}
+        for conv in load_data.CONVERTORS:
+            stats = collector.table(conv.psql_table)
+            stats.concurrent = 1
+            tasks[conv.sqlite_table] = asyncio.create_task(_stage_table(
+                pool, sqlite_path, conv, batch_size, binary, stats, checker,
+                [tasks[parent] for parent in conv.depends_on]))
+        results = await asyncio.gather(*tasks.values(),
+                                       return_exceptions=True)
+        result = True
+        for conv, error in zip(load_data.CONVERTORS, results):
+            if isinstance(error, Exception):
+                logger.error(f'Staging of {conv.sqlite_table} error: '
+                             f'{error}.')
+                result = False
+
+        async with pool.acquire() as pg_conn:
+            try:
+                if result:
+                    async with pg_conn.transaction():
+                        await _execute(pg_conn, parallel.publish_queries())
+            except Exception as exp:
+                logger.error(f'Publishing error: {exp}.')
+                result = False
+            await _execute(pg_conn, parallel.drop_staging_queries())
+    return result
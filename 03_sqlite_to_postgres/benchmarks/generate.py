@@ -0,0 +1,153 @@
+""" Synthetic SQLite source generator.
+
+Builds a database with 'sql_lite.ddl' schema at a given scale, with the
+genres and persons fan-out close to the real catalogue and a share of
+deliberately malformed timestamps and ratings. Run from the loader folder:
+    python -m benchmarks.generate --film-works 100000 bench.sqlite
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import os
+import random
+import sqlite3
+from typing import Iterator, List
+import uuid
+
+DDL_PATH = os.path.join(os.path.dirname(__file__), '..', 'sql_lite.ddl')
+GENRES = 30
+PERSONS_PER_FILM_WORK = 0.6
+GENRES_PER_FILM_WORK = (1, 3)
+PERSONS_PER_FILM = (3, 12)
+ROLES = ('actor', 'director', 'writer')
+TYPES = ('movie', 'tv_show')
+INSERT_BATCH = 10_000
+
+_START = datetime(2021, 6, 16, tzinfo=timezone.utc)
+_MALFORMED_TIMESTAMPS = (
+    '2021-06-16 20:14:09+00',
+    '2021-06-16T20:14:09.221838',
+    '16.06.2021 20:14',
+    '',
+)
+_MALFORMED_RATINGS = ('', 'n/a', '8,5', None)
+
+
+class _Faker:
+    def __init__(self, malformed: float, seed: int):
+        self._random = random.Random(seed)
+        self._malformed = malformed
+
+    def is_malformed(self) -> bool:
+        return self._random.random() < self._malformed
+
+    def timestamp(self) -> str:
+        if self.is_malformed():
+            return self._random.choice(_MALFORMED_TIMESTAMPS)
+        # Rows are imported in bulks, so timestamps often repeat
+        moment = _START + timedelta(
+            seconds=self._random.randrange(10 ** 5),
+            microseconds=self._random.randrange(10))
+        return moment.strftime('%Y-%m-%d %H:%M:%S.%f+00')
+
+    def rating(self):
+        if self.is_malformed():
+            return self._random.choice(_MALFORMED_RATINGS)
+        return round(self._random.uniform(0, 10), 1)
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self._random.getrandbits(128), version=4))
+
+    def words(self, count: int) -> str:
+        return ' '.join(
+            ''.join(self._random.choices('abcdefghijklmnopqrstuvwxyz',
+                                         k=self._random.randint(3, 9)))
+            for _ in range(count))
+
+    def sample(self, population: List[str], limits: tuple) -> List[str]:
+        count = min(self._random.randint(*limits), len(population))
+        return self._random.sample(population, count)
+
+    def choice(self, population):
+        return self._random.choice(population)
+
+
+def _batches(rows: Iterator[tuple]) -> Iterator[List[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(conn: sqlite3.Connection, table: str, rows: Iterator[tuple]):
+    for batch in _batches(rows):
+        conn.executemany(
+            'INSERT INTO {table} VALUES ({marks});'.format(
+                table=table, marks=', '.join('?' * len(batch[0]))),
+            batch)
+
+
+def generate(path: str, film_works: int, malformed: float, seed: int):
+    fake = _Faker(malformed, seed)
+    genres = [fake.uuid() for _ in range(GENRES)]
+    persons = [fake.uuid()
+               for _ in range(max(1, int(film_works * PERSONS_PER_FILM_WORK)))]
+    film_work_ids = (fake.uuid() for _ in range(film_works))
+
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF;')
+    conn.execute('PRAGMA synchronous = OFF;')
+    with open(DDL_PATH) as ddl:
+        conn.executescript(ddl.read())
+
+    # Columns order of the DDL tables
+    _insert(conn, 'genre', (
+        (genre_id, f'Genre {i} {fake.words(1)}', fake.words(10),
+         fake.timestamp(), fake.timestamp())
+        for i, genre_id in enumerate(genres)))
+    _insert(conn, 'person', (
+        (person_id, fake.words(2).title(), fake.timestamp(), fake.timestamp())
+        for person_id in persons))
+
+    links = {'genre_film_work': [], 'person_film_work': []}
+    for batch in _batches(film_work_ids):
+        _insert(conn, 'film_work', (
+            (film_work_id, fake.words(3).title(), fake.words(30),
+             '2020-01-01', None, fake.rating(), fake.choice(TYPES),
+             fake.timestamp(), fake.timestamp())
+            for film_work_id in batch))
+        for film_work_id in batch:
+            links['genre_film_work'].extend(
+                (fake.uuid(), film_work_id, genre_id, fake.timestamp())
+                for genre_id in fake.sample(genres, GENRES_PER_FILM_WORK))
+            links['person_film_work'].extend(
+                (fake.uuid(), film_work_id, person_id, fake.choice(ROLES),
+                 fake.timestamp())
+                for person_id in fake.sample(persons, PERSONS_PER_FILM))
+        for table, rows in links.items():
+            _insert(conn, table, iter(rows))
+            rows.clear()
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0].strip())
+    parser.add_argument('path', help='SQLite file to create')
+    parser.add_argument('--film-works', type=int, default=10_000)
+    parser.add_argument('--malformed', type=float, default=0.001,
+                        help='share of malformed timestamps and ratings')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.path, args.film_works, args.malformed, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+""" Loader benchmark.
+
+Runs loader modes against a local PostgreSQL (connection settings come
+from the same environment variables as 'load_data.py') and appends one
+JSON line per mode to the results file: rows/sec, peak RSS and the
+'metrics' stats (fetch, conversion and COPY time and so on) of every
+table.
+Every mode runs in a fresh process, so peak RSS values are comparable.
+Run from the loader folder:
+    python -m benchmarks.loader bench.sqlite --modes serial,pipeline
+"""
+
+import argparse
+from contextlib import closing
+from dataclasses import asdict
+from datetime import datetime, timezone
+import json
+import logging
+import multiprocessing
+import queue
+import resource
+import sqlite3
+import subprocess
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+import psycopg2
+import psycopg2.extras
+
+import load_data
+import metrics
+import parallel
+import pipeline
+
+MODES = ('serial', 'binary', 'parallel', 'pipeline')
+DEFAULT_RESULTS_PATH = 'benchmarks/results.jsonl'
+# How often a running mode is checked for a dead process
+RESULT_POLL_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def _table_rows(sqlite_path: str) -> dict:
+    with closing(sqlite3.connect(sqlite_path)) as conn:
+        return {
+            conv.sqlite_table: conn.execute(
+                'SELECT COUNT(*) FROM {table};'.format(
+                    table=conv.sqlite_table)).fetchone()[0]
+            for conv in load_data.CONVERTORS
+        }
+
+
+def _run_mode(mode: str,
+              sqlite_path: str,
+              dsl: dict,
+              workers: int,
+              batch_size: int) -> dict:
+    psycopg2.extras.register_uuid()
+    collector = metrics.Collector()
+    start = time.perf_counter()
+    if mode == 'parallel':
+        result = parallel.load_parallel(sqlite_path, dsl, workers, batch_size,
+                                        collector=collector)
+    else:
+        with load_data.sqlite_conn_context(sqlite_path) as sqlite, \
+                closing(psycopg2.connect(**dsl)) as pg_conn, \
+                pg_conn, pg_conn.cursor() as pg_cursor:
+            pg_cursor.execute('SET SESSION TIME ZONE "UTC";')
+            if mode == 'pipeline':
+                result = pipeline.load_pipelined(sqlite_path, pg_cursor,
+                                                 workers, batch_size,
+                                                 collector=collector)
+            else:
+                result = load_data.load_from_sqlite(
+                    sqlite.cursor(), pg_cursor, batch_size,
+                    mode == 'binary', collector)
+    wall = time.perf_counter() - start
+    return {
+        'success': result,
+        'wall_seconds': wall,
+        'tables': {stats.table: asdict(stats)
+                   for stats in collector.tables},
+        # Kilobytes on Linux
+        'peak_rss_kb': max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+    }
+
+
+def _child(results: multiprocessing.Queue, *args):
+    results.put(_run_mode(*args))
+
+
+def _wait_result(results: multiprocessing.Queue,
+                 child: multiprocessing.Process) -> Optional[dict]:
+    """Result of a mode, None if its process died without any."""
+    while True:
+        try:
+            return results.get(timeout=RESULT_POLL_SECONDS)
+        except queue.Empty:
+            if not child.is_alive():
+                # The result could be put just before the exit
+                try:
+                    return results.get_nowait()
+                except queue.Empty:
+                    return None
+
+
+def _revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def benchmark(sqlite_path: str,
+              modes: list,
+              workers: int,
+              batch_size: int) -> list:
+    load_dotenv()
+    dsl = load_data.get_dsl()
+    rows = _table_rows(sqlite_path)
+    context = multiprocessing.get_context('spawn')
+    records = []
+    for mode in modes:
+        results = context.Queue()
+        child = context.Process(
+            target=_child,
+            args=(results, mode, sqlite_path, dsl, workers, batch_size))
+        child.start()
+        measured = _wait_result(results, child)
+        child.join()
+        if measured is None:
+            logger.error(f'{mode} benchmark process died with exit code '
+                         f'{child.exitcode}, the mode is skipped')
+            continue
+        records.append({
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'revision': _revision(),
+            'mode': mode,
+            'sqlite': sqlite_path,
+            'workers': workers,
+            'batch_size': batch_size,
+            'rows': rows,
+            'rows_per_second': sum(rows.values()) / measured['wall_seconds'],
+            **measured,
+        })
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0].strip())
+    parser.add_argument('sqlite', help='SQLite source file')
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help='comma separated: ' + ', '.join(MODES))
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--batch-size', type=int,
+                        default=load_data.DEFAULT_BATCH_SIZE)
+    parser.add_argument('--output', default=DEFAULT_RESULTS_PATH)
+    args = parser.parse_args()
+
+    records = benchmark(args.sqlite, args.modes.split(','),
+                        args.workers, args.batch_size)
+    with open(args.output, 'a') as output:
+        for record in records:
+            output.write(json.dumps(record) + '\n')
+            print(f'{record["mode"]:<10}'
+                  f'{record["rows_per_second"]:>12.0f} rows/s'
+                  f'{record["peak_rss_kb"] / 1024:>10.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
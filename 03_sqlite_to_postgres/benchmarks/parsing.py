@@ -0,0 +1,73 @@
+""" Microbenchmark of SQLite values parsing.
+
+Compares the former 'strptime' based timestamps parsing and UUID objects
+round trip with the 'parsers' module. Run from the loader folder:
+    python -m benchmarks.parsing
+"""
+
+from datetime import datetime, timedelta, timezone
+import random
+import timeit
+import uuid
+
+import parsers
+
+ROWS = 100_000
+# Rows created by one batch import share the same timestamp
+DISTINCT_TIMESTAMPS = 1000
+REPEAT = 5
+
+
+def _legacy_timestamp(line: str) -> datetime:
+    return datetime.strptime(line + ':00', '%Y-%m-%d %H:%M:%S.%f%z').replace(
+        tzinfo=timezone.utc)
+
+
+def _legacy_uuid(line: str) -> str:
+    return str(uuid.UUID(line))
+
+
+def _sample_timestamps() -> list:
+    start = datetime(2021, 6, 16, tzinfo=timezone.utc)
+    distinct = [
+        (start + timedelta(seconds=i, microseconds=i)).strftime(
+            '%Y-%m-%d %H:%M:%S.%f+00')
+        for i in range(DISTINCT_TIMESTAMPS)
+    ]
+    return [random.choice(distinct) for _ in range(ROWS)]
+
+
+def _best_of(func, values: list) -> float:
+    return min(timeit.repeat(lambda: [func(v) for v in values],
+                             number=1,
+                             repeat=REPEAT))
+
+
+def _report(name: str, legacy: float, current: float):
+    print(f'{name:<28}{legacy:>10.3f}s{current:>10.3f}s'
+          f'{legacy / current:>9.1f}x')
+
+
+def main():
+    timestamps = _sample_timestamps()
+    uuids = [str(uuid.uuid4()) for _ in range(ROWS)]
+    print(f'{ROWS} values, best of {REPEAT} runs')
+    print(f'{"":<28}{"legacy":>11}{"parsers":>11}{"speedup":>10}')
+
+    def cold(line: str) -> datetime:
+        parsers._parse_timestamp.cache_clear()
+        return parsers.parse_timestamp(line)
+
+    _report('timestamps (no cache)',
+            _best_of(_legacy_timestamp, timestamps),
+            _best_of(cold, timestamps))
+    _report('timestamps (memoized)',
+            _best_of(_legacy_timestamp, timestamps),
+            _best_of(parsers.parse_timestamp, timestamps))
+    _report('uuid pass-through',
+            _best_of(_legacy_uuid, uuids),
+            _best_of(parsers.uuid_text, uuids))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+""" Microbenchmark of rows conversion.
+
+Compares the former conversion of a row through a SQLite dataclass and a
+PostgreSQL dataclass (pinned below as it was) with the single pass
+'tables.RowLayout' conversion of plain tuples into text(CSV) and binary
+COPY rows: time and peak memory allocated while a row is converted. Run
+from the loader folder:
+    python -m benchmarks.rows
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime
+import struct
+import time
+import tracemalloc
+from typing import Union
+import uuid
+
+import parsers
+import pgbinary
+import tables
+
+ROWS = 100_000
+
+_UUID = struct.Struct('!i16s')
+
+Str_None = Union[str, None]
+
+
+@dataclass(frozen=True)
+class _LegacySqliteFilmWork:
+    id: str
+    title: str
+    description: Str_None
+    creation_date: Str_None
+    file_path: Str_None
+    rating: Str_None
+    type: str
+    created_at: Str_None
+    updated_at: Str_None
+
+
+@dataclass(frozen=True)
+class _LegacyFilmWork:
+    """'tables.FilmWork' with its former per-row conversion."""
+
+    _TITLE_MAX_LEN = 200
+    _TYPE_MAX_LEN = 15
+
+    id: uuid.UUID
+    title: str
+    description: str
+    creation_date: date
+    rating: Union[float, None]
+    type: str
+    created: datetime
+    modified: datetime
+
+    @staticmethod
+    def create_from_sqlite(lite_table: _LegacySqliteFilmWork):
+        descr = lite_table.description if lite_table.description else ''
+        creation = date.fromisoformat(
+            lite_table.creation_date if lite_table.creation_date
+            else tables.UNIX_DATE_EMPTY_MARK
+        )
+        _rating = None
+        try:
+            _rating = float(lite_table.rating)
+        except Exception:
+            pass
+
+        created_at = parsers.parse_timestamp(lite_table.created_at)
+        updated_at = parsers.parse_timestamp(lite_table.updated_at)
+
+        return _LegacyFilmWork(
+            id=uuid.UUID(lite_table.id),
+            title=lite_table.title[: _LegacyFilmWork._TITLE_MAX_LEN],
+            description=descr,
+            creation_date=creation,
+            rating=_rating,
+            type=lite_table.type[:_LegacyFilmWork._TYPE_MAX_LEN],
+            created=created_at,
+            modified=updated_at
+        )
+
+    def __str__(self) -> str:
+        return '{created},{modified},{id_},{title},'.format(
+            created=self.created.isoformat(),
+            modified=self.modified.isoformat(),
+            id_=self.id,
+            title=tables._quotes(self.title)
+        ) + '{description},{creation_date},{rating},{type_}\n'.format(
+            description=tables._quotes(self.description),
+            creation_date=self.creation_date.isoformat(),
+            rating=self.rating if self.rating else tables.NULL_SYMBOL,
+            type_=tables._quotes(self.type),
+        )
+
+    def to_binary(self) -> bytes:
+        return pgbinary.encode_tuple((
+            pgbinary.encode_timestamptz(self.created),
+            pgbinary.encode_timestamptz(self.modified),
+            _UUID.pack(16, self.id.bytes),
+            pgbinary.encode_text(self.title),
+            pgbinary.encode_text(self.description),
+            pgbinary.encode_date(self.creation_date),
+            pgbinary.encode_float8(self.rating),
+            pgbinary.encode_text(self.type),
+        ))
+
+
+def _legacy(row: tuple) -> _LegacyFilmWork:
+    # Former rows were 'sqlite3.Row' of all the columns, made a dict
+    data = dict(zip(tables.FILM_WORK_LAYOUT.sqlite_columns, row))
+    return _LegacyFilmWork.create_from_sqlite(
+        _LegacySqliteFilmWork(file_path=None, **data))
+
+
+def _legacy_csv(row: tuple) -> str:
+    return str(_legacy(row))
+
+
+def _legacy_binary(row: tuple) -> bytes:
+    return _legacy(row).to_binary()
+
+
+def _sample_rows() -> list:
+    return [
+        (str(uuid.uuid4()), f'Film {i}', 'Description', '2021-01-01',
+         i % 100 / 10, 'movie', '2021-06-16 20:14:09.221838+00',
+         '2021-06-16 20:14:09.221838+00')
+        for i in range(ROWS)
+    ]
+
+
+def _run(convert, rows: list) -> float:
+    start = time.perf_counter()
+    for row in rows:
+        convert(row)
+    return time.perf_counter() - start
+
+
+def _peak_bytes(convert, row: tuple) -> int:
+    """Peak of a call, which caches (e.g. of timestamps) are filled for."""
+    tracemalloc.start()
+    convert(row)
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    convert(row)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    rows = _sample_rows()
+    print(f'{ROWS} film_work rows')
+    print(f'{"":<16}{"time":>10}{"peak bytes/row":>16}{"speedup":>10}')
+    for name, legacy, convert in (
+            ('csv', _legacy_csv, tables.FILM_WORK_LAYOUT.to_csv),
+            ('binary', _legacy_binary, tables.FILM_WORK_LAYOUT.to_binary)):
+        legacy_elapsed = _run(legacy, rows)
+        elapsed = _run(convert, rows)
+        print(f'{"legacy " + name:<16}{legacy_elapsed:>9.3f}s'
+              f'{_peak_bytes(legacy, rows[-1]):>16}')
+        print(f'{name:<16}{elapsed:>9.3f}s'
+              f'{_peak_bytes(convert, rows[-1]):>16}'
+              f'{legacy_elapsed / elapsed:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
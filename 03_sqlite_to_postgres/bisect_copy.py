@@ -0,0 +1,139 @@
+""" Batch COPY with bisection of failed batches.
+
+Converted rows are copied in batches, every batch inside its own
+savepoint. A batch PostgreSQL refuses (e.g. a too long value or a broken
+CSV line) is rolled back to its savepoint and split in halves, which are
+copied again, until the bad rows are isolated. Such rows are passed to
+a reject hook with the PostgreSQL error, all the others are loaded by
+COPY as usual, so a few dirty rows don't fail the whole load.
+
+Only data and integrity errors are bisected, any other error (e.g. a lost
+connection) is raised at once. Every loader engine copies SQLite rows this
+way, into the content tables or into their staging copies.
+
+'copy_stream' copies all the rows by a single COPY statement instead, for
+engines, which can read the rows again and bisect them only after such a
+COPY fails.
+"""
+
+import io
+import itertools
+import logging
+from typing import AnyStr, Callable, Iterable, List, Optional, Sequence, Tuple
+
+import psycopg2
+
+import load_data
+import metrics
+import pgbinary
+
+DEFAULT_BATCH_ROWS = 10000
+_SAVEPOINT = 'copy_batch'
+
+logger = logging.getLogger(__name__)
+
+
+def _copy(pg_cursor,
+          conv: load_data.Convertor,
+          target: str,
+          lines: Sequence[AnyStr],
+          binary: bool):
+    if binary:
+        stream = io.BytesIO(b''.join(
+            [pgbinary.HEADER, *lines, pgbinary.TRAILER]))
+    else:
+        stream = io.StringIO(''.join(lines))
+    load_data.copy(pg_cursor, stream, target, conv.columns, binary)
+
+
+def _copy_or_bisect(pg_cursor,
+                    conv: load_data.Convertor,
+                    target: str,
+                    entries: List[tuple],
+                    lines: List[AnyStr],
+                    binary: bool,
+                    reject: Callable[[tuple, Exception], None]) -> int:
+    """Number of the copied rows."""
+    pg_cursor.execute('SAVEPOINT {0};'.format(_SAVEPOINT))
+    try:
+        _copy(pg_cursor, conv, target, lines, binary)
+    except (psycopg2.DataError, psycopg2.IntegrityError) as exp:
+        pg_cursor.execute('ROLLBACK TO SAVEPOINT {0}; '
+                          'RELEASE SAVEPOINT {0};'.format(_SAVEPOINT))
+        if len(lines) == 1:
+            logger.error(f'Can\'t copy entry({entries[0]}): {exp}')
+            reject(entries[0], exp)
+            return 0
+        middle = len(lines) // 2
+        return (
+            _copy_or_bisect(pg_cursor, conv, target, entries[:middle],
+                            lines[:middle], binary, reject) +
+            _copy_or_bisect(pg_cursor, conv, target, entries[middle:],
+                            lines[middle:], binary, reject))
+    pg_cursor.execute('RELEASE SAVEPOINT {0};'.format(_SAVEPOINT))
+    return len(lines)
+
+
+def copy_stream(pg_cursor,
+                conv: load_data.Convertor,
+                batches: Iterable[Tuple[List[tuple], List[AnyStr]]],
+                binary: bool,
+                target: Optional[str] = None) -> bool:
+    """COPY 'load_data.extract_batches' output by a single statement.
+
+        Returns False, if PostgreSQL refuses some row: nothing is copied
+        then, but 'batches' are read till the end anyway, so all their
+        rows are filtered and converted (and their rejects reported) once.
+    """
+    target = target or conv.psql_table
+    lines = (line for _, batch_lines in batches for line in batch_lines)
+    if binary:
+        stream = load_data.BytesStreamReader(itertools.chain(
+            [pgbinary.HEADER], lines, [pgbinary.TRAILER]))
+    else:
+        stream = load_data.StreamReader(lines)
+    pg_cursor.execute('SAVEPOINT {0};'.format(_SAVEPOINT))
+    try:
+        load_data.copy(pg_cursor, stream, target, conv.columns, binary)
+    except (psycopg2.DataError, psycopg2.IntegrityError) as exp:
+        pg_cursor.execute('ROLLBACK TO SAVEPOINT {0}; '
+                          'RELEASE SAVEPOINT {0};'.format(_SAVEPOINT))
+        logger.warning(f'COPY into {target} failed: {exp}')
+        for _ in lines:
+            pass
+        return False
+    pg_cursor.execute('RELEASE SAVEPOINT {0};'.format(_SAVEPOINT))
+    return True
+
+
+def copy_batches(pg_cursor,
+                 conv: load_data.Convertor,
+                 batches: Iterable[Tuple[List[tuple], List[AnyStr]]],
+                 binary: bool,
+                 stats: metrics.TableStats,
+                 reject: Callable[[tuple, Exception], None],
+                 batch_rows: int = DEFAULT_BATCH_ROWS,
+                 target: Optional[str] = None):
+    """COPY 'load_data.extract_batches' output by 'batch_rows' rows.
+
+        Rows are copied into 'target' table, the table of 'conv' by
+        default.
+    """
+    target = target or conv.psql_table
+    entries: List[tuple] = []
+    lines: List[AnyStr] = []
+
+    def flush():
+        copied = _copy_or_bisect(pg_cursor, conv, target, entries, lines,
+                                 binary, reject)
+        stats.rows_failed += len(lines) - copied
+        entries.clear()
+        lines.clear()
+
+    for batch_entries, batch_lines in batches:
+        entries += batch_entries
+        lines += batch_lines
+        if len(lines) >= batch_rows:
+            flush()
+    if lines:
+        flush()
@@ -0,0 +1,414 @@
+""" Bulk load with deferred indexes, unique keys and foreign keys.
+
+Secondary indexes, unique constraints and foreign keys of the loaded
+tables are captured and dropped in the load transaction, so COPY pays
+neither for index maintenance nor for foreign key checks. Primary keys are
+kept: the foreign keys reference them. After the COPY of a table its rows,
+which duplicate a unique key of an earlier row, are deleted and
+quarantined, so link rows referencing them are quarantined as orphans.
+Before the commit the foreign keys are added back 'NOT VALID' (a catalog
+only change). After the commit the indexes, including the unique ones,
+are rebuilt in parallel on separate connections with a larger
+'maintenance_work_mem', unique constraints are attached to their indexes
+('USING INDEX'), the foreign keys are validated and the tables are
+analyzed.
+
+The captured definitions are saved to a versioned JSON file before the
+commit and removed after the rebuild, so a restarted job finishes an
+interrupted rebuild first.
+
+Attention!
+    Until the rebuild is finished unique keys aren't enforced: duplicates
+    written meanwhile fail the rebuild.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import asdict, dataclass
+import json
+import logging
+import os
+import sqlite3
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set
+
+import psycopg2
+
+import bisect_copy
+import load_data
+import metrics
+import parsers
+from quarantine import Quarantine
+import references
+
+SCHEMA = 'content'
+DEFAULT_MAINTENANCE_WORK_MEM = '512MB'
+# Snapshots of other versions are ignored
+SNAPSHOT_VERSION = 3
+
+logger = logging.getLogger(__name__)
+
+_INDEXES_QUERY = (
+    'SELECT t.relname, i.relname, pg_get_indexdef(i.oid) '
+    'FROM pg_index x '
+    'JOIN pg_class i ON i.oid = x.indexrelid '
+    'JOIN pg_class t ON t.oid = x.indrelid '
+    'WHERE t.relnamespace = %s::regnamespace AND t.relname = ANY(%s) '
+    'AND NOT EXISTS ('
+    "SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid "
+    "AND c.contype IN ('p', 'u', 'x'));"
+)
+_UNIQUE_KEYS_QUERY = (
+    'SELECT t.relname, c.conname, pg_get_indexdef(c.conindid), '
+    'ARRAY(SELECT a.attname::text FROM unnest(c.conkey) '
+    'WITH ORDINALITY AS k (attnum, position) '
+    'JOIN pg_attribute a ON a.attrelid = c.conrelid '
+    'AND a.attnum = k.attnum ORDER BY k.position) '
+    'FROM pg_constraint c JOIN pg_class t ON t.oid = c.conrelid '
+    'WHERE c.connamespace = %s::regnamespace AND t.relname = ANY(%s) '
+    "AND c.contype = 'u';"
+)
+_FOREIGN_KEYS_QUERY = (
+    'SELECT t.relname, c.conname, pg_get_constraintdef(c.oid) '
+    'FROM pg_constraint c JOIN pg_class t ON t.oid = c.conrelid '
+    'WHERE c.connamespace = %s::regnamespace AND t.relname = ANY(%s) '
+    "AND c.contype = 'f';"
+)
+
+
+@dataclass(frozen=True)
+class Deferred:
+    """Dropped index or foreign key."""
+
+    table: str
+    name: str
+    # 'CREATE INDEX ...' or the constraint definition
+    definition: str
+
+
+@dataclass(frozen=True)
+class UniqueKey:
+    """Dropped unique constraint."""
+
+    table: str
+    name: str
+    # 'CREATE UNIQUE INDEX ...' of the constraint index
+    definition: str
+    columns: List[str]
+
+
+_KINDS = {
+    'indexes': Deferred,
+    'unique_keys': UniqueKey,
+    'foreign_keys': Deferred,
+}
+
+
+@dataclass
+class SchemaSnapshot:
+    indexes: List[Deferred]
+    unique_keys: List[UniqueKey]
+    foreign_keys: List[Deferred]
+
+    @staticmethod
+    def capture(pg_cursor) -> 'SchemaSnapshot':
+        """Deferred objects of the loaded tables only."""
+        loaded = [conv.psql_table.split('.')[-1]
+                  for conv in load_data.CONVERTORS]
+        pg_cursor.execute(_INDEXES_QUERY, (SCHEMA, loaded))
+        indexes = [Deferred(*row) for row in pg_cursor.fetchall()]
+        pg_cursor.execute(_UNIQUE_KEYS_QUERY, (SCHEMA, loaded))
+        unique_keys = [UniqueKey(*row) for row in pg_cursor.fetchall()]
+        pg_cursor.execute(_FOREIGN_KEYS_QUERY, (SCHEMA, loaded))
+        foreign_keys = [Deferred(*row) for row in pg_cursor.fetchall()]
+        return SchemaSnapshot(indexes, unique_keys, foreign_keys)
+
+    @staticmethod
+    def load(path: str) -> Optional['SchemaSnapshot']:
+        if not os.path.exists(path):
+            return None
+        with open(path) as snapshot_file:
+            state = json.load(snapshot_file)
+        if state.pop('version', None) != SNAPSHOT_VERSION:
+            logger.warning(f'Schema snapshot {path} of another version is '
+                           f'ignored and removed')
+            os.remove(path)
+            return None
+        return SchemaSnapshot(**{
+            kind: [_KINDS[kind](**item) for item in items]
+            for kind, items in state.items()})
+
+    def save(self, path: str):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as snapshot_file:
+            json.dump({'version': SNAPSHOT_VERSION, **asdict(self)},
+                      snapshot_file)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(tmp_path, path)
+
+    @property
+    def tables(self) -> List[str]:
+        return sorted({item.table for item in
+                       self.indexes + self.unique_keys + self.foreign_keys})
+
+    def without(self, tables: Iterable[str]) -> 'SchemaSnapshot':
+        """Snapshot without the objects of 'tables'."""
+        tables = set(tables)
+        return SchemaSnapshot(**{
+            kind: [item for item in getattr(self, kind)
+                   if item.table not in tables]
+            for kind in _KINDS})
+
+
+def _qualified(name: str) -> str:
+    return '{schema}.{name}'.format(schema=SCHEMA, name=name)
+
+
+def drop(pg_cursor, snapshot: SchemaSnapshot):
+    # Foreign keys may depend on the unique indexes
+    for item in snapshot.foreign_keys + snapshot.unique_keys:
+        pg_cursor.execute(
+            'ALTER TABLE {table} DROP CONSTRAINT {name};'.format(
+                table=_qualified(item.table), name=item.name))
+    for item in snapshot.indexes:
+        pg_cursor.execute('DROP INDEX {index};'.format(
+            index=_qualified(item.name)))
+
+
+def add_foreign_keys(pg_cursor, foreign_keys: Iterable[Deferred]):
+    """Add foreign keys 'NOT VALID': existing rows aren't checked."""
+    for item in foreign_keys:
+        pg_cursor.execute(
+            'ALTER TABLE {table} ADD CONSTRAINT {name} {definition} '
+            'NOT VALID;'.format(table=_qualified(item.table),
+                                name=item.name,
+                                definition=item.definition))
+
+
+def remove_duplicates(sqlite_curs: sqlite3.Cursor,
+                      pg_cursor,
+                      conv: load_data.Convertor,
+                      unique_keys: Iterable[UniqueKey],
+                      reject: Callable[[Sequence, Exception], None]) -> int:
+    """Delete rows, which duplicate a unique key of an earlier copied row.
+
+        Their SQLite rows are passed to 'reject'. Returns the number of
+        the deleted rows.
+    """
+    errors: Dict[str, str] = {}
+    for key in unique_keys:
+        columns = ', '.join(key.columns)
+        pg_cursor.execute(
+            'DELETE FROM {table} WHERE ctid IN (SELECT ctid FROM ('
+            'SELECT ctid, row_number() OVER ('
+            'PARTITION BY {columns} ORDER BY ctid) AS position '
+            'FROM {table} WHERE {not_null}) AS ranked '
+            'WHERE position > 1) RETURNING id::text;'.format(
+                table=conv.psql_table, columns=columns,
+                not_null=' AND '.join(f'{column} IS NOT NULL'
+                                      for column in key.columns)))
+        for (id_,) in pg_cursor.fetchall():
+            errors[id_] = (f'duplicate key value violates unique '
+                           f'constraint "{key.name}" ({columns})')
+    if not errors:
+        return 0
+    id_index = conv.layout.sqlite_columns.index('id')
+    sqlite_curs.execute(load_data.select_query(conv))
+    for entries in iter(lambda: sqlite_curs.fetchmany(
+            load_data.DEFAULT_BATCH_SIZE), []):
+        for entry in entries:
+            try:
+                error = errors.get(parsers.uuid_text(entry[id_index]))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if error is not None:
+                logger.error(f'Can\'t copy entry({entry}): {error}')
+                reject(entry, ValueError(error))
+    return len(errors)
+
+
+def load_tables(sqlite_curs: sqlite3.Cursor,
+                pg_cursor,
+                unique_keys: Iterable[UniqueKey],
+                batch_size: int,
+                binary: bool = False,
+                collector: Optional[metrics.Collector] = None,
+                quarantine: Optional[Quarantine] = None) -> bool:
+    """'load_data.load_from_sqlite' without the dropped unique keys."""
+    collector = collector or metrics.Collector()
+    checker = references.ReferenceChecker(quarantine)
+    keys: Dict[str, List[UniqueKey]] = {}
+    for key in unique_keys:
+        keys.setdefault(_qualified(key.table), []).append(key)
+    for conv in load_data.CONVERTORS:
+        try:
+            with collector.profiled(conv.psql_table) as stats, \
+                    metrics.copy_timer(stats):
+                encode = (conv.layout.to_binary if binary
+                          else conv.layout.to_csv)
+                batches = load_data.extract_batches(
+                    sqlite_curs, conv, encode, batch_size, stats=stats,
+                    row_filter=checker.row_filter(conv, stats),
+                    on_reject=checker.on_reject(conv))
+                pg_cursor.execute('TRUNCATE TABLE {table} CASCADE;'.format(
+                    table=conv.psql_table))
+                bisect_copy.copy_batches(
+                    pg_cursor, conv, batches, binary, stats,
+                    checker.on_reject(conv, 'copy'))
+                # Before 'collect': link rows of duplicates are orphans
+                stats.rows_failed += remove_duplicates(
+                    sqlite_curs, pg_cursor, conv,
+                    keys.get(conv.psql_table, ()),
+                    checker.on_reject(conv, 'copy'))
+            checker.collect(sqlite_curs, conv)
+        except Exception as exp:
+            logger.error(f'Insertion into {conv.psql_table} error: {exp}.')
+            return False
+        logger.debug(f'{conv.sqlite_table} copied into {conv.psql_table}')
+    return True
+
+
+def _execute(dsl: dict, maintenance_work_mem: str, statements: List[str]):
+    """Worker thread: run the statements on its own connection."""
+    with closing(psycopg2.connect(**dsl)) as pg_conn:
+        pg_conn.autocommit = True
+        with pg_conn.cursor() as pg_cursor:
+            pg_cursor.execute('SET maintenance_work_mem = %s;',
+                              (maintenance_work_mem,))
+            for statement in statements:
+                logger.debug(statement)
+                pg_cursor.execute(statement)
+
+
+def _in_parallel(dsl: dict,
+                 workers: int,
+                 maintenance_work_mem: str,
+                 batches: Iterable[List[str]]):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_execute, dsl, maintenance_work_mem, batch)
+                   for batch in batches if batch]
+        for future in futures:
+            future.result()
+
+
+def _relations(pg_cursor) -> Set[str]:
+    pg_cursor.execute(
+        'SELECT relname FROM pg_class WHERE relnamespace = %s::regnamespace;',
+        (SCHEMA,))
+    return {row[0] for row in pg_cursor.fetchall()}
+
+
+def _constraints(pg_cursor) -> Set[str]:
+    pg_cursor.execute(
+        'SELECT conname FROM pg_constraint '
+        'WHERE connamespace = %s::regnamespace;',
+        (SCHEMA,))
+    return {row[0] for row in pg_cursor.fetchall()}
+
+
+def _unique_key_statements(key: UniqueKey, relations: Set[str]) -> List[str]:
+    statements = []
+    if key.name not in relations:
+        statements.append(key.definition + ';')
+    statements.append(
+        'ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE '
+        'USING INDEX {name};'.format(table=_qualified(key.table),
+                                     name=key.name))
+    return statements
+
+
+def rebuild(dsl: dict,
+            snapshot: SchemaSnapshot,
+            workers: int,
+            maintenance_work_mem: str = DEFAULT_MAINTENANCE_WORK_MEM):
+    """Build the dropped indexes, skipping the ones already built.
+
+        Unique constraints are added on top of their indexes. Foreign
+        keys are already added 'NOT VALID', they are validated. Objects
+        of the tables, which don't exist any more, are skipped.
+    """
+    with closing(psycopg2.connect(**dsl)) as pg_conn, \
+            pg_conn, pg_conn.cursor() as pg_cursor:
+        relations = _relations(pg_cursor)
+        constraints = _constraints(pg_cursor)
+    gone = sorted(set(snapshot.tables) - relations)
+    if gone:
+        logger.warning(f'Objects of missing tables {gone} are skipped')
+        snapshot = snapshot.without(gone)
+
+    # Every index is built by its own connection
+    _in_parallel(dsl, workers, maintenance_work_mem, (
+        [item.definition + ';'] for item in snapshot.indexes
+        if item.name not in relations))
+    _in_parallel(dsl, workers, maintenance_work_mem, (
+        _unique_key_statements(item, relations)
+        for item in snapshot.unique_keys if item.name not in constraints))
+
+    # Validation locks the table against other validations, so foreign
+    # keys of a table are validated one by one
+    foreign_keys: Dict[str, List[str]] = {}
+    for item in snapshot.foreign_keys:
+        foreign_keys.setdefault(item.table, []).append(
+            'ALTER TABLE {table} VALIDATE CONSTRAINT {name};'.format(
+                table=_qualified(item.table), name=item.name))
+    _in_parallel(dsl, workers, maintenance_work_mem, foreign_keys.values())
+    _in_parallel(dsl, workers, maintenance_work_mem, (
+        ['ANALYZE {table};'.format(table=_qualified(table))]
+        for table in snapshot.tables))
+
+
+def _finish(dsl: dict,
+            snapshot: SchemaSnapshot,
+            snapshot_path: str,
+            workers: int,
+            maintenance_work_mem: str) -> bool:
+    """Rebuild and remove the saved snapshot."""
+    try:
+        rebuild(dsl, snapshot, workers, maintenance_work_mem)
+    except Exception as exp:
+        logger.error(f'Rebuild error: {exp}. Definitions are kept in '
+                     f'{snapshot_path}, restart to finish the rebuild.')
+        return False
+    os.remove(snapshot_path)
+    return True
+
+
+def load_bulk(sqlite_curs: sqlite3.Cursor,
+              pg_conn,
+              dsl: dict,
+              snapshot_path: str,
+              workers: int,
+              batch_size: int,
+              binary: bool = False,
+              collector: Optional[metrics.Collector] = None,
+              quarantine: Optional[Quarantine] = None,
+              maintenance_work_mem: str = DEFAULT_MAINTENANCE_WORK_MEM
+              ) -> bool:
+    """Load all tables without deferred objects, then restore them.
+
+        Drop and load are done in a single transaction, so a failed load
+        is rolled back together with the dropped objects.
+    """
+    workers = max(workers, 1)
+    interrupted = SchemaSnapshot.load(snapshot_path)
+    if interrupted:
+        logger.info(f'Finishing the interrupted rebuild of {snapshot_path}')
+        if not _finish(dsl, interrupted, snapshot_path, workers,
+                       maintenance_work_mem):
+            return False
+
+    with pg_conn.cursor() as pg_cursor:
+        snapshot = SchemaSnapshot.capture(pg_cursor)
+        drop(pg_cursor, snapshot)
+        if not load_tables(sqlite_curs, pg_cursor, snapshot.unique_keys,
+                           batch_size, binary, collector, quarantine):
+            pg_conn.rollback()
+            return False
+        add_foreign_keys(pg_cursor, snapshot.foreign_keys)
+    snapshot.save(snapshot_path)
+    pg_conn.commit()
+    logger.info(f'Data loaded, rebuilding {len(snapshot.indexes)} indexes '
+                f'and {len(snapshot.unique_keys)} unique keys, validating '
+                f'{len(snapshot.foreign_keys)} foreign keys')
+    return _finish(dsl, snapshot, snapshot_path, workers,
+                   maintenance_work_mem)
@@ -0,0 +1,242 @@
+""" Export of the converted COPY data into compressed files.
+
+The expensive SQLite conversion runs once: every table is written as
+the very COPY stream 'load_data' sends to PostgreSQL, compressed with
+zstd (if 'zstandard' is installed) or gzip. 'manifest.json' keeps the
+COPY format, the table columns, row counts and sha256 of the uncompressed
+data, so 'replay.py' can load and check the files in any database.
+"""
+
+from contextlib import closing
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import sqlite3
+from typing import BinaryIO, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    # Optional, gzip is used without it
+    zstandard = None
+
+import load_data
+import metrics
+from quarantine import Quarantine
+
+MANIFEST_NAME = 'manifest.json'
+CHUNK_SIZE = 1 << 20
+COMPRESSIONS = {'zstd': '.zst', 'gzip': '.gz', 'none': ''}
+DEFAULT_COMPRESSION = 'zstd' if zstandard else 'gzip'
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ExportedTable:
+    table: str
+    columns: Tuple[str, ...]
+    # Relative to the export folder
+    file: str
+    rows: int
+    # Size and sha256 of the uncompressed COPY data
+    size: int
+    sha256: str
+
+
+@dataclass
+class Manifest:
+    binary: bool
+    compression: str
+    tables: List[ExportedTable] = field(default_factory=list)
+    created_at: str = field(
+        default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+    @staticmethod
+    def load(export_dir: str) -> 'Manifest':
+        with open(os.path.join(export_dir, MANIFEST_NAME)) as manifest_file:
+            state = json.load(manifest_file)
+        state['tables'] = [
+            ExportedTable(**dict(item, columns=tuple(item['columns'])))
+            for item in state['tables']]
+        return Manifest(**state)
+
+    def save(self, export_dir: str):
+        path = os.path.join(export_dir, MANIFEST_NAME)
+        with open(path + '.tmp', 'w') as manifest_file:
+            json.dump(asdict(self), manifest_file, indent=2)
+        os.replace(path + '.tmp', path)
+
+
+def _check_compression(compression: str):
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression {compression!r}')
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError('zstd compression requires zstandard package')
+
+
+def open_writer(path: str, compression: str) -> BinaryIO:
+    _check_compression(compression)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+    if compression == 'gzip':
+        # Fast level: the files are written once and read many times
+        return gzip.open(path, 'wb', compresslevel=1)
+    return open(path, 'wb')
+
+
+class _MappedFile(io.RawIOBase):
+    """Read-only file object of a memory-mapped file."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        with open(path, 'rb') as raw_file:
+            size = os.fstat(raw_file.fileno()).st_size
+            # Empty files can't be mapped
+            self._map = mmap.mmap(raw_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ) if size else None
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._map is None:
+            return 0
+        data = self._map[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        super().close()
+
+
+def open_reader(path: str, compression: str) -> BinaryIO:
+    """Stream of a compressed file, memory map of an uncompressed one."""
+    _check_compression(compression)
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    return _MappedFile(path)
+
+
+def _write_table(stream: load_data.StreamReader,
+                 path: str,
+                 compression: str) -> Tuple[int, str]:
+    """Size and sha256 of the written data."""
+    digest = hashlib.sha256()
+    size = 0
+    with open_writer(path, compression) as out_file:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            digest.update(chunk)
+            size += len(chunk)
+            out_file.write(chunk)
+    return size, digest.hexdigest()
+
+
+def export_tables(sqlite_curs: sqlite3.Cursor,
+                  export_dir: str,
+                  batch_size: int,
+                  binary: bool = False,
+                  compression: str = DEFAULT_COMPRESSION,
+                  collector: Optional[metrics.Collector] = None,
+                  quarantine: Optional[Quarantine] = None) -> Manifest:
+    """Write COPY data of all tables, the manifest is written last."""
+    # Built on top of this module
+    import references
+
+    _check_compression(compression)
+    os.makedirs(export_dir, exist_ok=True)
+    collector = collector or metrics.Collector()
+    checker = references.ReferenceChecker(quarantine)
+    manifest = Manifest(binary, compression)
+    for conv in load_data.CONVERTORS:
+        file_name = '{table}.{kind}{suffix}'.format(
+            table=conv.psql_table,
+            kind='bin' if binary else 'csv',
+            suffix=COMPRESSIONS[compression])
+        with collector.profiled(conv.psql_table) as stats, \
+                metrics.copy_timer(stats):
+            stream = load_data.table_stream(
+                sqlite_curs, conv, batch_size, binary, stats=stats,
+                row_filter=checker.row_filter(conv, stats),
+                on_reject=checker.on_reject(conv))
+            size, sha256 = _write_table(
+                stream, os.path.join(export_dir, file_name), compression)
+        checker.collect(sqlite_curs, conv)
+        manifest.tables.append(ExportedTable(
+            conv.psql_table, conv.columns, file_name, stats.rows_converted,
+            size, sha256))
+        logger.debug(f'{conv.sqlite_table} exported into {file_name}')
+    manifest.save(export_dir)
+    return manifest
+
+
+class HashingReader(io.RawIOBase):
+    """Read-only wrapper, which counts and hashes the read data."""
+
+    def __init__(self, raw: BinaryIO):
+        super().__init__()
+        self._raw = raw
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._raw.read(len(buffer))
+        buffer[:len(data)] = data
+        self.digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+def open_table(export_dir: str,
+               manifest: Manifest,
+               table: ExportedTable) -> HashingReader:
+    return HashingReader(open_reader(
+        os.path.join(export_dir, table.file), manifest.compression))
+
+
+def check(reader: HashingReader, table: ExportedTable):
+    """Raise 'ValueError', if the read data isn't the exported one."""
+    if reader.size != table.size or \
+            reader.digest.hexdigest() != table.sha256:
+        raise ValueError(f'{table.file} is damaged: checksum mismatch')
+
+
+def verify_files(export_dir: str) -> bool:
+    """Check the checksums without a database."""
+    manifest = Manifest.load(export_dir)
+    result = True
+    for table in manifest.tables:
+        with closing(open_table(export_dir, manifest, table)) as reader:
+            while reader.read(CHUNK_SIZE):
+                pass
+            try:
+                check(reader, table)
+            except ValueError as exp:
+                logger.error(str(exp))
+                result = False
+    return result
@@ -0,0 +1,222 @@
+""" Incremental (delta) synchronization.
+
+Instead of 'TRUNCATE ... CASCADE' and a full reload only rows changed
+since the previous run are copied. A per-table high-water mark of the
+SQLite 'changed_at' expression is kept in PostgreSQL and is updated in the
+same transaction as the data. Changed rows are copied into a temporary
+staging table and upserted with 'INSERT ... ON CONFLICT (id) DO UPDATE'.
+Changed link rows, which reference missing or rejected parent rows, are
+quarantined, as well as the rows PostgreSQL refuses to copy into the
+staging table.
+
+Deleted rows are found by an opt-in ('delete_missing') id-set diff: it
+reads all the SQLite ids, so it costs as much as a full load and is meant
+to be run occasionally. Rows with a missing or malformed id are skipped by
+the diff and quarantined.
+
+Attention!
+    Watermarks are compared as strings: SQLite stores timestamps as text
+    and all correct ones have the same format. Rows without any timestamp
+    are loaded only by the first synchronization.
+"""
+
+import logging
+import sqlite3
+from typing import Callable, Optional, Sequence
+
+import bisect_copy
+import load_data
+import metrics
+import parallel
+import parsers
+from quarantine import Quarantine
+import references
+
+STATE_TABLE = 'public.sqlite_sync_state'
+
+logger = logging.getLogger(__name__)
+
+
+def _ensure_state_table(pg_cursor):
+    pg_cursor.execute(
+        'CREATE TABLE IF NOT EXISTS {state} ('
+        'table_name TEXT PRIMARY KEY, '
+        'watermark TEXT NOT NULL, '
+        'synced_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now());'.format(
+            state=STATE_TABLE))
+
+
+def get_watermark(pg_cursor, psql_table: str) -> Optional[str]:
+    pg_cursor.execute(
+        'SELECT watermark FROM {state} WHERE table_name = %s;'.format(
+            state=STATE_TABLE),
+        (psql_table,))
+    row = pg_cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(pg_cursor, psql_table: str, watermark: str):
+    pg_cursor.execute(
+        'INSERT INTO {state} (table_name, watermark) VALUES (%s, %s) '
+        'ON CONFLICT (table_name) DO UPDATE '
+        'SET watermark = EXCLUDED.watermark, synced_at = now();'.format(
+            state=STATE_TABLE),
+        (psql_table, watermark))
+
+
+def _temp_name(conv: load_data.Convertor, kind: str) -> str:
+    return 'sync_{kind}_{table}'.format(kind=kind, table=conv.sqlite_table)
+
+
+def _valid_ids(sqlite_curs: sqlite3.Cursor,
+               conv: load_data.Convertor,
+               batch_size: int,
+               on_reject: Callable[[Sequence, Exception], None]):
+    """Canonical text of the ids of a SQLite table."""
+    id_index = conv.layout.sqlite_columns.index('id')
+    sqlite_curs.execute(load_data.select_query(conv))
+    for entries in iter(lambda: sqlite_curs.fetchmany(batch_size), []):
+        for entry in entries:
+            try:
+                yield parsers.uuid_text(entry[id_index]) + '\n'
+            except (AttributeError, TypeError, ValueError) as exp:
+                on_reject(entry, exp)
+
+
+def delete_missing(sqlite_curs: sqlite3.Cursor,
+                   pg_cursor,
+                   conv: load_data.Convertor,
+                   batch_size: int,
+                   on_reject: Optional[Callable[[Sequence, Exception], None]]
+                   = None) -> int:
+    """Delete PostgreSQL rows, which ids are absent in SQLite.
+
+        Rows without a valid id are passed to 'on_reject'.
+    """
+    ids = _temp_name(conv, 'ids')
+    # No key: duplicated SQLite ids mustn't fail the COPY
+    pg_cursor.execute(
+        'CREATE TEMP TABLE {ids} (id uuid NOT NULL) ON COMMIT DROP;'.format(
+            ids=ids))
+    stream = load_data.StreamReader(_valid_ids(
+        sqlite_curs, conv, batch_size,
+        on_reject or (lambda entry, error: None)))
+    pg_cursor.copy_expert('COPY {ids} (id) FROM STDIN;'.format(ids=ids),
+                          stream)
+    pg_cursor.execute('ANALYZE {ids};'.format(ids=ids))
+    pg_cursor.execute(
+        'DELETE FROM {table} AS t WHERE NOT EXISTS '
+        '(SELECT 1 FROM {ids} WHERE {ids}.id = t.id);'.format(
+            table=conv.psql_table, ids=ids))
+    return pg_cursor.rowcount
+
+
+def upsert_changed(sqlite_curs: sqlite3.Cursor,
+                   pg_cursor,
+                   conv: load_data.Convertor,
+                   batch_size: int,
+                   binary: bool = False,
+                   stats: Optional[metrics.TableStats] = None,
+                   row_filter: Optional[Callable[[tuple], bool]] = None,
+                   on_reject: Optional[Callable[[tuple, Exception], None]]
+                   = None,
+                   copy_reject: Optional[Callable[[tuple, Exception], None]]
+                   = None) -> int:
+    """Upsert rows changed after the table watermark.
+
+        Rows PostgreSQL refuses to copy are passed to 'copy_reject'.
+    """
+    stats = stats or metrics.TableStats(conv.psql_table)
+    old_mark = get_watermark(pg_cursor, conv.psql_table)
+    sqlite_curs.execute('SELECT MAX({changed}) FROM {table};'.format(
+        changed=conv.changed_at, table=conv.sqlite_table))
+    new_mark = sqlite_curs.fetchone()[0]
+    if new_mark is None or new_mark == old_mark:
+        return 0
+
+    if old_mark is None:
+        condition, params = '1', ()
+    else:
+        condition = '{changed} > ? AND {changed} <= ?'.format(
+            changed=conv.changed_at)
+        params = (old_mark, new_mark)
+    stage = _temp_name(conv, 'stage')
+    pg_cursor.execute(
+        'CREATE TEMP TABLE {stage} (LIKE {table} INCLUDING DEFAULTS) '
+        'ON COMMIT DROP;'.format(stage=stage, table=conv.psql_table))
+    pg_cursor.execute(parallel.add_keys_query(conv.psql_table, stage))
+    with metrics.copy_timer(stats):
+        encode = conv.layout.to_binary if binary else conv.layout.to_csv
+        batches = load_data.extract_batches(sqlite_curs, conv, encode,
+                                            batch_size, condition, params,
+                                            stats, row_filter, on_reject)
+        bisect_copy.copy_batches(pg_cursor, conv, batches, binary, stats,
+                                 copy_reject or (lambda entry, error: None),
+                                 target=stage)
+    pg_cursor.execute(
+        'INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} '
+        'ON CONFLICT (id) DO UPDATE SET {updates};'.format(
+            table=conv.psql_table,
+            columns=', '.join(conv.columns),
+            stage=stage,
+            updates=', '.join(
+                '{0} = EXCLUDED.{0}'.format(column)
+                for column in conv.columns if column != 'id')))
+    upserted = pg_cursor.rowcount
+    set_watermark(pg_cursor, conv.psql_table, new_mark)
+    return upserted
+
+
+def load_incremental(sqlite_curs: sqlite3.Cursor,
+                     pg_cursor,
+                     batch_size: int,
+                     binary: bool = False,
+                     collector: Optional[metrics.Collector] = None,
+                     quarantine: Optional[Quarantine] = None,
+                     deletions: bool = False) -> bool:
+    """Same contract as 'load_data.load_from_sqlite'.
+
+        Deleted SQLite rows are deleted from PostgreSQL only with
+        'deletions'.
+    """
+    collector = collector or metrics.Collector()
+    checker = references.ReferenceChecker(quarantine)
+    _ensure_state_table(pg_cursor)
+
+    def delete(conv: load_data.Convertor) -> int:
+        return delete_missing(sqlite_curs, pg_cursor, conv, batch_size,
+                              checker.on_reject(conv, 'id'))
+
+    def upsert(conv: load_data.Convertor) -> int:
+        stats = collector.table(conv.psql_table)
+        # Rows without an id are already quarantined by the deletion
+        skipped = set(checker.rejected(conv.sqlite_table))
+        id_index = conv.layout.sqlite_columns.index('id')
+        convert_reject = checker.on_reject(conv)
+
+        def on_reject(entry: Sequence, error: Exception):
+            if entry[id_index] not in skipped:
+                convert_reject(entry, error)
+
+        upserted = upsert_changed(
+            sqlite_curs, pg_cursor, conv, batch_size, binary, stats,
+            checker.row_filter(conv, stats), on_reject,
+            checker.on_reject(conv, 'copy'))
+        checker.collect(sqlite_curs, conv)
+        return upserted
+
+    # Children go first by deletion and last by insertion (foreign keys)
+    steps = []
+    if deletions:
+        steps += [(delete, conv, 'deleted from')
+                  for conv in reversed(load_data.CONVERTORS)]
+    steps += [(upsert, conv, 'upserted into')
+              for conv in load_data.CONVERTORS]
+    for step, conv, action in steps:
+        try:
+            count = step(conv)
+        except Exception as exp:
+            logger.error(f'Synchronization of {conv.psql_table} error: {exp}.')
+            return False
+        logger.info(f'{count} rows {action} {conv.psql_table}')
+    return True
@@ -1,76 +1,128 @@
+import asyncio
 from contextlib import contextmanager
 from dataclasses import dataclass
 import io
+import itertools
 import logging
 import os
 import sqlite3
-from typing import Callable, Union
+import time
+from typing import AnyStr, Callable, Iterator, List, Optional, Tuple
 
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2.extras import DictCursor
 
+import metrics
+import pgbinary
+from quarantine import Quarantine
+import sqlite_source
 import tables
-from tables import SqliteTables
-
-AnyTable = Union[
-    tables.FilmWork,
-    tables.Genre,
-    tables.Person,
-    tables.PersonFilmWork,
-    tables.GenreFilmWork
-]
 
 logging.basicConfig(format="%(asctime)s[%(name)s]: %(message)s", level="INFO")
 logger = logging.getLogger(__name__)
 
+DEFAULT_BATCH_SIZE = 1000
+# LOAD_MODE values, 'full' is the default one
+MODES = ('full', 'export', 'async', 'resumable', 'bulk', 'swap', 'swap-back',
+         'pipeline', 'incremental')
+
 
 @dataclass(frozen=True)
 class Convertor:
     sqlite_table: str
     psql_table: str
-    convert: Callable[[dict], AnyTable]
+    layout: tables.RowLayout
+    # PostgreSQL columns in order of the converted line
+    columns: Tuple[str, ...]
+    # SQLite tables, which have to be loaded before this one (foreign keys)
+    depends_on: Tuple[str, ...] = ()
+    # SQLite expression of the last row change time
+    changed_at: str = 'created_at'
 
 
-def load_from_sqlite(sqlite_curs: sqlite3.Cursor, pg_cursor):
-    convertors = (
-        Convertor(
-            sqlite_table='film_work',
-            psql_table='content.film_work',
-            convert=lambda data: tables.FilmWork.create_from_sqlite(
-                SqliteTables.FilmWork(**data))
-        ),
-        Convertor(
-            sqlite_table='genre',
-            psql_table='content.genre',
-            convert=lambda data: tables.Genre.create_from_sqlite(
-                SqliteTables.Genre(**data))
-        ),
-        Convertor(
-            sqlite_table='person',
-            psql_table='content.person',
-            convert=lambda data: tables.Person.create_from_sqlite(
-                SqliteTables.Person(**data))
-        ),
-        Convertor(
-            sqlite_table='genre_film_work',
-            psql_table='content.genre_film_work',
-            convert=lambda data: tables.GenreFilmWork.create_from_sqlite(
-                SqliteTables.GenreFilmWork(**data))
-        ),
-        Convertor(
-            sqlite_table='person_film_work',
-            psql_table='content.person_film_work',
-            convert=lambda data: tables.PersonFilmWork.create_from_sqlite(
-                SqliteTables.PersonFilmWork(**data))
-        ),
-    )
+CONVERTORS = (
+    Convertor(
+        sqlite_table='film_work',
+        psql_table='content.film_work',
+        layout=tables.FILM_WORK_LAYOUT,
+        columns=tables.FilmWork.COLUMNS,
+        changed_at='COALESCE(updated_at, created_at)'
+    ),
+    Convertor(
+        sqlite_table='genre',
+        psql_table='content.genre',
+        layout=tables.GENRE_LAYOUT,
+        columns=tables.Genre.COLUMNS,
+        changed_at='COALESCE(updated_at, created_at)'
+    ),
+    Convertor(
+        sqlite_table='person',
+        psql_table='content.person',
+        layout=tables.PERSON_LAYOUT,
+        columns=tables.Person.COLUMNS,
+        changed_at='COALESCE(updated_at, created_at)'
+    ),
+    Convertor(
+        sqlite_table='genre_film_work',
+        psql_table='content.genre_film_work',
+        layout=tables.GENRE_FILM_WORK_LAYOUT,
+        columns=tables.GenreFilmWork.COLUMNS,
+        depends_on=('film_work', 'genre')
+    ),
+    Convertor(
+        sqlite_table='person_film_work',
+        psql_table='content.person_film_work',
+        layout=tables.PERSON_FILM_WORK_LAYOUT,
+        columns=tables.PersonFilmWork.COLUMNS,
+        depends_on=('film_work', 'person')
+    ),
+)
+
+
+def get_convertor(sqlite_table: str) -> Convertor:
+    for conv in CONVERTORS:
+        if conv.sqlite_table == sqlite_table:
+            return conv
+    raise KeyError(sqlite_table)
+
+
+def load_from_sqlite(sqlite_curs: sqlite3.Cursor,
+                     pg_cursor,
+                     batch_size: int = DEFAULT_BATCH_SIZE,
+                     binary: bool = False,
+                     collector: Optional[metrics.Collector] = None,
+                     quarantine: Optional[Quarantine] = None,
+                     copy_batch_rows: Optional[int] = None):
+    """ Attention!
+
+        Rows PostgreSQL refuses to COPY are quarantined (see
+        'bisect_copy'), the other rows of the table are loaded.
+    """
+    # Built on top of this module
+    import bisect_copy
+    import references
+
+    collector = collector or metrics.Collector()
+    checker = references.ReferenceChecker(quarantine)
     result = True
-    for conv in convertors:
-        buff = io.StringIO()
-        buff = extract(sqlite_curs, conv.sqlite_table, conv.convert, buff)
+    for conv in CONVERTORS:
         try:
-            post(pg_cursor, buff, conv.psql_table)
+            with collector.profiled(conv.psql_table) as stats, \
+                    metrics.copy_timer(stats):
+                encode = (conv.layout.to_binary if binary
+                          else conv.layout.to_csv)
+                batches = extract_batches(
+                    sqlite_curs, conv, encode, batch_size, stats=stats,
+                    row_filter=checker.row_filter(conv, stats),
+                    on_reject=checker.on_reject(conv))
+                pg_cursor.execute('TRUNCATE TABLE {table} CASCADE;'.format(
+                    table=conv.psql_table))
+                bisect_copy.copy_batches(
+                    pg_cursor, conv, batches, binary, stats,
+                    checker.on_reject(conv, 'copy'),
+                    copy_batch_rows or bisect_copy.DEFAULT_BATCH_ROWS)
+            checker.collect(sqlite_curs, conv)
         except Exception as exp:
             logger.error(f'Insertion into {conv.psql_table} error: {exp}.')
             result = False
@@ -80,86 +132,403 @@ def load_from_sqlite(sqlite_curs: sqlite3.Cursor, pg_cursor):
     return result
 
 
-def extract(cursor: sqlite3.Cursor,
-            sqlite_table: str,
-            convertor: Callable[[dict], str],
-            out_stream: io.TextIOBase) -> io.TextIOBase:
-    cursor.execute('SELECT * FROM {table};'.format(table=sqlite_table))
-    for entry in cursor.fetchall():
-        try:
-            fw_line = str(convertor(dict(entry)))
-        except Exception as e:
-            logger.error(f'Can\'t convert entry({entry}): {e}')
-        else:
-            out_stream.write(fw_line)
-    return out_stream
+class StreamReader(io.IOBase):
+    """Read-only file object on top of a lines iterator.
+
+        'copy_expert' pulls data with 'read(size)', so only the lines
+        needed for the current chunk are kept in memory.
+    """
+
+    _empty = ''
+    _newline = '\n'
+
+    def __init__(self, lines: Iterator[AnyStr]):
+        super().__init__()
+        self._lines = lines
+        self._tail = self._empty
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> AnyStr:
+        chunks = [self._tail]
+        length = len(self._tail)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = self._empty.join(chunks)
+        if size < 0:
+            size = length
+        self._tail = data[size:]
+        return data[:size]
+
+    def readline(self, size: int = -1) -> AnyStr:
+        if not self._tail:
+            self._tail = next(self._lines, self._empty)
+        end = self._tail.find(self._newline) + 1 or len(self._tail)
+        if 0 <= size < end:
+            end = size
+        line, self._tail = self._tail[:end], self._tail[end:]
+        return line
 
 
-def extract_part(cursor: sqlite3.Cursor,
+class BytesStreamReader(StreamReader):
+    """'StreamReader' for binary chunks."""
+
+    _empty = b''
+    _newline = b'\n'
+
+
+def select_query(conv: Convertor, condition: str = '1') -> str:
+    """SQLite query of the columns 'conv.layout' converts."""
+    return 'SELECT {columns} FROM {table} WHERE {condition};'.format(
+        columns=', '.join(conv.layout.sqlite_columns),
+        table=conv.sqlite_table,
+        condition=condition)
+
+
+def extract_batches(cursor: sqlite3.Cursor,
+                    conv: Convertor,
+                    encode: Callable[[tuple], AnyStr],
+                    batch_size: int = DEFAULT_BATCH_SIZE,
+                    condition: str = '1',
+                    params: tuple = (),
+                    stats: Optional[metrics.TableStats] = None,
+                    row_filter: Optional[Callable[[tuple], bool]] = None,
+                    on_reject: Optional[Callable[[tuple, Exception], None]]
+                    = None) -> Iterator[Tuple[List[tuple], List[AnyStr]]]:
+    """Single pass conversion of plain SQLite tuples into COPY rows.
+
+        Yields the converted SQLite tuples of a batch and their lines.
+        A whole batch is converted before it's yielded, so the fetch and
+        conversion time in 'stats' excludes the consumer time. Rows
+        'row_filter' returns False for are skipped, rows which can't be
+        converted are passed to 'on_reject'.
+    """
+    stats = stats or metrics.TableStats(conv.psql_table)
+    cursor.row_factory = None
+    start = time.perf_counter()
+    cursor.execute(select_query(conv, condition), params)
+    while True:
+        entries = cursor.fetchmany(batch_size)
+        fetched = time.perf_counter()
+        stats.fetch_seconds += fetched - start
+        if not entries:
+            break
+        stats.rows_read += len(entries)
+        if row_filter:
+            entries = [entry for entry in entries if row_filter(entry)]
+        converted = []
+        lines = []
+        for entry in entries:
+            try:
+                lines.append(encode(entry))
+            except Exception as e:
+                stats.rows_rejected += 1
+                logger.error(f'Can\'t convert entry({entry}): {e}')
+                if on_reject:
+                    on_reject(entry, e)
+            else:
+                converted.append(entry)
+        stats.rows_converted += len(lines)
+        stats.bytes_sent += sum(map(len, lines))
+        stats.convert_seconds += time.perf_counter() - fetched
+        yield converted, lines
+        start = time.perf_counter()
+
+
+def extract_rows(cursor: sqlite3.Cursor,
+                 conv: Convertor,
+                 encode: Callable[[tuple], AnyStr],
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 condition: str = '1',
+                 params: tuple = (),
+                 stats: Optional[metrics.TableStats] = None,
+                 row_filter: Optional[Callable[[tuple], bool]] = None,
+                 on_reject: Optional[Callable[[tuple, Exception], None]] = None
+                 ) -> Iterator[AnyStr]:
+    """COPY rows of 'extract_batches'."""
+    for _, lines in extract_batches(cursor, conv, encode, batch_size,
+                                    condition, params, stats, row_filter,
+                                    on_reject):
+        yield from lines
+
+
+def table_stream(cursor: sqlite3.Cursor,
+                 conv: Convertor,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 binary: bool = False,
+                 condition: str = '1',
+                 params: tuple = (),
+                 stats: Optional[metrics.TableStats] = None,
+                 row_filter: Optional[Callable[[tuple], bool]] = None,
+                 on_reject: Optional[Callable[[tuple, Exception], None]] = None
+                 ) -> StreamReader:
+    """COPY data of a table in text(CSV) or binary format."""
+    if not binary:
+        return StreamReader(extract_rows(
+            cursor, conv, conv.layout.to_csv, batch_size, condition, params,
+            stats, row_filter, on_reject))
+    rows = extract_rows(
+        cursor, conv, conv.layout.to_binary, batch_size, condition, params,
+        stats, row_filter, on_reject)
+    return BytesStreamReader(
+        itertools.chain((pgbinary.HEADER,), rows, (pgbinary.TRAILER,)))
+
+
+def extract_part(cursor,
                  table_name: str,
                  limit: int,
-                 offset: int = 0) -> list:
+                 after=None,
+                 key: str = 'id',
+                 columns: Tuple[str, ...] = ()) -> list:
+    """Page of a table ordered by 'key', which follows the 'after' key.
+
+        Keyset pagination instead of 'OFFSET': every page is an index range
+        scan, not a rescan of all the previous rows. Works with SQLite and
+        PostgreSQL cursors (the only difference is the parameter style).
+        Only 'columns' are selected, if they are given.
+    """
+    # PostgreSQL has no 'WHERE 1'
+    where, params = '', ()
+    if after is not None:
+        mark = '?' if isinstance(cursor, sqlite3.Cursor) else '%s'
+        where = ' WHERE {key} > {mark}'.format(key=key, mark=mark)
+        params = (after,)
     cursor.execute(
-        'SELECT * FROM {table} LIMIT {limit} OFFSET {offset};'.format(
+        'SELECT {columns} FROM {table}{where} ORDER BY {key} '
+        'LIMIT {limit};'.format(
+            columns=', '.join(columns) if columns else '*',
             table=table_name,
-            limit=limit,
-            offset=offset
-        )
+            where=where,
+            key=key,
+            limit=limit
+        ),
+        params
     )
 
     return cursor.fetchall()
 
 
-def post(pg_cursor, csv: io.TextIOBase, postgres_name: str):
+def extract_pages(cursor,
+                  table_name: str,
+                  limit: int,
+                  key: str = 'id',
+                  columns: Tuple[str, ...] = ()) -> Iterator[list]:
+    """All the table pages of 'extract_part'."""
+    after = None
+    while True:
+        page = extract_part(cursor, table_name, limit, after, key, columns)
+        if page:
+            yield page
+        if len(page) < limit:
+            break
+        after = page[-1][key]
+
+
+def post(pg_cursor,
+         csv: io.IOBase,
+         postgres_name: str,
+         columns: Tuple[str, ...] = (),
+         binary: bool = False):
     pg_cursor.execute(
         'TRUNCATE TABLE {table} CASCADE;'.format(table=postgres_name))
-    csv.seek(0)
-    pg_cursor.copy_expert(
-        "COPY {table} FROM STDIN \
-        WITH CSV DELIMITER '{delim}' NULL '{null}' QUOTE '{quote}';".format(
-            table=postgres_name,
+    copy(pg_cursor, csv, postgres_name, columns, binary)
+
+
+def copy(pg_cursor,
+         csv: io.IOBase,
+         postgres_name: str,
+         columns: Tuple[str, ...] = (),
+         binary: bool = False):
+    if csv.seekable():
+        csv.seek(0)
+    if binary:
+        options = '(FORMAT binary)'
+    else:
+        options = "CSV DELIMITER '{delim}' NULL '{null}' QUOTE '{quote}'"
+        options = options.format(
             delim=tables.DELIMITER,
             null=tables.NULL_SYMBOL,
-            quote=tables.QUOTE_SYMBOL),
+            quote=tables.QUOTE_SYMBOL)
+    pg_cursor.copy_expert(
+        'COPY {table}{columns} FROM STDIN WITH {options};'.format(
+            table=postgres_name,
+            columns=' ({0})'.format(', '.join(columns)) if columns else '',
+            options=options),
         csv)
 
 
 @contextmanager
-def sqlite_conn_context(db_path: str):
+def sqlite_conn_context(db_path: str, check_same_thread: bool = True):
     """ Attention!
 
         We couldn't use 'sqlite3.PARSE_COLNAMES | sqlite3.PARSE_DECLTYPES'
         for connection, Our db contains wrong formatted datetime fields:
         e.g: 'filmwork' 6th row field 'updated_at'
     """
-    conn = sqlite3.connect(db_path)
+    conn = sqlite_source.connect(db_path,
+                                 check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
-    yield conn
-    conn.close()
+    try:
+        yield conn
+    finally:
+        conn.close()
 
 
-def main():
-    load_dotenv()
-    dsl = {
+def get_dsl() -> dict:
+    return {
         'dbname': os.environ.get('DB_NAME'),
         'user': os.environ.get('DB_USER'),
         'password': os.environ.get('DB_PASSWORD'),
         'host': os.environ.get('DB_HOST', '127.0.0.1'),
         'port': int(os.environ.get('DB_PORT', 5432)),
     }
+
+
+def main():
+    load_dotenv()
+    dsl = get_dsl()
     db_path = os.environ.get('SQL_LITE_DB_PATH', 'db.sqlite')
+    batch_size = int(os.environ.get('LOAD_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+    workers = int(os.environ.get('LOAD_WORKERS', 1))
+    mode = os.environ.get('LOAD_MODE', 'full')
+    if mode not in MODES:
+        logger.error(f'Unknown load mode {mode!r}, '
+                     f'expected one of: {", ".join(MODES)}')
+        return
+    binary = os.environ.get('LOAD_COPY_FORMAT', 'csv') == 'binary'
+    collector = metrics.Collector.from_env()
+    quarantine = Quarantine(os.environ.get('LOAD_QUARANTINE_PATH'))
     psycopg2.extras.register_uuid()
+    try:
+        if _load(mode, db_path, dsl, workers, batch_size, binary, collector,
+                 quarantine):
+            logger.info('Database coping finished successful')
+        else:
+            logger.error('Database coping failed, please check the errors '
+                         'above')
+    finally:
+        collector.emit(mode)
+        quarantine.report()
+        quarantine.close()
+
+
+def _load(mode: str,
+          db_path: str,
+          dsl: dict,
+          workers: int,
+          batch_size: int,
+          binary: bool,
+          collector: metrics.Collector,
+          quarantine: Quarantine) -> bool:
+    # Loader engines are built on top of this module
+    import bulk
+    import export
+    import incremental
+    import multisource
+    import parallel
+    import pipeline
+    import resumable
+    import swap
+
+    try:
+        sources = multisource.resolve(db_path)
+    except FileNotFoundError as exp:
+        logger.error(exp)
+        return False
+    if len(sources) > 1:
+        if mode != 'full':
+            logger.error(f'{mode} load of several sources isn\'t supported')
+            return False
+        with psycopg2.connect(**dsl) as pg_conn, \
+                pg_conn.cursor() as pg_cursor:
+            pg_cursor.execute('SET SESSION TIME ZONE "UTC";')
+            result = multisource.load_merged(
+                sources, pg_cursor,
+                workers if workers > 1 else len(sources),
+                batch_size, binary, collector, quarantine,
+                os.environ.get('LOAD_DEDUP_RULE', multisource.DEFAULT_RULE),
+                os.environ.get('LOAD_DEDUP_INDEX_DIR'))
+            if not result:
+                pg_conn.rollback()
+        return result
+    if sources:
+        db_path = sources[0]
+
+    if mode == 'export':
+        export_dir = os.environ.get('LOAD_EXPORT_DIR', 'export')
+        with sqlite_conn_context(db_path) as sqlite:
+            manifest = export.export_tables(
+                sqlite.cursor(), export_dir, batch_size, binary,
+                os.environ.get('LOAD_EXPORT_COMPRESSION',
+                               export.DEFAULT_COMPRESSION),
+                collector, quarantine)
+        logger.info(f'{len(manifest.tables)} tables exported into '
+                    f'{export_dir}')
+        return True
+
+    if mode == 'full' and workers > 1:
+        return parallel.load_parallel(db_path, dsl, workers, batch_size,
+                                      binary, collector, quarantine)
+    if mode == 'async':
+        # asyncpg is required by this engine only
+        import aioload
+        concurrency = workers if workers > 1 else len(CONVERTORS)
+        return asyncio.run(aioload.load_async(db_path, dsl, batch_size,
+                                              binary, collector, concurrency,
+                                              quarantine))
 
     with sqlite_conn_context(db_path) as sqlite, \
             psycopg2.connect(**dsl, cursor_factory=DictCursor) as pg_conn, \
             pg_conn.cursor() as pg_cursor:
         pg_cursor.execute('SET SESSION TIME ZONE "UTC";')
-        if not load_from_sqlite(sqlite.cursor(), pg_cursor):
-            pg_conn.rollback()
-            logger.error('There were some problems by tables. ' +
-                         'Please check the work result in your DB viewer')
+        if mode == 'resumable':
+            journal = resumable.ProgressJournal(
+                os.environ.get('LOAD_JOURNAL_PATH', db_path + '.journal'),
+                db_path)
+            chunk_rows = int(os.environ.get('LOAD_CHUNK_ROWS',
+                                            resumable.DEFAULT_CHUNK_ROWS))
+            return resumable.load_resumable(sqlite.cursor(), pg_conn,
+                                            journal, batch_size, binary,
+                                            chunk_rows, collector,
+                                            quarantine)
+        if mode == 'bulk':
+            return bulk.load_bulk(
+                sqlite.cursor(), pg_conn, dsl,
+                os.environ.get('LOAD_SCHEMA_SNAPSHOT_PATH',
+                               db_path + '.schema.json'),
+                workers, batch_size, binary, collector, quarantine,
+                os.environ.get('LOAD_MAINTENANCE_WORK_MEM',
+                               bulk.DEFAULT_MAINTENANCE_WORK_MEM))
+        if mode in ('swap', 'swap-back'):
+            lock_timeout = os.environ.get('LOAD_LOCK_TIMEOUT',
+                                          swap.DEFAULT_LOCK_TIMEOUT)
+            if mode == 'swap-back':
+                return swap.swap_back(pg_conn, lock_timeout)
+            return swap.load_swap(sqlite.cursor(), pg_conn, batch_size,
+                                  binary, collector, quarantine,
+                                  lock_timeout)
+        if mode == 'pipeline':
+            result = pipeline.load_pipelined(db_path, pg_cursor, workers,
+                                             batch_size, binary, collector,
+                                             quarantine)
+        elif mode == 'incremental':
+            result = incremental.load_incremental(
+                sqlite.cursor(), pg_cursor, batch_size, binary, collector,
+                quarantine,
+                os.environ.get('LOAD_DELETE_MISSING', '') == '1')
         else:
-            logger.info(f'Database coping finished successful')
+            copy_batch_rows = os.environ.get('LOAD_COPY_BATCH_ROWS')
+            result = load_from_sqlite(
+                sqlite.cursor(), pg_cursor, batch_size, binary, collector,
+                quarantine, copy_batch_rows and int(copy_batch_rows))
+        if not result:
+            pg_conn.rollback()
+        return result
 
 
 if __name__ == '__main__':
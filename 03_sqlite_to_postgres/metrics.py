@@ -0,0 +1,173 @@
+""" Loader instrumentation.
+
+Every table load collects rows read, converted and rejected, bytes sent
+to COPY and time spent in SQLite fetch, conversion and COPY. The stats
+are written as JSON lines and, optionally, as a Prometheus textfile (for
+node_exporter textfile collector). cProfile or tracemalloc may be turned
+on around every table load without any code patching.
+"""
+
+import cProfile
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+import json
+import os
+import time
+import tracemalloc
+from typing import Dict, Iterator, List, Optional
+
+PROFILERS = ('cprofile', 'tracemalloc')
+_PROMETHEUS_PREFIX = 'sqlite_to_postgres'
+_TRACEMALLOC_TOP = 25
+
+
+@dataclass
+class TableStats:
+    table: str
+    rows_read: int = 0
+    rows_converted: int = 0
+    rows_rejected: int = 0
+    # Link rows referencing rows, which are not loaded
+    rows_orphaned: int = 0
+    # Rows PostgreSQL refused to COPY
+    rows_failed: int = 0
+    # Characters for the text(CSV) format
+    bytes_sent: int = 0
+    fetch_seconds: float = 0
+    convert_seconds: float = 0
+    copy_seconds: float = 0
+    # tracemalloc profiling only
+    peak_memory_bytes: int = 0
+    # 1, if the table is loaded at the same time as other tables: their
+    # seconds overlap and don't add up to the load time
+    concurrent: int = 0
+
+    def add(self, other: 'TableStats'):
+        for name, value in asdict(other).items():
+            if name != 'table':
+                setattr(self, name, getattr(self, name) + value)
+
+
+@contextmanager
+def copy_timer(stats: TableStats) -> Iterator[None]:
+    """Time of a COPY call without the fetch and conversion inside it."""
+    before = stats.fetch_seconds + stats.convert_seconds
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    stats.copy_seconds += max(
+        elapsed - (stats.fetch_seconds + stats.convert_seconds - before), 0)
+
+
+class Collector:
+    """Stats of all tables of a load job and their outputs."""
+
+    def __init__(self,
+                 json_path: Optional[str] = None,
+                 prometheus_path: Optional[str] = None,
+                 profiler: Optional[str] = None,
+                 profile_dir: str = '.'):
+        if profiler and profiler not in PROFILERS:
+            raise ValueError(f'Unknown profiler {profiler!r}')
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self._tables: Dict[str, TableStats] = {}
+
+    @staticmethod
+    def from_env() -> 'Collector':
+        return Collector(
+            json_path=os.environ.get('LOAD_METRICS_PATH'),
+            prometheus_path=os.environ.get('LOAD_PROMETHEUS_PATH'),
+            profiler=os.environ.get('LOAD_PROFILE'),
+            profile_dir=os.environ.get('LOAD_PROFILE_DIR', '.'),
+        )
+
+    def table(self, name: str) -> TableStats:
+        return self._tables.setdefault(name, TableStats(name))
+
+    @property
+    def tables(self) -> List[TableStats]:
+        return list(self._tables.values())
+
+    @contextmanager
+    def profiled(self, name: str) -> Iterator[TableStats]:
+        """Stats of a table, profiled if a profiler is configured."""
+        stats = self.table(name)
+        with self._profiling(name, stats):
+            yield stats
+
+    @contextmanager
+    def profiled_run(self, name: str) -> Iterator[None]:
+        """Profile of a whole load, which tables share a process."""
+        with self._profiling(name):
+            yield
+
+    @contextmanager
+    def _profiling(self,
+                   name: str,
+                   stats: Optional[TableStats] = None) -> Iterator[None]:
+        if self.profiler == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                profile.dump_stats(self._profile_path(name, 'prof'))
+        elif self.profiler == 'tracemalloc':
+            tracemalloc.start()
+            try:
+                yield
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                if stats is not None:
+                    stats.peak_memory_bytes = max(stats.peak_memory_bytes,
+                                                  peak)
+                with open(self._profile_path(name, 'tracemalloc.txt'),
+                          'w') as report:
+                    for line in snapshot.statistics('lineno')[
+                            :_TRACEMALLOC_TOP]:
+                        report.write(f'{line}\n')
+        else:
+            yield
+
+    def _profile_path(self, name: str, extension: str) -> str:
+        return os.path.join(self.profile_dir, f'{name}.{extension}')
+
+    def emit(self, mode: str):
+        if self.json_path:
+            self.write_json_lines(self.json_path, mode)
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path, mode)
+
+    def write_json_lines(self, path: str, mode: str):
+        timestamp = datetime.now(timezone.utc).isoformat()
+        with open(path, 'a') as output:
+            for stats in self._tables.values():
+                output.write(json.dumps(
+                    {'timestamp': timestamp, 'mode': mode, **asdict(stats)}
+                ) + '\n')
+
+    def write_prometheus(self, path: str, mode: str):
+        lines = []
+        for field in TableStats.__dataclass_fields__:
+            if field == 'table':
+                continue
+            metric = f'{_PROMETHEUS_PREFIX}_{field}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.extend(
+                f'{metric}{{table="{stats.table}",mode="{mode}"}} '
+                f'{getattr(stats, field)}'
+                for stats in self._tables.values())
+        lines.append(f'{_PROMETHEUS_PREFIX}_last_run_timestamp_seconds '
+                     f'{time.time()}')
+        # The collector must never read a half written file
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as output:
+            output.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
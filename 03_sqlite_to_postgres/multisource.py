@@ -0,0 +1,270 @@
+""" Load of several SQLite sources (e.g. regional shards) as one database.
+
+The sources are given as a comma separated list of paths or globs. Rows
+with the same primary key are deduplicated by a rule:
+    'latest' - the latest 'changed_at' wins, a later source on a tie
+    'first' - the first source in the list wins
+    'last' - the last source in the list wins
+
+Primary keys are read by concurrent threads into a temporary on-disk
+SQLite index (a 'WITHOUT ROWID' table per loaded table), which keeps the
+winning source of every key, so the rows themselves are never kept in
+memory. Keys are compared in the canonical UUID text, rows with a missing
+or malformed id are copied from every source and quarantined by the
+conversion. Then each source is attached to the index in turn and its winning
+rows are copied into the table by 'bisect_copy', so the rows PostgreSQL
+refuses, e.g. the same genre name in two sources, are quarantined.
+Sources are opened read-only, a missing source or a glob without any
+matches is an error.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import glob
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+from typing import AnyStr, Callable, Iterator, List, Optional, Tuple
+
+import bisect_copy
+import load_data
+import metrics
+import parsers
+from quarantine import Quarantine
+import references
+import sqlite_source
+
+DEFAULT_RULE = 'latest'
+SOURCES_SEPARATOR = ','
+
+# UPSERT condition of a new key location to replace the kept one
+_RULES = {
+    'latest': '(excluded.changed_at, excluded.source) > '
+              '({table}.changed_at, {table}.source)',
+    'first': 'excluded.source < {table}.source',
+    'last': 'excluded.source > {table}.source',
+}
+_QUEUE_BATCHES = 4
+_QUEUE_TIMEOUT = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+def resolve(spec: str) -> List[str]:
+    """Paths of the sources, globs are expanded in sorted order.
+
+        Raises 'FileNotFoundError' for a glob without any matches.
+    """
+    paths = []
+    for pattern in spec.split(SOURCES_SEPARATOR):
+        pattern = pattern.strip()
+        if not pattern:
+            continue
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise FileNotFoundError(
+                    f'No SQLite sources match {pattern!r}')
+            paths += matches
+        else:
+            paths.append(pattern)
+    return paths
+
+
+def _changed_at(value: Optional[str]) -> str:
+    """Comparable UTC time, empty (the oldest) for missing or wrong ones."""
+    if not value:
+        return ''
+    try:
+        return parsers.parse_timestamp(value).isoformat()
+    except ValueError:
+        return ''
+
+
+def _canonical_id(value) -> Optional[str]:
+    """Canonical UUID text, None for missing or malformed ids."""
+    try:
+        return parsers.uuid_text(value)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _read_keys(path: str,
+               source: int,
+               batch_size: int,
+               batches: queue.Queue,
+               stop: threading.Event):
+    """Worker thread: (table, rows) batches of keys of a source.
+
+        Gives up, when 'stop' is set.
+    """
+    with closing(sqlite_source.connect(path)) as sqlite:
+        for conv in load_data.CONVERTORS:
+            cursor = sqlite.execute(
+                'SELECT id, {changed_at} FROM {table};'.format(
+                    changed_at=conv.changed_at, table=conv.sqlite_table))
+            for entries in iter(lambda: cursor.fetchmany(batch_size), []):
+                rows = []
+                for id_, changed_at in entries:
+                    id_ = _canonical_id(id_)
+                    if id_ is not None:
+                        rows.append((id_, source, _changed_at(changed_at)))
+                batch = (conv.sqlite_table, rows)
+                while True:
+                    if stop.is_set():
+                        return
+                    try:
+                        batches.put(batch, timeout=_QUEUE_TIMEOUT)
+                        break
+                    except queue.Full:
+                        continue
+
+
+class DedupIndex:
+    """Temporary SQLite database of the winning source of every key."""
+
+    def __init__(self, directory: Optional[str] = None,
+                 rule: str = DEFAULT_RULE):
+        if rule not in _RULES:
+            raise ValueError(f'Unknown dedup rule: {rule!r}')
+        self.rule = rule
+        handle, self.path = tempfile.mkstemp(
+            prefix='dedup-', suffix='.sqlite', dir=directory)
+        os.close(handle)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute('PRAGMA journal_mode = OFF;')
+        self._conn.execute('PRAGMA synchronous = OFF;')
+        for conv in load_data.CONVERTORS:
+            self._conn.execute(
+                'CREATE TABLE {table} (id TEXT PRIMARY KEY, '
+                'source INTEGER NOT NULL, changed_at TEXT NOT NULL) '
+                'WITHOUT ROWID;'.format(table=conv.sqlite_table))
+
+    def _upsert_query(self, table: str) -> str:
+        return (
+            'INSERT INTO {table} (id, source, changed_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET source = excluded.source, '
+            'changed_at = excluded.changed_at WHERE {rule};'.format(
+                table=table, rule=_RULES[self.rule].format(table=table)))
+
+    def build(self, sources: List[str], workers: int, batch_size: int):
+        """Read the keys of the sources in up to 'workers' threads.
+
+            The index is written by this thread only, readers are
+            throttled by a bounded queue.
+        """
+        workers = max(min(workers, len(sources)), 1)
+        batches = queue.Queue(maxsize=workers * _QUEUE_BATCHES)
+        stop = threading.Event()
+        queries = {conv.sqlite_table: self._upsert_query(conv.sqlite_table)
+                   for conv in load_data.CONVERTORS}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_read_keys, path, source, batch_size,
+                                   batches, stop)
+                       for source, path in enumerate(sources)]
+            try:
+                # No more batches can be put, when all readers are done
+                while not (all(future.done() for future in futures) and
+                           batches.empty()):
+                    try:
+                        table, rows = batches.get(timeout=_QUEUE_TIMEOUT)
+                    except queue.Empty:
+                        continue
+                    self._conn.executemany(queries[table], rows)
+            except BaseException:
+                # Readers blocked by the full queue must not be waited for
+                stop.set()
+                raise
+        for future in futures:
+            future.result()
+        self._conn.commit()
+        for conv in load_data.CONVERTORS:
+            self._conn.execute(
+                'CREATE INDEX {table}_source ON {table} (source, id);'.format(
+                    table=conv.sqlite_table))
+        self._conn.commit()
+
+    def cursor(self) -> sqlite3.Cursor:
+        return self._conn.cursor()
+
+    def close(self):
+        self._conn.close()
+        os.remove(self.path)
+
+    def __enter__(self) -> 'DedupIndex':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def merged_batches(sources: List[str],
+                   index: DedupIndex,
+                   conv: load_data.Convertor,
+                   batch_size: int = load_data.DEFAULT_BATCH_SIZE,
+                   binary: bool = False,
+                   stats: Optional[metrics.TableStats] = None,
+                   row_filter: Optional[Callable[[tuple], bool]] = None,
+                   on_reject: Optional[Callable[[tuple, Exception], None]]
+                   = None) -> Iterator[Tuple[List[tuple], List[AnyStr]]]:
+    """'load_data.extract_batches' of the winning rows of all sources."""
+    stats = stats or metrics.TableStats(conv.psql_table)
+    encode = conv.layout.to_binary if binary else conv.layout.to_csv
+    for source, path in enumerate(sources):
+        with closing(sqlite_source.connect(path)) as sqlite:
+            sqlite.create_function('canonical_id', 1, _canonical_id,
+                                   deterministic=True)
+            sqlite.execute('ATTACH DATABASE ? AS dedup;', (index.path,))
+            # Rows without a valid id are rejected by the conversion
+            yield from load_data.extract_batches(
+                sqlite.cursor(), conv, encode, batch_size,
+                'canonical_id(id) IS NULL OR canonical_id(id) IN '
+                '(SELECT id FROM dedup.{table} WHERE source = ?)'.format(
+                    table=conv.sqlite_table),
+                (source,), stats, row_filter, on_reject)
+
+
+def load_merged(sources: List[str],
+                pg_cursor,
+                workers: int,
+                batch_size: int,
+                binary: bool = False,
+                collector: Optional[metrics.Collector] = None,
+                quarantine: Optional[Quarantine] = None,
+                rule: str = DEFAULT_RULE,
+                index_dir: Optional[str] = None) -> bool:
+    """Same result as 'load_data.load_from_sqlite' of a merged source."""
+    collector = collector or metrics.Collector()
+    checker = references.ReferenceChecker(quarantine)
+    with DedupIndex(index_dir, rule) as index:
+        try:
+            index.build(sources, workers, batch_size)
+        except Exception as exp:
+            logger.error(f'Keys reading error: {exp}.')
+            return False
+        logger.info(f'Keys of {len(sources)} sources are deduplicated')
+        for conv in load_data.CONVERTORS:
+            try:
+                with collector.profiled(conv.psql_table) as stats, \
+                        metrics.copy_timer(stats):
+                    batches = merged_batches(
+                        sources, index, conv, batch_size, binary, stats,
+                        checker.row_filter(conv, stats),
+                        checker.on_reject(conv))
+                    pg_cursor.execute(
+                        'TRUNCATE TABLE {table} CASCADE;'.format(
+                            table=conv.psql_table))
+                    bisect_copy.copy_batches(
+                        pg_cursor, conv, batches, binary, stats,
+                        checker.on_reject(conv, 'copy'))
+                checker.collect(index.cursor(), conv)
+            except Exception as exp:
+                logger.error(
+                    f'Insertion into {conv.psql_table} error: {exp}.')
+                return False
+            logger.debug(f'{conv.sqlite_table} of {len(sources)} sources '
+                         f'copied into {conv.psql_table}')
+    return True
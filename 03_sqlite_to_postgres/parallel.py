@@ -0,0 +1,201 @@
+""" Parallel SQLite to PostgreSQL loader.
+
+Every table is extracted, converted and copied by its own worker process
+on its own connection into an UNLOGGED staging table. Link tables are
+scheduled only after the tables they reference are staged. When all the
+tables are staged, 'content' tables are replaced in a single transaction,
+so the whole job is still committed or rolled back as one unit.
+
+Every worker appends the rows it doesn't load to the same quarantine
+file. A link table worker drops the orphan rows: it reads the ids of the
+parent tables, except the ones the parent workers rejected. A staging
+table has the keys of its table, so rows PostgreSQL refuses, duplicates
+included, are isolated by 'bisect_copy' and quarantined as well.
+"""
+
+from collections import Counter
+from concurrent.futures import (FIRST_COMPLETED, Future,
+                                ProcessPoolExecutor, wait)
+from contextlib import closing
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+import psycopg2
+
+import bisect_copy
+import load_data
+import metrics
+from quarantine import Quarantine
+import references
+
+STAGING_SUFFIX = '__load'
+
+logger = logging.getLogger(__name__)
+
+
+def staging_name(psql_table: str) -> str:
+    return psql_table + STAGING_SUFFIX
+
+
+def add_keys_query(psql_table: str, target: str) -> str:
+    """Primary key and unique constraints of a table added to 'target'.
+
+        With the keys duplicates are refused by COPY into 'target', so
+        they are quarantined instead of failing the load later.
+    """
+    return (
+        'DO $$ DECLARE key text; BEGIN '
+        'FOR key IN SELECT pg_get_constraintdef(oid) FROM pg_constraint '
+        "WHERE conrelid = '{table}'::regclass AND contype IN ('p', 'u') "
+        "LOOP EXECUTE 'ALTER TABLE {target} ADD ' || key; "
+        'END LOOP; END $$;'.format(table=psql_table, target=target))
+
+
+def create_staging_query(conv: load_data.Convertor) -> str:
+    """Staging table with the primary key and unique constraints."""
+    return (
+        'DROP TABLE IF EXISTS {stage}; '
+        'CREATE UNLOGGED TABLE {stage} '
+        '(LIKE {table} INCLUDING DEFAULTS); '.format(
+            stage=staging_name(conv.psql_table), table=conv.psql_table) +
+        add_keys_query(conv.psql_table, staging_name(conv.psql_table)))
+
+
+def _stage_table(sqlite_path: str,
+                 dsl: dict,
+                 sqlite_table: str,
+                 batch_size: int,
+                 binary: bool,
+                 collector: metrics.Collector,
+                 quarantine_path: Optional[str],
+                 rejected: Dict[str, Set[str]]
+                 ) -> Tuple[metrics.TableStats, Counter, Set[str]]:
+    """Worker process: copy one SQLite table into its staging table.
+
+        'rejected' are the ids of the rejected rows of the parent tables.
+        Returns the table stats, the quarantine counts and the ids of the
+        rejected rows of the table.
+    """
+    conv = load_data.get_convertor(sqlite_table)
+    staging = staging_name(conv.psql_table)
+    with Quarantine(quarantine_path) as quarantine, \
+            load_data.sqlite_conn_context(sqlite_path) as sqlite, \
+            closing(psycopg2.connect(**dsl)) as pg_conn, \
+            pg_conn, pg_conn.cursor() as pg_cursor, \
+            collector.profiled(conv.psql_table) as stats:
+        stats.concurrent = 1
+        checker = references.ReferenceChecker(quarantine)
+        for parent in conv.depends_on:
+            checker.exclude(parent, rejected.get(parent, ()))
+            checker.collect(sqlite.cursor(), load_data.get_convertor(parent))
+        pg_cursor.execute('SET SESSION TIME ZONE "UTC";')
+        pg_cursor.execute(create_staging_query(conv))
+        with metrics.copy_timer(stats):
+            encode = conv.layout.to_binary if binary else conv.layout.to_csv
+            batches = load_data.extract_batches(
+                sqlite.cursor(), conv, encode, batch_size, stats=stats,
+                row_filter=checker.row_filter(conv, stats),
+                on_reject=checker.on_reject(conv))
+            bisect_copy.copy_batches(pg_cursor, conv, batches, binary, stats,
+                                     checker.on_reject(conv, 'copy'),
+                                     target=staging)
+    return stats, quarantine.counts, checker.rejected(conv.sqlite_table)
+
+
+def publish_queries() -> List[str]:
+    """Replacement of 'content' tables by the staged data."""
+    queries = ['TRUNCATE TABLE {tables} CASCADE;'.format(
+        tables=', '.join(conv.psql_table for conv in load_data.CONVERTORS))]
+    queries += [
+        'INSERT INTO {table} ({columns}) '
+        'SELECT {columns} FROM {stage};'.format(
+            table=conv.psql_table,
+            columns=', '.join(conv.columns),
+            stage=staging_name(conv.psql_table))
+        for conv in load_data.CONVERTORS]
+    return queries
+
+
+def drop_staging_queries() -> List[str]:
+    return ['DROP TABLE IF EXISTS {stage};'.format(
+        stage=staging_name(conv.psql_table))
+        for conv in load_data.CONVERTORS]
+
+
+def _publish(pg_cursor):
+    for query in publish_queries():
+        pg_cursor.execute(query)
+    logger.debug('Staged tables published')
+
+
+def _drop_staging(pg_cursor):
+    for query in drop_staging_queries():
+        pg_cursor.execute(query)
+
+
+def _stage_all(sqlite_path: str,
+               dsl: dict,
+               workers: int,
+               batch_size: int,
+               binary: bool,
+               collector: metrics.Collector,
+               quarantine: Quarantine) -> bool:
+    pending = {conv.sqlite_table: conv for conv in load_data.CONVERTORS}
+    staged: Set[str] = set()
+    rejected: Dict[str, Set[str]] = {}
+    running: Dict[Future, str] = {}
+    result = True
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while running or (pending and result):
+            ready = [conv for conv in pending.values()
+                     if set(conv.depends_on) <= staged] if result else []
+            for conv in ready:
+                del pending[conv.sqlite_table]
+                future = pool.submit(_stage_table, sqlite_path, dsl,
+                                     conv.sqlite_table, batch_size, binary,
+                                     collector, quarantine.path,
+                                     {parent: rejected.get(parent, set())
+                                      for parent in conv.depends_on})
+                running[future] = conv.sqlite_table
+            if not running:
+                logger.error(f'Unresolvable dependencies: {list(pending)}')
+                return False
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                sqlite_table = running.pop(future)
+                try:
+                    stats, counts, rejected_ids = future.result()
+                except Exception as exp:
+                    logger.error(f'Staging of {sqlite_table} error: {exp}.')
+                    result = False
+                else:
+                    collector.table(stats.table).add(stats)
+                    quarantine.counts.update(counts)
+                    rejected[sqlite_table] = rejected_ids
+                    staged.add(sqlite_table)
+                    logger.debug(f'{sqlite_table} staged')
+    return result
+
+
+def load_parallel(sqlite_path: str,
+                  dsl: dict,
+                  workers: int,
+                  batch_size: int,
+                  binary: bool = False,
+                  collector: Optional[metrics.Collector] = None,
+                  quarantine: Optional[Quarantine] = None) -> bool:
+    result = _stage_all(sqlite_path, dsl, workers, batch_size, binary,
+                        collector or metrics.Collector(),
+                        quarantine or Quarantine())
+    with closing(psycopg2.connect(**dsl)) as pg_conn:
+        try:
+            with pg_conn, pg_conn.cursor() as pg_cursor:
+                if result:
+                    _publish(pg_cursor)
+                _drop_staging(pg_cursor)
+        except Exception as exp:
+            logger.error(f'Publishing error: {exp}.')
+            result = False
+            with pg_conn, pg_conn.cursor() as pg_cursor:
+                _drop_staging(pg_cursor)
+    return result
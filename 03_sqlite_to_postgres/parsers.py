@@ -0,0 +1,84 @@
+""" Fast parsing of SQLite text values.
+
+SQLite keeps timestamps as text, e.g. '2021-06-16 20:14:09.221838+00'.
+'datetime.fromisoformat' parses this shape much faster than 'strptime',
+other (malformed) shapes fall back to a list of 'strptime' formats.
+Many rows share the same timestamps, so results are memoized.
+"""
+
+from datetime import datetime, timezone
+from functools import lru_cache
+import re
+from typing import Optional
+import uuid
+
+TIMESTAMPS_CACHE_SIZE = 1 << 16
+
+_DATE_LEN = len('YYYY-MM-DD')
+_FALLBACK_FORMATS = (
+    '%Y-%m-%d %H:%M:%S.%f%z',
+    '%Y-%m-%d %H:%M:%S%z',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M%z',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+)
+_UUID_RE = re.compile(
+    '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def _has_short_offset(line: str) -> bool:
+    """Ends with SQLite '+HH' offset after the time part."""
+    return len(line) > _DATE_LEN and line[-3] in {'+', '-'}
+
+
+def _to_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _parse_fallback(line: str) -> datetime:
+    # SQLite writes '+00' offsets, 'strptime' wants '+0000'
+    padded = line + '00' if _has_short_offset(line) else line
+    for fmt in _FALLBACK_FORMATS:
+        try:
+            return datetime.strptime(padded, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f'Unknown timestamp format: {line!r}')
+
+
+@lru_cache(maxsize=TIMESTAMPS_CACHE_SIZE)
+def _parse_timestamp(line: str) -> datetime:
+    # Python < 3.11 'fromisoformat' doesn't accept '+00' offsets
+    iso_line = line + ':00' if _has_short_offset(line) else line
+    try:
+        parsed = datetime.fromisoformat(iso_line)
+    except ValueError:
+        parsed = _parse_fallback(line.strip())
+    return _to_utc(parsed)
+
+
+def parse_timestamp(line: Optional[str]) -> Optional[datetime]:
+    """UTC datetime of a SQLite timestamp, None for empty values."""
+    if not line:
+        return None
+    return _parse_timestamp(line)
+
+
+def uuid_text(value: str) -> str:
+    """Validated canonical UUID string.
+
+        Canonical values are passed through as is, others are normalized
+        by 'uuid.UUID' (it raises 'ValueError' for wrong ones).
+    """
+    if _UUID_RE.fullmatch(value):
+        return value
+    return str(uuid.UUID(value))
+
+
+def uuid_bytes(value: str) -> bytes:
+    """16 bytes of a UUID string."""
+    return bytes.fromhex(uuid_text(value).replace('-', ''))
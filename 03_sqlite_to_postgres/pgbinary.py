@@ -0,0 +1,69 @@
+""" PostgreSQL binary COPY format encoder.
+
+See "Binary Format" section of the PostgreSQL 'COPY' documentation.
+Every field is its length (int32, -1 for NULL) followed by the value in
+the type binary representation, every tuple starts with fields count.
+"""
+
+from datetime import date, datetime, timezone
+import struct
+from typing import Iterable, Optional
+
+HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+TRAILER = struct.pack('!h', -1)
+
+_PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+_PG_EPOCH_DATE = _PG_EPOCH.date()
+_NULL = struct.pack('!i', -1)
+_FIELDS_COUNT = struct.Struct('!h')
+_UUID = struct.Struct('!i16s')
+_INT4 = struct.Struct('!ii')
+_INT8 = struct.Struct('!iq')
+_FLOAT8 = struct.Struct('!id')
+_LENGTH = struct.Struct('!i')
+_MICROSECONDS_PER_DAY = 86400 * 10 ** 6
+
+
+def encode_uuid_text(value: Optional[str]) -> bytes:
+    """Canonical UUID string, without building 'uuid.UUID' object."""
+    if value is None:
+        return _NULL
+    return _UUID.pack(16, bytes.fromhex(value.replace('-', '')))
+
+
+def encode_text(value: Optional[str]) -> bytes:
+    if value is None:
+        return _NULL
+    data = value.encode('utf-8')
+    return _LENGTH.pack(len(data)) + data
+
+
+def encode_timestamptz(value: Optional[datetime]) -> bytes:
+    """Microseconds since 2000-01-01 UTC (int64)."""
+    if value is None:
+        return _NULL
+    delta = value - _PG_EPOCH
+    return _INT8.pack(
+        8,
+        delta.days * _MICROSECONDS_PER_DAY +
+        delta.seconds * 10 ** 6 +
+        delta.microseconds)
+
+
+def encode_date(value: Optional[date]) -> bytes:
+    """Days since 2000-01-01 (int32)."""
+    if value is None:
+        return _NULL
+    return _INT4.pack(4, (value - _PG_EPOCH_DATE).days)
+
+
+def encode_float8(value: Optional[float]) -> bytes:
+    if value is None:
+        return _NULL
+    return _FLOAT8.pack(8, value)
+
+
+def encode_tuple(fields: Iterable[bytes]) -> bytes:
+    """Join already encoded fields into one tuple."""
+    fields = tuple(fields)
+    return _FIELDS_COUNT.pack(len(fields)) + b''.join(fields)
@@ -0,0 +1,275 @@
+""" Overlapped reader/converter/writer loader.
+
+For every table three stages run at the same time:
+    - a reader thread gets SQLite batches, which the process pool reads in
+      rowid ranges, into a bounded queue;
+    - a feeder thread sends the batches to a conversion process pool and
+      puts converted batches, in order, into another bounded queue;
+    - the converted batches are streamed into PostgreSQL by a single
+      COPY statement.
+Bounded queues (the batches queues and the in-flight conversions) keep
+memory flat, so the load time approaches the slowest stage instead of the
+sum of all of them. Orphan rows are dropped by the reader thread, they
+and the rows which can't be converted are quarantined.
+
+If PostgreSQL refuses some row, the COPY of the table is rolled back, and
+the table is read and converted again and copied by 'bisect_copy' batches,
+which isolate and quarantine the bad rows.
+"""
+
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import logging
+import queue
+import threading
+import time
+from typing import (Any, AnyStr, Callable, Iterator, List, Optional,
+                    Sequence, Tuple)
+
+import bisect_copy
+import load_data
+import metrics
+from quarantine import Quarantine
+import references
+import sqlite_source
+
+_QUEUE_TIMEOUT = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+def _convert_batch(sqlite_table: str,
+                   binary: bool,
+                   rows: list) -> Tuple[list, list, float]:
+    """Worker process: encode a batch of SQLite tuples.
+
+        Returns the COPY lines, (index, error message) of the rejected
+        rows and the conversion time.
+    """
+    start = time.perf_counter()
+    layout = load_data.get_convertor(sqlite_table).layout
+    encode = layout.to_binary if binary else layout.to_csv
+    lines = []
+    rejected = []
+    for index, entry in enumerate(rows):
+        try:
+            lines.append(encode(entry))
+        except Exception as e:
+            logger.error(f'Can\'t convert entry({entry}): {e}')
+            # Exceptions of any kind can't be always pickled
+            rejected.append((index, str(e)))
+    return lines, rejected, time.perf_counter() - start
+
+
+class _TablePipeline:
+    """Stages of a table load.
+
+        Every stage updates its own fields of 'stats'. The stages overlap,
+        so the COPY time is the wall time of the whole table load.
+    """
+
+    def __init__(self,
+                 sqlite_path: str,
+                 conv: load_data.Convertor,
+                 pool: Executor,
+                 max_inflight: int,
+                 batch_size: int,
+                 binary: bool,
+                 stats: metrics.TableStats,
+                 row_filter: Optional[Callable[[Sequence], bool]],
+                 on_reject: Callable[[Sequence, str], None]):
+        self._sqlite_path = sqlite_path
+        self._conv = conv
+        self._pool = pool
+        self._max_inflight = max_inflight
+        self._batch_size = batch_size
+        self._binary = binary
+        self._stats = stats
+        self._row_filter = row_filter
+        self._on_reject = on_reject
+        self._batches = queue.Queue(maxsize=max_inflight)
+        self._converted = queue.Queue(maxsize=max_inflight)
+        self._stop = threading.Event()
+        self._errors: List[Exception] = []
+
+    def _put(self, target: queue.Queue, batch: Optional[tuple]) -> bool:
+        while not self._stop.is_set():
+            try:
+                target.put(batch, timeout=_QUEUE_TIMEOUT)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def _get(self, source: queue.Queue) -> Optional[tuple]:
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=_QUEUE_TIMEOUT)
+            except queue.Empty:
+                continue
+        return None
+
+    def _read(self):
+        try:
+            # Batches are read in rowid ranges by the pool processes, the
+            # columns are in 'layout' order already
+            _, batches = sqlite_source.scan(
+                self._sqlite_path, self._conv.sqlite_table,
+                self._conv.layout.sqlite_columns, self._pool,
+                self._max_inflight, self._batch_size)
+            start = time.perf_counter()
+            for rows in batches:
+                self._stats.fetch_seconds += time.perf_counter() - start
+                self._stats.rows_read += len(rows)
+                if self._row_filter:
+                    rows = [entry for entry in rows
+                            if self._row_filter(entry)]
+                if not self._put(self._batches, rows):
+                    break
+                start = time.perf_counter()
+        except Exception as exp:
+            self._errors.append(exp)
+        finally:
+            self._put(self._batches, None)
+
+    def _feed(self):
+        inflight = deque()
+        try:
+            while True:
+                rows = self._get(self._batches)
+                if rows is None:
+                    break
+                inflight.append((rows, self._pool.submit(
+                    _convert_batch,
+                    self._conv.sqlite_table,
+                    self._binary,
+                    rows)))
+                if len(inflight) >= self._max_inflight:
+                    if not self._put(self._converted,
+                                     self._result(*inflight.popleft())):
+                        return
+            while inflight:
+                if not self._put(self._converted,
+                                 self._result(*inflight.popleft())):
+                    return
+        except Exception as exp:
+            self._errors.append(exp)
+            self._stop.set()
+        finally:
+            self._put(self._converted, None)
+
+    def _result(self,
+                rows: list,
+                future: Future) -> Tuple[List[tuple], List[AnyStr]]:
+        """Converted rows of a batch and their lines."""
+        lines, rejected, seconds = future.result()
+        self._stats.rows_converted += len(lines)
+        self._stats.rows_rejected += len(rejected)
+        self._stats.bytes_sent += sum(map(len, lines))
+        self._stats.convert_seconds += seconds
+        for index, error in rejected:
+            self._on_reject(rows[index], error)
+        if rejected:
+            indexes = {index for index, _ in rejected}
+            rows = [entry for index, entry in enumerate(rows)
+                    if index not in indexes]
+        return rows, lines
+
+    def _output(self) -> Iterator[Tuple[List[tuple], List[AnyStr]]]:
+        """Converted batches, which fail at the end on a stage error.
+
+            A truncated table must not be committed.
+        """
+        while True:
+            batch = self._get(self._converted)
+            if batch is None:
+                break
+            yield batch
+        if self._errors:
+            raise self._errors[0]
+
+    def run(self,
+            copy: Callable[[Iterator[Tuple[List[tuple], List[AnyStr]]]],
+                           Any]) -> Any:
+        """Result of 'copy' of the converted batches."""
+        stages = (
+            threading.Thread(target=self._read, daemon=True),
+            threading.Thread(target=self._feed, daemon=True),
+        )
+        for stage in stages:
+            stage.start()
+        start = time.perf_counter()
+        try:
+            return copy(self._output())
+        finally:
+            self._stats.copy_seconds += time.perf_counter() - start
+            self._stop.set()
+            for stage in stages:
+                stage.join()
+
+
+def _bisect(sqlite_path: str,
+            conv: load_data.Convertor,
+            pool: Executor,
+            max_inflight: int,
+            batch_size: int,
+            binary: bool,
+            stats: metrics.TableStats,
+            checker: references.ReferenceChecker,
+            pg_cursor):
+    """Copy a table again by batches, after its single COPY failed.
+
+        Orphans and conversion rejects are quarantined by the first pass
+        already, the rows read again are only counted in throwaway stats.
+    """
+    logger.warning(f'{conv.psql_table} is copied again by batches')
+    again = metrics.TableStats(conv.psql_table)
+    table = _TablePipeline(
+        sqlite_path, conv, pool, max_inflight, batch_size, binary, again,
+        checker.row_filter(conv, again, report=False),
+        lambda entry, error: None)
+    table.run(lambda batches: bisect_copy.copy_batches(
+        pg_cursor, conv, batches, binary, again,
+        checker.on_reject(conv, 'copy')))
+    stats.rows_failed += again.rows_failed
+    stats.copy_seconds += again.copy_seconds
+
+
+def load_pipelined(sqlite_path: str,
+                   pg_cursor,
+                   workers: int,
+                   batch_size: int,
+                   binary: bool = False,
+                   collector: Optional[metrics.Collector] = None,
+                   quarantine: Optional[Quarantine] = None) -> bool:
+    """Same contract as 'load_data.load_from_sqlite'."""
+    collector = collector or metrics.Collector()
+    checker = references.ReferenceChecker(quarantine)
+    pg_cursor.connection.set_client_encoding('UTF8')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Workers are forked at the first task: it must happen before the
+        # stage threads exist, a fork of a multithreaded process may hang.
+        pool.submit(int).result()
+        for conv in load_data.CONVERTORS:
+            try:
+                with collector.profiled(conv.psql_table) as stats:
+                    pg_cursor.execute('TRUNCATE TABLE {table} CASCADE;'.format(
+                        table=conv.psql_table))
+                    table = _TablePipeline(
+                        sqlite_path, conv, pool, workers * 2, batch_size,
+                        binary, stats, checker.row_filter(conv, stats),
+                        checker.on_reject(conv))
+                    copied = table.run(
+                        lambda batches: bisect_copy.copy_stream(
+                            pg_cursor, conv, batches, binary))
+                    if not copied:
+                        _bisect(sqlite_path, conv, pool, workers * 2,
+                                batch_size, binary, stats, checker,
+                                pg_cursor)
+                with load_data.sqlite_conn_context(sqlite_path) as sqlite:
+                    checker.collect(sqlite.cursor(), conv)
+            except Exception as exp:
+                logger.error(f'Insertion into {conv.psql_table} error: {exp}.')
+                return False
+            logger.debug(f'{conv.sqlite_table} copied into {conv.psql_table}')
+    return True
@@ -0,0 +1,92 @@
+""" Quarantine of rows, which are not loaded.
+
+Such rows are appended to a JSON lines file with the table, the reason and
+the original SQLite values, so they can be inspected and fixed by hand.
+Without a file the rows are only counted. Rows can be added by several
+threads, and several processes can append to the same file.
+"""
+
+from collections import Counter
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import threading
+from typing import Iterator, Optional, Sequence, TextIO
+
+logger = logging.getLogger(__name__)
+
+
+def read(path: str) -> Iterator[dict]:
+    """Entries of a quarantine file, none if there is no file."""
+    try:
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    except FileNotFoundError:
+        return
+
+
+class Quarantine:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        # (table, reason): rows
+        self.counts = Counter()
+        self._file: Optional[TextIO] = None
+        self._lock = threading.Lock()
+
+    def add(self,
+            table: str,
+            reason: str,
+            row: Sequence,
+            error: str = ''):
+        line = json.dumps({
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'table': table,
+            'reason': reason,
+            'row': list(row),
+            'error': error,
+        }, default=str) + '\n'
+        with self._lock:
+            self.counts[(table, reason)] += 1
+            if not self.path:
+                return
+            if self._file is None:
+                # Whole lines are appended, several processes may share
+                # the file
+                self._file = open(self.path, 'a', buffering=1)
+            self._file.write(line)
+
+    def size(self) -> int:
+        """Size of the file, e.g. a checkpoint to truncate it back to."""
+        with self._lock:
+            if not self.path or not os.path.exists(self.path):
+                return 0
+            return os.path.getsize(self.path)
+
+    def truncate(self, size: int):
+        """Drop the rows added after the 'size' checkpoint."""
+        with self._lock:
+            if (self.path and os.path.exists(self.path) and
+                    os.path.getsize(self.path) > size):
+                # Appends of an open file go to the new end
+                os.truncate(self.path, size)
+
+    def report(self):
+        for (table, reason), count in sorted(self.counts.items()):
+            logger.warning(f'{count} {table} rows are not loaded: {reason}')
+        if self.counts and self.path:
+            logger.warning(f'Not loaded rows are saved to {self.path}')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> 'Quarantine':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,180 @@
+""" Referential pre-validation of link tables.
+
+Primary keys of the loaded parent tables are kept as sorted packed 16-byte
+UUIDs in a single 'bytearray' (about 16 bytes per id instead of about
+90 bytes of a 'str' in a 'set'), and membership is a binary search. Link
+rows, which reference a missing or rejected parent row, are dropped from
+the COPY stream and quarantined instead of failing the whole COPY.
+
+Attention!
+    A foreign key column is named after the referenced table:
+    'film_work' is referenced by 'film_work_id'.
+"""
+
+from bisect import bisect_left
+import logging
+import sqlite3
+from typing import Callable, Dict, Iterable, Optional, Sequence, Set
+
+import load_data
+import metrics
+from parsers import uuid_bytes
+from quarantine import Quarantine
+
+UUID_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+
+class _PackedKeys:
+    """'bisect' view of the packed ids."""
+
+    def __init__(self, data: bytearray):
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._data) // UUID_SIZE
+
+    def __getitem__(self, index: int) -> bytes:
+        start = index * UUID_SIZE
+        return bytes(self._data[start:start + UUID_SIZE])
+
+
+class IdSet:
+    """Sorted set of packed UUIDs.
+
+        Ids are expected in order (so they are just appended), an id out
+        of order makes the set sorted once at the first lookup.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._keys = _PackedKeys(self._data)
+        self._last = b''
+        self._sorted = True
+
+    def add(self, value: bytes):
+        if value < self._last:
+            self._sorted = False
+        self._last = value
+        self._data += value
+
+    def _sort(self):
+        keys = sorted({self._keys[index] for index in range(len(self))})
+        self._data[:] = b''.join(keys)
+        self._sorted = True
+
+    def __contains__(self, value: bytes) -> bool:
+        if not self._sorted:
+            self._sort()
+        index = bisect_left(self._keys, value)
+        return index < len(self._keys) and self._keys[index] == value
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class ReferenceChecker:
+    """Loaded ids of parent tables and orphan filters of link tables."""
+
+    def __init__(self, quarantine: Optional[Quarantine] = None):
+        self._quarantine = quarantine or Quarantine()
+        self._ids: Dict[str, IdSet] = {}
+        self._rejected: Dict[str, Set[str]] = {}
+
+    def on_reject(self,
+                  conv: load_data.Convertor,
+                  reason: str = 'conversion'
+                  ) -> Callable[[Sequence, Exception], None]:
+        """Hook of rejected rows: they are not loaded."""
+        id_index = conv.layout.sqlite_columns.index('id')
+        rejected = self._rejected.setdefault(conv.sqlite_table, set())
+
+        def reject(entry: Sequence, error: Exception):
+            rejected.add(entry[id_index])
+            self._quarantine.add(conv.psql_table, reason, entry,
+                                 str(error).strip())
+        return reject
+
+    def rejected(self, sqlite_table: str) -> Set[str]:
+        """Ids of the rejected rows of a table."""
+        return self._rejected.get(sqlite_table, set())
+
+    def exclude(self, sqlite_table: str, ids: Iterable[str]):
+        """Treat rows as rejected, e.g. by another worker process."""
+        self._rejected.setdefault(sqlite_table, set()).update(ids)
+
+    def collect(self, sqlite_curs: sqlite3.Cursor, conv: load_data.Convertor):
+        """Keep the ids of a loaded table, if some table references it."""
+        if not any(conv.sqlite_table in other.depends_on
+                   for other in load_data.CONVERTORS):
+            return
+        rejected = self._rejected.get(conv.sqlite_table, set())
+        ids = IdSet()
+        sqlite_curs.execute('SELECT id FROM {table} ORDER BY id;'.format(
+            table=conv.sqlite_table))
+        for entries in iter(lambda: sqlite_curs.fetchmany(
+                load_data.DEFAULT_BATCH_SIZE), []):
+            for (id_,) in entries:
+                if id_ in rejected:
+                    continue
+                try:
+                    ids.add(uuid_bytes(id_))
+                except (AttributeError, TypeError, ValueError):
+                    continue
+        self._ids[conv.sqlite_table] = ids
+        logger.debug(f'{len(ids)} {conv.sqlite_table} ids collected')
+
+    def collect_loaded(self, pg_conn, conv: load_data.Convertor):
+        """Keep the ids of a table from PostgreSQL, e.g. of rows loaded
+        by an earlier run, which rejects aren't known."""
+        if not any(conv.sqlite_table in other.depends_on
+                   for other in load_data.CONVERTORS):
+            return
+        ids = IdSet()
+        with pg_conn.cursor(name='loaded_ids') as pg_cursor:
+            pg_cursor.execute(
+                'SELECT id::text FROM {table} ORDER BY id;'.format(
+                    table=conv.psql_table))
+            for entries in iter(lambda: pg_cursor.fetchmany(
+                    load_data.DEFAULT_BATCH_SIZE), []):
+                for (id_,) in entries:
+                    ids.add(uuid_bytes(id_))
+        self._ids[conv.sqlite_table] = ids
+        logger.debug(f'{len(ids)} loaded {conv.sqlite_table} ids collected')
+
+    def row_filter(self,
+                   conv: load_data.Convertor,
+                   stats: metrics.TableStats,
+                   report: bool = True
+                   ) -> Optional[Callable[[Sequence], bool]]:
+        """Predicate of the rows, which reference loaded rows only.
+
+            Without 'report' orphans are not quarantined, e.g. when the
+            same rows are filtered again.
+        """
+        references = [
+            (conv.layout.sqlite_columns.index(f'{parent}_id'),
+             self._ids[parent])
+            for parent in conv.depends_on if parent in self._ids]
+        if not references:
+            return None
+
+        def accept(entry: Sequence) -> bool:
+            for index, ids in references:
+                try:
+                    found = uuid_bytes(entry[index]) in ids
+                except (AttributeError, TypeError, ValueError):
+                    found = False
+                if not found:
+                    stats.rows_orphaned += 1
+                    if not report:
+                        return False
+                    self._quarantine.add(
+                        conv.psql_table, 'orphan', entry,
+                        'no {column} {value}'.format(
+                            column=conv.layout.sqlite_columns[index],
+                            value=entry[index]))
+                    return False
+            return True
+        return accept
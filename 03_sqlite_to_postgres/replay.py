@@ -0,0 +1,75 @@
+""" Load of exported COPY files into PostgreSQL.
+
+The files written by the 'export' load mode are streamed into COPY as
+they are, without SQLite and any conversion, so the same export can be
+loaded into staging, CI and production databases. All tables are
+replaced in a single transaction, which is rolled back if a file doesn't
+match its manifest checksum or row count.
+
+Run from the loader folder, with the database settings of 'load_data.py':
+    python replay.py export
+    python replay.py --check-only export
+"""
+
+import argparse
+from contextlib import closing
+import logging
+import sys
+
+from dotenv import load_dotenv
+import psycopg2
+
+import export
+import load_data
+
+logger = logging.getLogger(__name__)
+
+
+def replay(export_dir: str, pg_conn) -> bool:
+    manifest = export.Manifest.load(export_dir)
+    try:
+        with pg_conn.cursor() as pg_cursor:
+            pg_cursor.execute('SET SESSION TIME ZONE "UTC";')
+            for table in manifest.tables:
+                with closing(export.open_table(export_dir, manifest,
+                                               table)) as reader:
+                    load_data.post(pg_cursor, reader, table.table,
+                                   table.columns, manifest.binary)
+                    export.check(reader, table)
+                if pg_cursor.rowcount >= 0 and \
+                        pg_cursor.rowcount != table.rows:
+                    raise ValueError(
+                        f'{table.file}: {pg_cursor.rowcount} rows are '
+                        f'loaded, {table.rows} are expected')
+                logger.debug(f'{table.file} copied into {table.table}')
+        pg_conn.commit()
+    except Exception as exp:
+        logger.error(f'Replay of {export_dir} error: {exp}.')
+        pg_conn.rollback()
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0].strip())
+    parser.add_argument('export_dir', help='folder with manifest.json')
+    parser.add_argument('--check-only', action='store_true',
+                        help='check the file checksums without a database')
+    args = parser.parse_args()
+
+    if args.check_only:
+        result = export.verify_files(args.export_dir)
+    else:
+        load_dotenv()
+        with closing(psycopg2.connect(**load_data.get_dsl())) as pg_conn:
+            result = replay(args.export_dir, pg_conn)
+    if result and args.check_only:
+        logger.info(f'{args.export_dir} files match the manifest')
+    elif result:
+        logger.info(f'{args.export_dir} replay finished successful')
+    sys.exit(0 if result else 1)
+
+
+if __name__ == '__main__':
+    main()
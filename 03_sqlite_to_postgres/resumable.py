@@ -0,0 +1,221 @@
+""" Checkpointed, resumable loading.
+
+Tables are copied in chunks of SQLite rowid ranges and every chunk is
+committed separately. The progress is kept in a JSON journal next to the
+SQLite file, so a restarted job continues from the last checkpoint
+instead of starting from scratch. The journal is removed when the job is
+finished, and it is reset when the SQLite file has been changed.
+
+A chunk is marked 'pending' in the journal before its commit. If the job
+dies between the commit and the journal update, the chunk rows are
+deleted by ids and the chunk is copied again. Rows PostgreSQL refuses are
+isolated by 'bisect_copy' and quarantined with the orphan and conversion
+rejects, the other rows of the chunk are committed. Every checkpoint keeps
+the size of the quarantine file, a restarted job truncates the file back
+to it, so the rows of a chunk copied again aren't quarantined twice.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from typing import List, Optional
+
+import bisect_copy
+import load_data
+import metrics
+import parsers
+from quarantine import Quarantine
+import references
+
+DEFAULT_CHUNK_ROWS = 100_000
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressJournal:
+    """Committed rowid ranges of every table."""
+
+    def __init__(self, path: str, sqlite_path: str):
+        self.path = path
+        stat = os.stat(sqlite_path)
+        self._source = {
+            'path': os.path.abspath(sqlite_path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+        self._tables = {}
+        # Quarantine file path and size at the last checkpoint
+        self.quarantine: Optional[dict] = None
+        self.resumed = False
+        if os.path.exists(path):
+            with open(path) as journal_file:
+                state = json.load(journal_file)
+            if state.get('source') == self._source:
+                self._tables = state['tables']
+                self.quarantine = state.get('quarantine')
+                self.resumed = True
+            else:
+                logger.warning(f'{sqlite_path} has been changed, '
+                               f'journal {path} is ignored')
+
+    def table(self, sqlite_table: str) -> dict:
+        return self._tables.setdefault(
+            sqlite_table, {'rowid': 0, 'pending': None, 'done': False})
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as journal_file:
+            json.dump({'source': self._source, 'tables': self._tables,
+                       'quarantine': self.quarantine},
+                      journal_file)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def checkpoint(self, quarantine: Quarantine):
+        """Save the progress along with the quarantine file size."""
+        if quarantine.path:
+            self.quarantine = {'path': os.path.abspath(quarantine.path),
+                               'size': quarantine.size()}
+        self.save()
+
+    def rewind(self, quarantine: Quarantine):
+        """Drop the quarantined rows after the last checkpoint."""
+        if (self.quarantine and quarantine.path and
+                os.path.abspath(quarantine.path) == self.quarantine['path']):
+            quarantine.truncate(self.quarantine['size'])
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _chunk_end(sqlite_curs: sqlite3.Cursor,
+               sqlite_table: str,
+               start: int,
+               chunk_rows: int) -> Optional[int]:
+    sqlite_curs.execute(
+        'SELECT MAX(rowid) FROM (SELECT rowid FROM {table} WHERE rowid > ? '
+        'ORDER BY rowid LIMIT ?);'.format(table=sqlite_table),
+        (start, chunk_rows))
+    return sqlite_curs.fetchone()[0]
+
+
+def _chunk_ids(sqlite_curs: sqlite3.Cursor,
+               sqlite_table: str,
+               start: int,
+               end: int) -> List[str]:
+    sqlite_curs.execute(
+        'SELECT id FROM {table} WHERE rowid > ? AND rowid <= ?;'.format(
+            table=sqlite_table),
+        (start, end))
+    ids = []
+    for entry in sqlite_curs.fetchall():
+        try:
+            ids.append(parsers.uuid_text(entry[0]))
+        except (AttributeError, ValueError):
+            continue
+    return ids
+
+
+def _undo_pending(sqlite_curs: sqlite3.Cursor,
+                  pg_conn,
+                  conv: load_data.Convertor,
+                  pending: dict):
+    ids = _chunk_ids(sqlite_curs, conv.sqlite_table,
+                     pending['start'], pending['end'])
+    with pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute(
+            'DELETE FROM {table} WHERE id = ANY(%s::uuid[]);'.format(
+                table=conv.psql_table),
+            (ids,))
+    pg_conn.commit()
+
+
+def _truncate_all(pg_conn):
+    with pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute('TRUNCATE TABLE {tables} CASCADE;'.format(
+            tables=', '.join(conv.psql_table
+                             for conv in load_data.CONVERTORS)))
+    pg_conn.commit()
+
+
+def _load_table(sqlite_curs: sqlite3.Cursor,
+                pg_conn,
+                conv: load_data.Convertor,
+                journal: ProgressJournal,
+                batch_size: int,
+                binary: bool,
+                chunk_rows: int,
+                stats: metrics.TableStats,
+                checker: references.ReferenceChecker,
+                quarantine: Quarantine):
+    progress = journal.table(conv.sqlite_table)
+    if progress['pending']:
+        logger.info(f'Redo of the last {conv.sqlite_table} chunk')
+        _undo_pending(sqlite_curs, pg_conn, conv, progress['pending'])
+        progress['pending'] = None
+        journal.save()
+    encode = conv.layout.to_binary if binary else conv.layout.to_csv
+    row_filter = checker.row_filter(conv, stats)
+    while True:
+        start = progress['rowid']
+        end = _chunk_end(sqlite_curs, conv.sqlite_table, start, chunk_rows)
+        if end is None:
+            break
+        with pg_conn.cursor() as pg_cursor, metrics.copy_timer(stats):
+            batches = load_data.extract_batches(
+                sqlite_curs, conv, encode, batch_size,
+                'rowid > ? AND rowid <= ?', (start, end), stats,
+                row_filter, checker.on_reject(conv))
+            bisect_copy.copy_batches(pg_cursor, conv, batches, binary, stats,
+                                     checker.on_reject(conv, 'copy'))
+        progress['pending'] = {'start': start, 'end': end}
+        journal.save()
+        pg_conn.commit()
+        progress['rowid'] = end
+        progress['pending'] = None
+        journal.checkpoint(quarantine)
+        logger.debug(f'{conv.sqlite_table} rows up to rowid {end} committed')
+    progress['done'] = True
+    journal.checkpoint(quarantine)
+
+
+def load_resumable(sqlite_curs: sqlite3.Cursor,
+                   pg_conn,
+                   journal: ProgressJournal,
+                   batch_size: int,
+                   binary: bool = False,
+                   chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                   collector: Optional[metrics.Collector] = None,
+                   quarantine: Optional[Quarantine] = None) -> bool:
+    """Load all tables, continuing from the journal checkpoint."""
+    collector = collector or metrics.Collector()
+    quarantine = quarantine or Quarantine()
+    checker = references.ReferenceChecker(quarantine)
+    if journal.resumed:
+        logger.info(f'Resuming the load from {journal.path}')
+        journal.rewind(quarantine)
+    else:
+        _truncate_all(pg_conn)
+        journal.checkpoint(quarantine)
+    # Ids are collected from PostgreSQL: rejects of the chunks loaded by
+    # an earlier run aren't known
+    for conv in load_data.CONVERTORS:
+        if journal.table(conv.sqlite_table)['done']:
+            checker.collect_loaded(pg_conn, conv)
+            continue
+        try:
+            with collector.profiled(conv.psql_table) as stats:
+                _load_table(sqlite_curs, pg_conn, conv, journal,
+                            batch_size, binary, chunk_rows, stats, checker,
+                            quarantine)
+            checker.collect_loaded(pg_conn, conv)
+        except Exception as exp:
+            logger.error(f'Insertion into {conv.psql_table} error: {exp}. '
+                         f'Restart to continue from the last checkpoint.')
+            pg_conn.rollback()
+            return False
+    journal.remove()
+    return True
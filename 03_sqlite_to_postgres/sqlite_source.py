@@ -0,0 +1,127 @@
+""" Read-optimised SQLite source.
+
+The database is opened by a read-only ('mode=ro') URI, a large
+'mmap_size' and page cache let SQLite read pages without a syscall per
+page. Sharded readers opt in to an 'immutable' URI as well: SQLite takes
+no locks and doesn't check the file for changes. A table is split into
+ranges of rowids, which several reader processes scan at the same time,
+so extraction isn't bound to a single core. Batches are plain tuples,
+a column map gives the index of every column in them.
+
+Attention!
+    An immutable database must not be changed while it's read: SQLite
+    ignores its write-ahead log and may return wrong results otherwise.
+"""
+
+from collections import deque
+from concurrent.futures import Executor
+from contextlib import closing
+from dataclasses import dataclass
+from functools import lru_cache
+import os
+import sqlite3
+from typing import Dict, Iterator, List, Sequence, Tuple
+from urllib.parse import quote
+
+DEFAULT_MMAP_SIZE = 1 << 30
+# KiB
+DEFAULT_CACHE_SIZE = 1 << 18
+
+ColumnMap = Dict[str, int]
+
+
+def connect(path: str,
+            immutable: bool = False,
+            mmap_size: int = DEFAULT_MMAP_SIZE,
+            cache_size: int = DEFAULT_CACHE_SIZE,
+            check_same_thread: bool = True) -> sqlite3.Connection:
+    """Read-only connection to a database file.
+
+        An 'immutable' connection doesn't see concurrent changes and
+        changes kept in the write-ahead log.
+    """
+    if not os.path.exists(path):
+        # SQLite reports a missing file with an obscure error
+        raise FileNotFoundError(f'No SQLite database {path!r}')
+    conn = sqlite3.connect(
+        'file:{path}?mode=ro{immutable}'.format(
+            path=quote(os.path.abspath(path)),
+            immutable='&immutable=1' if immutable else ''),
+        uri=True, check_same_thread=check_same_thread)
+    conn.execute('PRAGMA mmap_size = {0};'.format(int(mmap_size)))
+    # A negative size is in KiB instead of pages
+    conn.execute('PRAGMA cache_size = -{0};'.format(int(cache_size)))
+    return conn
+
+
+@lru_cache(maxsize=8)
+def _connection(path: str) -> sqlite3.Connection:
+    """Reader process: a connection is opened once and reused."""
+    return connect(path, immutable=True, check_same_thread=False)
+
+
+@dataclass(frozen=True)
+class Shard:
+    """Rowids range of a table, both ends are included."""
+
+    path: str
+    table: str
+    first: int
+    last: int
+
+
+def column_map(columns: Sequence[str]) -> ColumnMap:
+    return {column: index for index, column in enumerate(columns)}
+
+
+def shards(conn: sqlite3.Connection,
+           path: str,
+           table: str,
+           shard_rows: int) -> List[Shard]:
+    """Ranges of about 'shard_rows' rows, rowids are assumed to be dense."""
+    first, last, count = conn.execute(
+        'SELECT min(rowid), max(rowid), count(*) FROM {table};'.format(
+            table=table)).fetchone()
+    if not count:
+        return []
+    span = max((last - first + 1) * shard_rows // count, 1)
+    return [Shard(path, table, start, min(start + span - 1, last))
+            for start in range(first, last + 1, span)]
+
+
+def read_shard(shard: Shard, columns: Tuple[str, ...]) -> List[tuple]:
+    """Reader process: rows of a shard in rowid order."""
+    return _connection(shard.path).execute(
+        'SELECT {columns} FROM {table} WHERE rowid BETWEEN ? AND ? '
+        'ORDER BY rowid;'.format(columns=', '.join(columns),
+                                 table=shard.table),
+        (shard.first, shard.last)).fetchall()
+
+
+def scan(path: str,
+         table: str,
+         columns: Tuple[str, ...],
+         pool: Executor,
+         max_inflight: int,
+         shard_rows: int) -> Tuple[ColumnMap, Iterator[List[tuple]]]:
+    """Column map and batches of a table, read by 'pool' processes.
+
+        Batches come in rowid order, at most 'max_inflight' shards are read
+        ahead of the consumer.
+    """
+    with closing(connect(path, immutable=True)) as conn:
+        table_shards = shards(conn, path, table, shard_rows)
+
+    def batches() -> Iterator[List[tuple]]:
+        inflight = deque()
+        try:
+            for shard in table_shards:
+                inflight.append(pool.submit(read_shard, shard, columns))
+                if len(inflight) >= max_inflight:
+                    yield inflight.popleft().result()
+            while inflight:
+                yield inflight.popleft().result()
+        finally:
+            for future in inflight:
+                future.cancel()
+    return column_map(columns), batches()
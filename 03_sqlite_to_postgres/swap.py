@@ -0,0 +1,271 @@
+""" Zero-downtime reload with an atomic swap.
+
+The data is copied into UNLOGGED shadow copies ('__new') of the content
+tables, while the live tables keep serving reads and writes. Every shadow
+gets the triggers, primary key and unique constraints of its live table
+before COPY, so rows PostgreSQL refuses are isolated by 'bisect_copy' and
+quarantined, and the other indexes after it. Then the shadows are set
+LOGGED, get their foreign keys and are swapped in by renames in a single
+short transaction with a 'lock_timeout', which is retried if the locks
+can't be taken in time. The replaced tables are kept ('__old') until the
+next reload, so 'swap_back' returns them back at once.
+
+Attention!
+    Foreign keys of other tables, which reference the content tables,
+    follow the renamed tables to '__old'.
+"""
+
+import logging
+import re
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+
+import psycopg2
+import psycopg2.errors
+
+import bisect_copy
+import load_data
+import metrics
+from quarantine import Quarantine
+import references
+
+SCHEMA = 'content'
+NEW_SUFFIX = '__new'
+OLD_SUFFIX = '__old'
+DEFAULT_LOCK_TIMEOUT = '2s'
+SWAP_ATTEMPTS = 10
+_SWAP_RETRY_DELAY = 1
+_MAX_NAME_LEN = 63
+_KEY_KINDS = frozenset(('p', 'u'))
+
+logger = logging.getLogger(__name__)
+
+
+def suffixed(name: str, suffix: str) -> str:
+    """Name with suffix, which PostgreSQL doesn't truncate."""
+    return name[:_MAX_NAME_LEN - len(suffix)] + suffix
+
+
+def _table_name(psql_table: str) -> str:
+    return psql_table.split('.')[-1]
+
+
+def _qualified(name: str) -> str:
+    return '{schema}.{name}'.format(schema=SCHEMA, name=name)
+
+
+def _shadow(psql_table: str, suffix: str = NEW_SUFFIX) -> str:
+    return _qualified(suffixed(_table_name(psql_table), suffix))
+
+
+def _on_table(definition: str, psql_table: str, target: str) -> str:
+    """Point 'ON <table>' of an index or trigger definition to 'target'."""
+    return re.sub(r'\bON (?:{schema}\.)?{table}\b'.format(
+        schema=SCHEMA, table=_table_name(psql_table)),
+        'ON ' + target, definition, count=1)
+
+
+def _constraints(pg_cursor,
+                 psql_table: str) -> List[Tuple[str, str, str, str]]:
+    """(name, type, definition, index) of keys and foreign keys."""
+    pg_cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid), "
+        "conindid::regclass::text FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f') "
+        "ORDER BY conname;",
+        (psql_table,))
+    return pg_cursor.fetchall()
+
+
+def _indexes(pg_cursor,
+             psql_table: str,
+             with_constraints: bool) -> List[Tuple[str, str]]:
+    """(name, definition) of indexes of a table."""
+    pg_cursor.execute(
+        'SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x '
+        'JOIN pg_class i ON i.oid = x.indexrelid '
+        'WHERE x.indrelid = %s::regclass AND (%s OR NOT EXISTS ('
+        'SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid '
+        "AND c.contype IN ('p', 'u', 'x'))) ORDER BY i.relname;",
+        (psql_table, with_constraints))
+    return pg_cursor.fetchall()
+
+
+def _create_shadow(pg_cursor, psql_table: str):
+    shadow = _shadow(psql_table)
+    pg_cursor.execute(
+        'CREATE UNLOGGED TABLE {shadow} (LIKE {table} '
+        'INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE);'.format(
+            shadow=shadow, table=psql_table))
+    # Before COPY: triggers maintain derived columns of the loaded rows
+    pg_cursor.execute(
+        'SELECT pg_get_triggerdef(oid) FROM pg_trigger '
+        'WHERE tgrelid = %s::regclass AND NOT tgisinternal;',
+        (psql_table,))
+    for (definition,) in pg_cursor.fetchall():
+        pg_cursor.execute(_on_table(definition, psql_table, shadow))
+    # Keys reject duplicates by COPY, their indexes get their names
+    for name, kind, definition, _ in _constraints(pg_cursor, psql_table):
+        if kind not in _KEY_KINDS:
+            continue
+        pg_cursor.execute(
+            'ALTER TABLE {shadow} ADD CONSTRAINT {name} {definition};'.format(
+                shadow=shadow,
+                name=suffixed(name, NEW_SUFFIX),
+                definition=definition))
+
+
+def _index_shadow(pg_cursor, psql_table: str):
+    shadow = _shadow(psql_table)
+    for name, definition in _indexes(pg_cursor, psql_table, False):
+        definition = definition.replace(
+            'INDEX {0} '.format(name),
+            'INDEX {0} '.format(suffixed(name, NEW_SUFFIX)), 1)
+        pg_cursor.execute(_on_table(definition, psql_table, shadow) + ';')
+
+
+def _link_shadow(pg_cursor, psql_table: str):
+    """Foreign keys of a shadow reference other shadows."""
+    loaded = '|'.join(_table_name(conv.psql_table)
+                      for conv in load_data.CONVERTORS)
+    for name, kind, definition, _ in _constraints(pg_cursor, psql_table):
+        if kind != 'f':
+            continue
+        definition = re.sub(
+            r'REFERENCES (?:{schema}\.)?({loaded})\('.format(
+                schema=SCHEMA, loaded=loaded),
+            lambda match: 'REFERENCES {0}('.format(
+                _shadow(match.group(1))),
+            definition)
+        pg_cursor.execute(
+            'ALTER TABLE {shadow} ADD CONSTRAINT {name} {definition};'.format(
+                shadow=_shadow(psql_table),
+                name=suffixed(name, NEW_SUFFIX),
+                definition=definition))
+
+
+def _drop(pg_cursor, suffix: str):
+    # A single statement: the dropped tables reference each other
+    pg_cursor.execute('DROP TABLE IF EXISTS {tables};'.format(
+        tables=', '.join(_shadow(conv.psql_table, suffix)
+                         for conv in load_data.CONVERTORS)))
+
+
+def _rename(pg_cursor,
+            table: str,
+            constraints: List[str],
+            indexes: List[str],
+            source: str,
+            target: str):
+    """Change the suffix of a table and of its constraints and indexes.
+
+        Renaming of a primary key or a unique constraint renames its
+        index as well. An empty suffix is the live name.
+    """
+    pg_cursor.execute('ALTER TABLE {old} RENAME TO {new};'.format(
+        old=_qualified(suffixed(table, source)),
+        new=suffixed(table, target)))
+    for constraint in constraints:
+        pg_cursor.execute(
+            'ALTER TABLE {table} RENAME CONSTRAINT {old} TO {new};'.format(
+                table=_qualified(suffixed(table, target)),
+                old=suffixed(constraint, source),
+                new=suffixed(constraint, target)))
+    for index in indexes:
+        pg_cursor.execute('ALTER INDEX {old} RENAME TO {new};'.format(
+            old=_qualified(suffixed(index, source)),
+            new=suffixed(index, target)))
+
+
+def _swap_tables(pg_cursor, incoming: str, outgoing: str):
+    """Live tables get 'outgoing' suffix, 'incoming' ones become live."""
+    for conv in load_data.CONVERTORS:
+        table = _table_name(conv.psql_table)
+        constraints = [row[0] for row in
+                       _constraints(pg_cursor, conv.psql_table)]
+        indexes = [row[0] for row in
+                   _indexes(pg_cursor, conv.psql_table, False)]
+        _rename(pg_cursor, table, constraints, indexes, '', outgoing)
+        _rename(pg_cursor, table, constraints, indexes, incoming, '')
+
+
+def _swap(pg_conn, incoming: str, outgoing: str, lock_timeout: str) -> bool:
+    tables = ', '.join(
+        '{0}, {1}'.format(conv.psql_table, _shadow(conv.psql_table, incoming))
+        for conv in load_data.CONVERTORS)
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            with pg_conn.cursor() as pg_cursor:
+                pg_cursor.execute('SET LOCAL lock_timeout = %s;',
+                                  (lock_timeout,))
+                pg_cursor.execute(
+                    'LOCK TABLE {tables} IN ACCESS EXCLUSIVE MODE;'.format(
+                        tables=tables))
+                _swap_tables(pg_cursor, incoming, outgoing)
+            pg_conn.commit()
+            return True
+        except psycopg2.errors.LockNotAvailable:
+            pg_conn.rollback()
+            logger.warning(f'Swap attempt {attempt} is timed out')
+            time.sleep(_SWAP_RETRY_DELAY)
+        except Exception as exp:
+            pg_conn.rollback()
+            logger.error(f'Tables swap error: {exp}.')
+            raise
+    logger.error(f'Tables have not been swapped in {SWAP_ATTEMPTS} attempts')
+    return False
+
+
+def load_swap(sqlite_curs: sqlite3.Cursor,
+              pg_conn,
+              batch_size: int,
+              binary: bool = False,
+              collector: Optional[metrics.Collector] = None,
+              quarantine: Optional[Quarantine] = None,
+              lock_timeout: str = DEFAULT_LOCK_TIMEOUT) -> bool:
+    """Load all tables into shadow tables and swap them in."""
+    collector = collector or metrics.Collector()
+    checker = references.ReferenceChecker(quarantine)
+    with pg_conn.cursor() as pg_cursor:
+        _drop(pg_cursor, OLD_SUFFIX)
+        _drop(pg_cursor, NEW_SUFFIX)
+    pg_conn.commit()
+    try:
+        with pg_conn.cursor() as pg_cursor:
+            for conv in load_data.CONVERTORS:
+                _create_shadow(pg_cursor, conv.psql_table)
+                with collector.profiled(conv.psql_table) as stats, \
+                        metrics.copy_timer(stats):
+                    encode = (conv.layout.to_binary if binary
+                              else conv.layout.to_csv)
+                    batches = load_data.extract_batches(
+                        sqlite_curs, conv, encode, batch_size, stats=stats,
+                        row_filter=checker.row_filter(conv, stats),
+                        on_reject=checker.on_reject(conv))
+                    bisect_copy.copy_batches(
+                        pg_cursor, conv, batches, binary, stats,
+                        checker.on_reject(conv, 'copy'),
+                        target=_shadow(conv.psql_table))
+                checker.collect(sqlite_curs, conv)
+                _index_shadow(pg_cursor, conv.psql_table)
+                logger.debug(f'{conv.sqlite_table} copied into '
+                             f'{_shadow(conv.psql_table)}')
+            # Referenced tables go first: a logged table can't reference
+            # an unlogged one
+            for conv in load_data.CONVERTORS:
+                pg_cursor.execute('ALTER TABLE {shadow} SET LOGGED;'.format(
+                    shadow=_shadow(conv.psql_table)))
+            for conv in load_data.CONVERTORS:
+                _link_shadow(pg_cursor, conv.psql_table)
+        pg_conn.commit()
+    except Exception as exp:
+        logger.error(f'Shadow tables load error: {exp}.')
+        pg_conn.rollback()
+        return False
+    return _swap(pg_conn, NEW_SUFFIX, OLD_SUFFIX, lock_timeout)
+
+
+def swap_back(pg_conn, lock_timeout: str = DEFAULT_LOCK_TIMEOUT) -> bool:
+    """Return the tables replaced by the last reload."""
+    return _swap(pg_conn, OLD_SUFFIX, NEW_SUFFIX, lock_timeout)
@@ -1,14 +1,22 @@
 """ Databases tables.
-This packet contains source and target DB tables in dataclasses.
+This packet contains target DB tables in dataclasses and the layouts,
+which convert source SQLite rows into their COPY rows.
 """
 
 from dataclasses import dataclass
-from datetime import date, datetime, timezone
-from typing import Union
+from datetime import date, datetime, time, timezone
+from typing import Callable, Optional, Sequence, Tuple, Union
 import uuid
 
+import parsers
+import pgbinary
+
 MAX_UNIX_DATE = '2038-01-19'
 UNIX_DATE_EMPTY_MARK = MAX_UNIX_DATE
+# Missing SQLite timestamps are loaded as this fixed mark, so every load
+# (and every checksum) of the same source gives the same rows
+EMPTY_TIMESTAMP_MARK = datetime.combine(
+    date.fromisoformat(UNIX_DATE_EMPTY_MARK), time(), timezone.utc)
 QUOTE_SYMBOL = '\x16'
 NULL_SYMBOL = 'NULL'
 DELIMITER = ','
@@ -17,70 +25,18 @@ Str_None = Union[str, None]
 
 
 def _quotes(line: str) -> str:
-    return QUOTE_SYMBOL + line + QUOTE_SYMBOL
-
-
-def _str_to_datetime(line: str) -> datetime:
-    if line:
-        return datetime.strptime(line + ':00', '%Y-%m-%d %H:%M:%S.%f%z')
-    return datetime.datetime.utcnow()
-
-
-class SqliteTables:
-    """ Attention.
-
-        Tables should have 'date' and 'datetime' types, but our db contains
-         wrong formatted datetime fields.
-         e.g.: 'filmwork' 6th row field 'updated_at'
-    """
-
-    @dataclass(frozen=True)
-    class FilmWork:
-        id: str
-        title: str
-        description: Str_None
-        creation_date: Str_None
-        file_path: Str_None
-        rating: Str_None
-        type: str
-        created_at: Str_None
-        updated_at: Str_None
-
-    @dataclass(frozen=True)
-    class Genre:
-        id: str
-        name: str
-        description: Str_None
-        created_at: Str_None
-        updated_at: Str_None
-
-    @dataclass(frozen=True)
-    class Person:
-        id: str
-        full_name: str
-        created_at: Str_None
-        updated_at: Str_None
-
-    @dataclass(frozen=True)
-    class GenreFilmWork:
-        id: str
-        created_at: Str_None
-        film_work_id: str
-        genre_id: str
-
-    @dataclass(frozen=True)
-    class PersonFilmWork:
-        id: str
-        role: str
-        created_at: Str_None
-        film_work_id: str
-        person_id: str
+    # A quote inside a quoted CSV value is escaped by doubling it
+    return QUOTE_SYMBOL + line.replace(
+        QUOTE_SYMBOL, QUOTE_SYMBOL * 2) + QUOTE_SYMBOL
 
 
 @dataclass(frozen=True)
 class FilmWork:
     """PostreSQL 'filmwork' Table."""
 
+    # Columns order of the COPY rows
+    COLUMNS = ('created', 'modified', 'id', 'title',
+               'description', 'creation_date', 'rating', 'type')
     _TITLE_MAX_LEN = 200
     _TYPE_MAX_LEN = 15
 
@@ -93,54 +49,13 @@ class FilmWork:
     created: datetime
     modified: datetime
 
-    @staticmethod
-    def create_from_sqlite(lite_table: SqliteTables.FilmWork):
-        descr = lite_table.description if lite_table.description else ''
-        creation = date.fromisoformat(
-            lite_table.creation_date if lite_table.creation_date
-            else UNIX_DATE_EMPTY_MARK
-        )
-        _rating = None
-        try:
-            _rating = float(lite_table.rating)
-        except Exception:
-            pass
-
-        created_at = _str_to_datetime(lite_table.created_at).replace(
-            tzinfo=timezone.utc)
-        updated_at = _str_to_datetime(lite_table.updated_at).replace(
-            tzinfo=timezone.utc)
-
-        return FilmWork(
-            id=uuid.UUID(lite_table.id),
-            title=lite_table.title[: FilmWork._TITLE_MAX_LEN],
-            description=descr,
-            creation_date=creation,
-            rating=_rating,
-            type=lite_table.type[:FilmWork._TYPE_MAX_LEN],
-            created=created_at,
-            modified=updated_at
-        )
-
-    # FixMe: Replace all QUOTE_SYMBOL symbols
-    def __str__(self) -> str:
-        return '{created},{modified},{id_},{title},'.format(
-            created=self.created.isoformat(),
-            modified=self.modified.isoformat(),
-            id_=self.id,
-            title=_quotes(self.title)
-        ) + '{description},{creation_date},{rating},{type_}\n'.format(
-            description=_quotes(self.description),
-            creation_date=self.creation_date.isoformat(),
-            rating=self.rating if self.rating else NULL_SYMBOL,
-            type_=_quotes(self.type),
-        )
-
 
 @dataclass(frozen=True)
 class Genre:
     """PostreSQL 'genre' Table."""
 
+    # Columns order of the COPY rows
+    COLUMNS = ('created', 'modified', 'id', 'name', 'description')
     _NAME_MAX_LEN = 100
     _TYPE_MAX_LEN = 15
 
@@ -150,37 +65,13 @@ class Genre:
     created: datetime
     modified: datetime
 
-    @staticmethod
-    def create_from_sqlite(lite_table: SqliteTables.Genre):
-        created_at = _str_to_datetime(lite_table.created_at).replace(
-            tzinfo=timezone.utc)
-        updated_at = _str_to_datetime(lite_table.updated_at).replace(
-            tzinfo=timezone.utc)
-
-        return Genre(
-            id=uuid.UUID(lite_table.id),
-            name=lite_table.name[: Genre._NAME_MAX_LEN],
-            description=lite_table.description,
-            created=created_at,
-            modified=updated_at
-        )
-
-    # FixMe: Replace all QUOTE_SYMBOL symbols
-    def __str__(self) -> str:
-        return '{created},{modified},{id_},{name},{description}\n'.format(
-            created=self.created.isoformat(),
-            modified=self.modified.isoformat(),
-            id_=self.id,
-            name=_quotes(self.name),
-            description=_quotes(self.description) if self.description
-            else NULL_SYMBOL,
-        )
-
 
 @dataclass(frozen=True)
 class Person:
     """PostreSQL 'person' Table."""
 
+    # Columns order of the COPY rows
+    COLUMNS = ('created', 'modified', 'id', 'full_name')
     _NAME_MAX_LEN = 200
     _TYPE_MAX_LEN = 15
 
@@ -189,90 +80,195 @@ class Person:
     created: datetime
     modified: datetime
 
-    @staticmethod
-    def create_from_sqlite(lite_table: SqliteTables.Person):
-        created_at = _str_to_datetime(lite_table.created_at).replace(
-            tzinfo=timezone.utc)
-        updated_at = _str_to_datetime(lite_table.updated_at).replace(
-            tzinfo=timezone.utc)
-
-        return Person(
-            id=uuid.UUID(lite_table.id),
-            full_name=lite_table.full_name[: Person._NAME_MAX_LEN],
-            created=created_at,
-            modified=updated_at
-        )
-
-    # FixMe: Replace all QUOTE_SYMBOL symbols
-    def __str__(self) -> str:
-        return '{created},{modified},{id_},{name}\n'.format(
-            created=self.created.isoformat(),
-            modified=self.modified.isoformat(),
-            id_=self.id,
-            name=_quotes(self.full_name),
-        )
-
 
 @dataclass(frozen=True)
 class PersonFilmWork:
     """PostreSQL 'person_filmwork' Table."""
 
+    # Columns order of the COPY rows
+    COLUMNS = ('id', 'role', 'created', 'film_work_id', 'person_id')
+
     id: uuid.UUID
     role: Str_None
     created: datetime
     film_work_id: uuid.UUID
     person_id: uuid.UUID
 
-    @staticmethod
-    def create_from_sqlite(lite_table: SqliteTables.PersonFilmWork):
-        created_at = _str_to_datetime(lite_table.created_at).replace(
-            tzinfo=timezone.utc)
-
-        return PersonFilmWork(
-            id=uuid.UUID(lite_table.id),
-            role=lite_table.role,
-            created=created_at,
-            film_work_id=uuid.UUID(lite_table.film_work_id),
-            person_id=uuid.UUID(lite_table.person_id)
-        )
-
-    # FixMe: Replace all QUOTE_SYMBOL symbols
-    def __str__(self) -> str:
-        return '{id_},{role},{created},{film_id},{person_id}\n'.format(
-            created=self.created.isoformat(),
-            id_=self.id,
-            film_id=self.film_work_id,
-            person_id=self.person_id,
-            role=_quotes(self.role),
-        )
-
 
 @dataclass(frozen=True)
 class GenreFilmWork:
     """PostreSQL 'genre_filmwork' Table."""
 
+    # Columns order of the COPY rows
+    COLUMNS = ('id', 'created', 'film_work_id', 'genre_id')
+
     id: uuid.UUID
     created: datetime
     film_work_id: uuid.UUID
     genre_id: uuid.UUID
 
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _text_csv(value: Str_None) -> str:
+    return NULL_SYMBOL if value is None else _quotes(value)
+
+
+def _float_csv(value: Optional[float]) -> str:
+    return NULL_SYMBOL if value is None else repr(value)
+
+
+def _isoformat(value: Union[date, datetime]) -> str:
+    return value.isoformat()
+
+
+def _as_is(value: str) -> str:
+    return value
+
+
+# COPY encoders of PostgreSQL values by type: (CSV, binary)
+_ENCODERS = {
+    'uuid': (_as_is, pgbinary.encode_uuid_text),
+    'text': (_text_csv, pgbinary.encode_text),
+    'timestamptz': (_isoformat, pgbinary.encode_timestamptz),
+    'date': (_isoformat, pgbinary.encode_date),
+    'float8': (_float_csv, pgbinary.encode_float8),
+}
+
+
+@dataclass(frozen=True)
+class RowLayout:
+    """Single pass conversion of plain SQLite tuples into COPY rows.
+
+        'sqlite_columns' are selected from SQLite, 'convert' maps such
+        a tuple to PostgreSQL values in 'COLUMNS' order of the target
+        table, without any intermediate objects. UUIDs stay strings.
+    """
+
+    sqlite_columns: Tuple[str, ...]
+    convert: Callable[[Sequence], tuple]
+    # PostgreSQL types of the converted values
+    pg_types: Tuple[str, ...]
+    csv_encoders: Tuple[Callable, ...]
+    binary_encoders: Tuple[Callable, ...]
+
     @staticmethod
-    def create_from_sqlite(lite_table: SqliteTables.GenreFilmWork):
-        created_at = _str_to_datetime(lite_table.created_at).replace(
-            tzinfo=timezone.utc)
-
-        return GenreFilmWork(
-            id=uuid.UUID(lite_table.id),
-            created=created_at,
-            film_work_id=uuid.UUID(lite_table.film_work_id),
-            genre_id=uuid.UUID(lite_table.genre_id)
+    def create(sqlite_columns: Tuple[str, ...],
+               convert: Callable[[Sequence], tuple],
+               pg_types: Tuple[str, ...]):
+        return RowLayout(
+            sqlite_columns=sqlite_columns,
+            convert=convert,
+            pg_types=pg_types,
+            csv_encoders=tuple(_ENCODERS[tp][0] for tp in pg_types),
+            binary_encoders=tuple(_ENCODERS[tp][1] for tp in pg_types),
         )
 
-    # FixMe: Replace all QUOTE_SYMBOL symbols
-    def __str__(self) -> str:
-        return '{id_},{created},{film_id},{genre_id}\n'.format(
-            created=self.created.isoformat(),
-            id_=self.id,
-            film_id=self.film_work_id,
-            genre_id=self.genre_id,
-        )
+    def to_csv(self, row: Sequence) -> str:
+        return DELIMITER.join([
+            encode(value)
+            for encode, value in zip(self.csv_encoders, self.convert(row))
+        ]) + '\n'
+
+    def to_binary(self, row: Sequence) -> bytes:
+        return pgbinary.encode_tuple([
+            encode(value)
+            for encode, value in zip(self.binary_encoders, self.convert(row))
+        ])
+
+
+def _timestamp(value: Str_None) -> datetime:
+    return parsers.parse_timestamp(value) or EMPTY_TIMESTAMP_MARK
+
+
+def _timestamps(created: Str_None, updated: Str_None) -> tuple:
+    """'created' and 'modified', a missing update time is the creation one."""
+    created_at = _timestamp(created)
+    return created_at, parsers.parse_timestamp(updated) or created_at
+
+
+def _film_work_values(row: Sequence) -> tuple:
+    id_, title, descr, creation, rating, type_, created, updated = row
+    return (
+        *_timestamps(created, updated),
+        parsers.uuid_text(id_),
+        title[:FilmWork._TITLE_MAX_LEN],
+        descr or '',
+        date.fromisoformat(creation or UNIX_DATE_EMPTY_MARK),
+        _to_float(rating),
+        type_[:FilmWork._TYPE_MAX_LEN],
+    )
+
+
+def _genre_values(row: Sequence) -> tuple:
+    id_, name, descr, created, updated = row
+    return (
+        *_timestamps(created, updated),
+        parsers.uuid_text(id_),
+        name[:Genre._NAME_MAX_LEN],
+        descr,
+    )
+
+
+def _person_values(row: Sequence) -> tuple:
+    id_, full_name, created, updated = row
+    return (
+        *_timestamps(created, updated),
+        parsers.uuid_text(id_),
+        full_name[:Person._NAME_MAX_LEN],
+    )
+
+
+def _person_film_work_values(row: Sequence) -> tuple:
+    id_, role, created, film_work_id, person_id = row
+    return (
+        parsers.uuid_text(id_),
+        role,
+        _timestamp(created),
+        parsers.uuid_text(film_work_id),
+        parsers.uuid_text(person_id),
+    )
+
+
+def _genre_film_work_values(row: Sequence) -> tuple:
+    id_, created, film_work_id, genre_id = row
+    return (
+        parsers.uuid_text(id_),
+        _timestamp(created),
+        parsers.uuid_text(film_work_id),
+        parsers.uuid_text(genre_id),
+    )
+
+
+FILM_WORK_LAYOUT = RowLayout.create(
+    ('id', 'title', 'description', 'creation_date', 'rating', 'type',
+     'created_at', 'updated_at'),
+    _film_work_values,
+    ('timestamptz', 'timestamptz', 'uuid', 'text', 'text', 'date', 'float8',
+     'text'),
+)
+GENRE_LAYOUT = RowLayout.create(
+    ('id', 'name', 'description', 'created_at', 'updated_at'),
+    _genre_values,
+    ('timestamptz', 'timestamptz', 'uuid', 'text', 'text'),
+)
+PERSON_LAYOUT = RowLayout.create(
+    ('id', 'full_name', 'created_at', 'updated_at'),
+    _person_values,
+    ('timestamptz', 'timestamptz', 'uuid', 'text'),
+)
+PERSON_FILM_WORK_LAYOUT = RowLayout.create(
+    ('id', 'role', 'created_at', 'film_work_id', 'person_id'),
+    _person_film_work_values,
+    ('uuid', 'text', 'timestamptz', 'uuid', 'uuid'),
+)
+GENRE_FILM_WORK_LAYOUT = RowLayout.create(
+    ('id', 'created_at', 'film_work_id', 'genre_id'),
+    _genre_film_work_values,
+    ('uuid', 'timestamptz', 'uuid', 'uuid'),
+)
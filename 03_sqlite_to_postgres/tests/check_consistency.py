@@ -1,7 +1,7 @@
-from dataclasses import dataclass
+import itertools
 import os
 import sqlite3
-from typing import Callable
+from typing import Iterator, Tuple
 
 from dotenv import load_dotenv
 import psycopg2
@@ -10,6 +10,7 @@ import pytest
 
 import load_data
 import tables
+import verify
 
 
 @pytest.fixture(scope='module')
@@ -18,14 +19,23 @@ def activate_env():
 
 
 @pytest.fixture()
-def psql_connect():
-    dsl = {
+def dsl() -> dict:
+    return {
         'dbname': os.environ.get('DB_NAME', 'movies_database'),
         'user': 'app',
         'password': '123qwe',
         'host': os.environ.get('DB_HOST', '127.0.0.1'),
         'port': int(os.environ.get('DB_PORT', 5432)),
     }
+
+
+@pytest.fixture()
+def sqlite_path() -> str:
+    return os.environ.get('SQL_LITE_DB_PATH', '../db.sqlite')
+
+
+@pytest.fixture()
+def psql_connect(dsl):
     psycopg2.extras.register_uuid()
     with psycopg2.connect(**dsl, cursor_factory=DictCursor) as pg_conn, \
             pg_conn.cursor() as pg_cursor:
@@ -34,10 +44,9 @@ def psql_connect():
 
 
 @pytest.fixture()
-def sqlite_connect():
+def sqlite_connect(sqlite_path):
     try:
-        db_path = os.environ.get('SQL_LITE_DB_PATH', '../db.sqlite')
-        conn = sqlite3.connect(db_path)
+        conn = sqlite3.connect(sqlite_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         yield cursor
@@ -67,109 +76,45 @@ def test_sizes(psql_connect, sqlite_connect):
         assert get_size(pg_curs, tbl[0]) == get_size(sqlite_curs, tbl[1])
 
 
-@dataclass(frozen=True)
-class Convertor:
-    table_name: str
-    create_class: Callable[[dict], load_data.AnyTable]
-
-
-@dataclass(frozen=True)
-class MainConvertor:
-    postgresql: Convertor
-    sqlite: Convertor
-
-
-def _get_convertors() -> list[MainConvertor]:
-    return [
-        MainConvertor(
-            sqlite=Convertor(
-                table_name='film_work',
-                create_class=lambda d: tables.FilmWork.create_from_sqlite(
-                    tables.SqliteTables.FilmWork(**d)
-                ),
-            ),
-            postgresql=Convertor(
-                table_name='content.film_work',
-                create_class=lambda d: tables.FilmWork(**d),
-            ),
-        ),
-        MainConvertor(
-            sqlite=Convertor(
-                table_name='genre',
-                create_class=lambda d: tables.Genre.create_from_sqlite(
-                    tables.SqliteTables.Genre(**d)
-                ),
-            ),
-            postgresql=Convertor(
-                table_name='content.genre',
-                create_class=lambda d: tables.Genre(**d),
-            ),
-        ),
-        MainConvertor(
-            sqlite=Convertor(
-                table_name='person',
-                create_class=lambda d: tables.Person.create_from_sqlite(
-                    tables.SqliteTables.Person(**d)
-                ),
-            ),
-            postgresql=Convertor(
-                table_name='content.person',
-                create_class=lambda d: tables.Person(**d),
-            ),
-        ),
-        MainConvertor(
-            sqlite=Convertor(
-                table_name='genre_film_work',
-                create_class=lambda d: tables.GenreFilmWork.create_from_sqlite(
-                    tables.SqliteTables.GenreFilmWork(**d)
-                ),
-            ),
-            postgresql=Convertor(
-                table_name='content.genre_film_work',
-                create_class=lambda d: tables.GenreFilmWork(**d),
-            ),
-        ),
-        MainConvertor(
-            sqlite=Convertor(
-                table_name='person_film_work',
-                create_class=lambda d:
-                tables.PersonFilmWork.create_from_sqlite(
-                    tables.SqliteTables.PersonFilmWork(**d)
-                ),
-            ),
-            postgresql=Convertor(
-                table_name='content.person_film_work',
-                create_class=lambda d: tables.PersonFilmWork(**d),
-            ),
-        ),
-    ]
+_LINES_PER_TIME_EXTRACTION = 400
 
 
-_LINES_PER_TIME_EXTRACTION = 400
+def _rows(cursor,
+          table_name: str,
+          columns: Tuple[str, ...]) -> Iterator[tuple]:
+    for page in load_data.extract_pages(cursor, table_name,
+                                        _LINES_PER_TIME_EXTRACTION,
+                                        columns=columns):
+        yield from map(tuple, page)
+
+
+def _loaded(layout: tables.RowLayout, row: tuple) -> tuple:
+    """PostgreSQL values as 'RowLayout.convert' gives them: UUIDs are
+    strings."""
+    return tuple(
+        str(value) if pg_type == 'uuid' and value is not None else value
+        for value, pg_type in zip(row, layout.pg_types))
 
 
 def test_equality(psql_connect, sqlite_connect):
     sqlite_curs = sqlite_connect
     pg_curs = psql_connect
 
-    for conv in _get_convertors():
-        offset = 0
-        size = _LINES_PER_TIME_EXTRACTION
-        while True:
-            lite_data = load_data.extract_part(sqlite_curs,
-                                               conv.sqlite.table_name,
-                                               size,
-                                               offset)
-            post_data = load_data.extract_part(pg_curs,
-                                               conv.postgresql.table_name,
-                                               size,
-                                               offset)
-            cnt = len(lite_data)
-            for i in range(cnt):
-                assert conv.postgresql.create_class(
-                    dict(post_data[i])
-                ) == conv.sqlite.create_class(dict(lite_data[i]))
-
-            offset += cnt
-            if cnt < size:
-                break
+    for conv in load_data.CONVERTORS:
+        # Both sides are ordered by id: uuid and its lower-case text
+        # representation are sorted in the same order. DB maintained
+        # columns (e.g. 'genre_names', 'search_vector') are not selected.
+        for lite_row, post_row in itertools.zip_longest(
+                _rows(sqlite_curs, conv.sqlite_table,
+                      conv.layout.sqlite_columns),
+                _rows(pg_curs, conv.psql_table, conv.columns)):
+            assert lite_row is not None and post_row is not None
+            assert _loaded(conv.layout, post_row) == \
+                conv.layout.convert(lite_row)
+
+
+def test_checksums(sqlite_path, dsl):
+    for report in verify.verify(
+            sqlite_path, dsl, os.cpu_count(),
+            quarantine_path=os.environ.get('LOAD_QUARANTINE_PATH')):
+        assert report.ok, report.summary()
@@ -0,0 +1,106 @@
+import psycopg2
+import pytest
+
+import bisect_copy
+import load_data
+import metrics
+import pgbinary
+
+BAD_LINE = 'bad\n'
+
+
+class FakeCursor:
+    """COPY into a list, a line with 'bad' fails the whole statement."""
+
+    def __init__(self):
+        self.rows = []
+        self.copies = 0
+        self._savepoint = None
+
+    def execute(self, query: str):
+        if query.startswith('SAVEPOINT'):
+            self._savepoint = len(self.rows)
+        elif query.startswith('ROLLBACK TO SAVEPOINT'):
+            del self.rows[self._savepoint:]
+
+    def copy_expert(self, query: str, file):
+        self.copies += 1
+        data = file.read()
+        if isinstance(data, bytes):
+            assert data.startswith(pgbinary.HEADER)
+            assert data.endswith(pgbinary.TRAILER)
+            data = data[len(pgbinary.HEADER):-len(pgbinary.TRAILER)]
+            data = data.decode()
+        lines = data.splitlines(keepends=True)
+        if BAD_LINE in lines:
+            raise psycopg2.DataError('bad line')
+        self.rows += lines
+
+
+def _batches(lines: list, binary: bool = False, size: int = 3):
+    for start in range(0, len(lines), size):
+        chunk = lines[start:start + size]
+        yield ([(line.strip(),) for line in chunk],
+               [line.encode() for line in chunk] if binary else chunk)
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_single_bad_row_is_isolated(binary):
+    lines = [f'{number}\n' for number in range(16)]
+    lines[11] = BAD_LINE
+    cursor = FakeCursor()
+    rejected = []
+    stats = metrics.TableStats('content.genre')
+    bisect_copy.copy_batches(
+        cursor, load_data.get_convertor('genre'),
+        _batches(lines, binary), binary, stats,
+        lambda entry, exp: rejected.append(entry), batch_rows=16)
+
+    assert cursor.rows == [line for line in lines if line != BAD_LINE]
+    assert rejected == [('bad',)]
+    assert stats.rows_failed == 1
+    # Halves of the failed batch, not a COPY per row
+    assert cursor.copies == 9
+
+
+def test_batches_by_rows():
+    lines = [f'{number}\n' for number in range(10)]
+    cursor = FakeCursor()
+    bisect_copy.copy_batches(
+        cursor, load_data.get_convertor('genre'), _batches(lines), False,
+        metrics.TableStats('content.genre'), None, batch_rows=4)
+    assert cursor.rows == lines
+    # 3 + 3, 3 + 1 rows
+    assert cursor.copies == 2
+
+
+def test_stream():
+    lines = [f'{number}\n' for number in range(10)]
+    cursor = FakeCursor()
+    assert bisect_copy.copy_stream(
+        cursor, load_data.get_convertor('genre'), _batches(lines), False)
+    assert cursor.rows == lines
+    assert cursor.copies == 1
+
+
+def test_failed_stream_is_read_till_the_end():
+    lines = [f'{number}\n' for number in range(10)]
+    lines[1] = BAD_LINE
+    batches = _batches(lines)
+    cursor = FakeCursor()
+    assert not bisect_copy.copy_stream(
+        cursor, load_data.get_convertor('genre'), batches, False)
+    assert cursor.rows == []
+    assert next(batches, None) is None
+
+
+def test_other_errors_are_raised():
+    class LostCursor(FakeCursor):
+        def copy_expert(self, query: str, file):
+            raise psycopg2.OperationalError('connection lost')
+
+    with pytest.raises(psycopg2.OperationalError):
+        bisect_copy.copy_batches(
+            LostCursor(), load_data.get_convertor('genre'),
+            _batches(['0\n']), False, metrics.TableStats('content.genre'),
+            None)
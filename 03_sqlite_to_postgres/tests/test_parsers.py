@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import parsers
+
+_UTC = timezone.utc
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('2021-06-16 20:14:09.221838+00',
+     datetime(2021, 6, 16, 20, 14, 9, 221838, tzinfo=_UTC)),
+    ('2021-06-16 23:14:09+03',
+     datetime(2021, 6, 16, 20, 14, 9, tzinfo=_UTC)),
+    ('2021-06-16T20:14:09.221838',
+     datetime(2021, 6, 16, 20, 14, 9, 221838, tzinfo=_UTC)),
+])
+def test_iso_timestamps(line, expected):
+    assert parsers.parse_timestamp(line) == expected
+
+
+@pytest.mark.parametrize('line, expected', [
+    # Surrounding spaces aren't accepted by 'fromisoformat'
+    (' 2021-06-16 20:14:09.221838+00 ',
+     datetime(2021, 6, 16, 20, 14, 9, 221838, tzinfo=_UTC)),
+    (' 2021-06-16 17:14:09-03 ',
+     datetime(2021, 6, 16, 20, 14, 9, tzinfo=_UTC)),
+    (' 2021-06-16 20:14:09.5 ',
+     datetime(2021, 6, 16, 20, 14, 9, 500000, tzinfo=_UTC)),
+    (' 2021-06-16 20:14:09 ',
+     datetime(2021, 6, 16, 20, 14, 9, tzinfo=_UTC)),
+    (' 2021-06-16 21:14+01 ',
+     datetime(2021, 6, 16, 20, 14, tzinfo=_UTC)),
+    (' 2021-06-16 20:14 ',
+     datetime(2021, 6, 16, 20, 14, tzinfo=_UTC)),
+    (' 2021-06-16 ',
+     datetime(2021, 6, 16, tzinfo=_UTC)),
+])
+def test_fallback_timestamps(line, expected):
+    assert parsers.parse_timestamp(line) == expected
+
+
+@pytest.mark.parametrize('line', [None, ''])
+def test_empty_timestamps(line):
+    assert parsers.parse_timestamp(line) is None
+
+
+@pytest.mark.parametrize('line', ['16.06.2021 20:14', '2021-13-01', 'now'])
+def test_unknown_timestamps(line):
+    with pytest.raises(ValueError):
+        parsers.parse_timestamp(line)
+
+
+def test_uuid_text():
+    canonical = '3d825f60-9fff-4dfe-b294-1a45fa1e115d'
+    assert parsers.uuid_text(canonical) is canonical
+    assert parsers.uuid_text(canonical.upper()) == canonical
+    assert parsers.uuid_text(canonical.replace('-', '')) == canonical
+    assert parsers.uuid_text('{' + canonical + '}') == canonical
+
+
+@pytest.mark.parametrize('value', ['', 'not-a-uuid', '3d825f60-9fff'])
+def test_wrong_uuid_text(value):
+    with pytest.raises(ValueError):
+        parsers.uuid_text(value)
+
+
+def test_uuid_bytes():
+    assert parsers.uuid_bytes('00010203-0405-0607-0809-0A0B0C0D0E0F') == \
+        bytes(range(16))
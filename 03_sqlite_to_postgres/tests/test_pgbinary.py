@@ -0,0 +1,96 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+import pgbinary
+import tables
+
+# Expected values are the PostgreSQL '<type>_send' output
+_NULL = bytes.fromhex('ffffffff')
+
+
+def test_header_and_trailer():
+    assert pgbinary.HEADER == b'PGCOPY\n\xff\r\n\x00' + bytes(8)
+    assert pgbinary.TRAILER == b'\xff\xff'
+
+
+@pytest.mark.parametrize('encode', [
+    pgbinary.encode_uuid_text,
+    pgbinary.encode_text,
+    pgbinary.encode_timestamptz,
+    pgbinary.encode_date,
+    pgbinary.encode_float8,
+])
+def test_null(encode):
+    assert encode(None) == _NULL
+
+
+def test_uuid():
+    assert pgbinary.encode_uuid_text(
+        '00010203-0405-0607-0809-0a0b0c0d0e0f') == \
+        bytes.fromhex('00000010') + bytes(range(16))
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('', '00000000'),
+    ('ab', '00000002' '6162'),
+    ('é', '00000002' 'c3a9'),
+])
+def test_text(value, expected):
+    assert pgbinary.encode_text(value) == bytes.fromhex(expected)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (datetime(2000, 1, 1, tzinfo=timezone.utc), '0000000000000000'),
+    (datetime(2000, 1, 1, 0, 0, 1, 2, tzinfo=timezone.utc),
+     '00000000000f4242'),
+    (datetime(1999, 12, 31, 23, 59, 59, tzinfo=timezone.utc),
+     'fffffffffff0bdc0'),
+    # The same moment in another zone
+    (datetime(2000, 1, 1, 3, tzinfo=timezone(timedelta(hours=3))),
+     '0000000000000000'),
+    (datetime(2021, 6, 16, 20, 14, 9, 221838, tzinfo=timezone.utc),
+     '000267e6807cc8ce'),
+])
+def test_timestamptz(value, expected):
+    assert pgbinary.encode_timestamptz(value) == \
+        bytes.fromhex('00000008' + expected)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (date(2000, 1, 1), '00000000'),
+    (date(2000, 1, 2), '00000001'),
+    (date(1999, 12, 31), 'ffffffff'),
+    (date(2021, 6, 16), '00001e9d'),
+])
+def test_date(value, expected):
+    assert pgbinary.encode_date(value) == bytes.fromhex('00000004' + expected)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (0.0, '0000000000000000'),
+    (1.5, '3ff8000000000000'),
+    (-2.0, 'c000000000000000'),
+])
+def test_float8(value, expected):
+    assert pgbinary.encode_float8(value) == \
+        bytes.fromhex('00000008' + expected)
+
+
+def test_tuple():
+    assert pgbinary.encode_tuple(
+        (pgbinary.encode_text('a'), pgbinary.encode_text(None))) == \
+        bytes.fromhex('0002' '00000001' '61' 'ffffffff')
+
+
+def test_layout_row():
+    row = ('00010203-0405-0607-0809-0A0B0C0D0E0F', 'ab', None,
+           '2000-01-01 00:00:01.000002+00', '')
+    assert tables.GENRE_LAYOUT.to_binary(row) == bytes.fromhex(
+        '0005'
+        '00000008' '00000000000f4242'
+        # A missing update time is the creation one
+        '00000008' '00000000000f4242'
+        '00000010' '000102030405060708090a0b0c0d0e0f'
+        '00000002' '6162'
+        'ffffffff')
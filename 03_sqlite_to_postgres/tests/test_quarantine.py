@@ -0,0 +1,46 @@
+import json
+
+import quarantine
+
+
+def test_counts_without_file():
+    with quarantine.Quarantine() as rows:
+        rows.add('content.genre', 'copy', ('id', 'name'))
+        rows.add('content.genre', 'copy', ('id', 'name'))
+        assert rows.size() == 0
+    assert rows.counts == {('content.genre', 'copy'): 2}
+
+
+def test_file(tmp_path):
+    path = str(tmp_path / 'quarantine.jsonl')
+    with quarantine.Quarantine(path) as rows:
+        rows.add('content.genre', 'conversion', ('id', None, 1.5), 'wrong')
+        checkpoint = rows.size()
+        rows.add('content.person', 'copy', ('id',))
+    entries = list(quarantine.read(path))
+    assert [(entry['table'], entry['reason'], entry['row'], entry['error'])
+            for entry in entries] == [
+        ('content.genre', 'conversion', ['id', None, 1.5], 'wrong'),
+        ('content.person', 'copy', ['id'], ''),
+    ]
+    with open(path) as file:
+        assert json.loads(file.readline()) == entries[0]
+        assert file.tell() == checkpoint
+
+
+def test_truncate(tmp_path):
+    path = str(tmp_path / 'quarantine.jsonl')
+    with quarantine.Quarantine(path) as rows:
+        rows.add('content.genre', 'copy', ('first',))
+        checkpoint = rows.size()
+        rows.add('content.genre', 'copy', ('second',))
+        rows.truncate(checkpoint)
+        # The open file appends to the new end
+        rows.add('content.genre', 'copy', ('third',))
+        rows.truncate(rows.size() + 1)
+    assert [entry['row'] for entry in quarantine.read(path)] == \
+        [['first'], ['third']]
+
+
+def test_read_missing_file(tmp_path):
+    assert list(quarantine.read(str(tmp_path / 'missing.jsonl'))) == []
@@ -0,0 +1,92 @@
+import sqlite3
+import uuid
+
+import pytest
+
+import load_data
+import metrics
+from parsers import uuid_bytes
+from quarantine import Quarantine
+import references
+
+FILM_IDS = sorted(str(uuid.uuid4()) for _ in range(5))
+GENRE_ID = str(uuid.uuid4())
+
+
+def _packed(count: int) -> list:
+    return [uuid_bytes(str(uuid.uuid4())) for _ in range(count)]
+
+
+def test_sorted_ids():
+    values = sorted(_packed(100))
+    ids = references.IdSet()
+    for value in values:
+        ids.add(value)
+    assert len(ids) == 100
+    assert all(value in ids for value in values)
+    assert bytes(references.UUID_SIZE) not in ids
+    assert b'\xff' * references.UUID_SIZE not in ids
+
+
+def test_ids_out_of_order():
+    values = _packed(100)
+    ids = references.IdSet()
+    for value in values + values[:10]:
+        ids.add(value)
+    assert all(value in ids for value in values)
+    # Duplicates are dropped by the sort
+    assert len(ids) == 100
+    assert uuid_bytes(str(uuid.uuid4())) not in ids
+
+
+@pytest.fixture()
+def sqlite_curs():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE film_work (id TEXT);')
+    cursor.execute('CREATE TABLE genre (id TEXT);')
+    # A loaded id may differ from the canonical one
+    cursor.executemany('INSERT INTO film_work VALUES (?);',
+                       [(FILM_IDS[0].upper(),)] +
+                       [(id_,) for id_ in FILM_IDS[1:]] + [('broken',)])
+    cursor.execute('INSERT INTO genre VALUES (?);', (GENRE_ID,))
+    yield cursor
+    conn.close()
+
+
+def _link(film_work_id) -> tuple:
+    return (str(uuid.uuid4()), '2021-06-16 20:14:09+00', film_work_id,
+            GENRE_ID)
+
+
+def test_orphans(sqlite_curs):
+    film_work = load_data.get_convertor('film_work')
+    genre_film_work = load_data.get_convertor('genre_film_work')
+    quarantine = Quarantine()
+    checker = references.ReferenceChecker(quarantine)
+    checker.on_reject(film_work)(
+        (FILM_IDS[1],) + (None,) * 7, ValueError('wrong'))
+    checker.collect(sqlite_curs, film_work)
+    checker.collect(sqlite_curs, load_data.get_convertor('genre'))
+    stats = metrics.TableStats(genre_film_work.psql_table)
+    accept = checker.row_filter(genre_film_work, stats)
+
+    assert accept(_link(FILM_IDS[0]))
+    assert accept(_link(FILM_IDS[2].upper()))
+    # Rejected, missing and wrong parent ids
+    assert not accept(_link(FILM_IDS[1]))
+    assert not accept(_link(str(uuid.uuid4())))
+    assert not accept(_link('broken'))
+    assert not accept(_link(None))
+    assert stats.rows_orphaned == 4
+    assert quarantine.counts == {
+        ('content.film_work', 'conversion'): 1,
+        ('content.genre_film_work', 'orphan'): 4,
+    }
+
+
+def test_no_parents_collected():
+    genre_film_work = load_data.get_convertor('genre_film_work')
+    checker = references.ReferenceChecker()
+    stats = metrics.TableStats(genre_film_work.psql_table)
+    assert checker.row_filter(genre_film_work, stats) is None
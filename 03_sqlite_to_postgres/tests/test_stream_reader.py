@@ -0,0 +1,43 @@
+import itertools
+
+import load_data
+
+
+def test_read_by_size():
+    stream = load_data.StreamReader(iter(['ab\n', 'cde\n', 'f\n']))
+    assert stream.read(2) == 'ab'
+    assert stream.read(4) == '\ncde'
+    assert stream.read(10) == '\nf\n'
+    assert stream.read(10) == ''
+
+
+def test_read_all():
+    stream = load_data.StreamReader(iter(['ab\n', 'cde\n']))
+    assert stream.read(1) == 'a'
+    assert stream.read() == 'b\ncde\n'
+    assert stream.read() == ''
+
+
+def test_read_is_lazy():
+    lines = (f'{number}\n' for number in itertools.count())
+    stream = load_data.StreamReader(lines)
+    assert stream.read(5) == '0\n1\n2'
+    # Only the lines of the chunk are pulled
+    assert next(lines) == '3\n'
+
+
+def test_readline():
+    stream = load_data.StreamReader(iter(['ab\ncd\n', 'ef']))
+    assert stream.readline(1) == 'a'
+    assert stream.readline() == 'b\n'
+    assert stream.readline() == 'cd\n'
+    assert stream.readline() == 'ef'
+    assert stream.readline() == ''
+
+
+def test_bytes():
+    stream = load_data.BytesStreamReader(iter([b'ab\n', b'cd']))
+    assert stream.readable()
+    assert stream.readline() == b'ab\n'
+    assert stream.read(5) == b'cd'
+    assert stream.read() == b''
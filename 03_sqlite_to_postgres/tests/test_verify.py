@@ -0,0 +1,84 @@
+from datetime import date, datetime, timedelta, timezone
+import json
+import sqlite3
+import uuid
+
+import pytest
+
+import load_data
+import verify
+
+GENRE_IDS = sorted(str(uuid.uuid4()) for _ in range(3))
+
+
+# Expected values are the output of the '_PG_NORMALIZERS' expressions
+@pytest.mark.parametrize('pg_type, value, expected', [
+    ('uuid', '3d825f60-9fff-4dfe-b294-1a45fa1e115d',
+     '3d825f60-9fff-4dfe-b294-1a45fa1e115d'),
+    ('text', 'Sci-Fi', 'Sci-Fi'),
+    ('timestamptz',
+     datetime(2021, 6, 16, 23, 14, 9, 500000,
+              tzinfo=timezone(timedelta(hours=3))),
+     '2021-06-16T20:14:09.500000'),
+    ('timestamptz', datetime(2021, 6, 16, tzinfo=timezone.utc),
+     '2021-06-16T00:00:00.000000'),
+    ('date', date(2021, 6, 16), '2021-06-16'),
+    ('float8', 8.5, '8.500000'),
+    ('float8', 0.1234565, '0.123457'),
+    ('float8', 1e-7, '0.000000'),
+])
+def test_normalizers(pg_type, value, expected):
+    assert verify._PY_NORMALIZERS[pg_type](value) == expected
+
+
+def test_row_hash():
+    # ('x' || left(md5(line), 16))::bit(64)::bigint
+    assert verify._row_hash('abc') == -8070080442485551184
+    assert verify._row_hash('a\t\\N') == -7622377032539862116
+
+
+def test_buckets():
+    # left(md5(id::text), 3)
+    id_ = '3d825f60-9fff-4dfe-b294-1a45fa1e115d'
+    assert verify.bucket_of(id_, 3) == 'b03'
+    bucket = verify._sqlite_bucket(3)
+    assert bucket(id_.upper()) == 'b03'
+    assert bucket('broken') is None
+    assert bucket(None) is None
+
+
+def test_quarantined_ids(tmp_path):
+    path = tmp_path / 'quarantine.jsonl'
+    entries = [
+        {'table': 'content.genre', 'row': [GENRE_IDS[0].upper(), 'name']},
+        {'table': 'content.genre', 'row': ['broken', 'name']},
+        {'table': 'content.unknown', 'row': [GENRE_IDS[1]]},
+        {'table': 'content.genre_film_work', 'row': []},
+    ]
+    path.write_text(''.join(json.dumps(entry) + '\n' for entry in entries))
+    assert verify.quarantined_ids(str(path)) == {
+        'genre': frozenset([GENRE_IDS[0]])}
+    assert verify.quarantined_ids(None) == {}
+
+
+def test_sqlite_rows(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE genre (id TEXT, name TEXT, '
+                     'description TEXT, created_at TEXT, updated_at TEXT);')
+        conn.executemany(
+            'INSERT INTO genre VALUES (?, ?, NULL, ?, NULL);', [
+                (GENRE_IDS[0], 'Drama', '2021-06-16 20:14:09.5+00'),
+                (GENRE_IDS[1], 'Comedy', '2021-06-16 20:14:09+00'),
+                # Rejected by the conversion
+                (GENRE_IDS[2], 'Horror', '16.06.2021'),
+            ])
+    conn.close()
+    rows = list(verify._sqlite_rows(
+        path, load_data.get_convertor('genre'), 2,
+        skipped=frozenset([GENRE_IDS[1]])))
+    line = '\t'.join([
+        '2021-06-16T20:14:09.500000', '2021-06-16T20:14:09.500000',
+        GENRE_IDS[0], 'Drama', verify.NULL_TEXT])
+    assert rows == [(verify.bucket_of(GENRE_IDS[0], 2), GENRE_IDS[0],
+                     verify._row_hash(line))]
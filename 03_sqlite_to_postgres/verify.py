@@ -0,0 +1,323 @@
+""" Checksum based consistency verification.
+
+Rows of every table are grouped into buckets by a prefix of md5 of the
+row id. A bucket digest is the number of rows and the sum of the first 64
+bits of md5 of every normalised row. PostgreSQL digests are computed by a
+single aggregate query, SQLite ones by a streaming pass through the same
+'RowLayout' conversion the loader uses. Rows are compared one by one only
+in the buckets with different digests. Tables and mismatched buckets are
+checked by parallel processes. Rows of the loader quarantine file aren't
+expected in PostgreSQL and are skipped.
+
+Run from the loader folder, with the same environment as 'load_data.py':
+    python verify.py --prefix 3
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass, field
+from datetime import date, timezone
+from decimal import Decimal, ROUND_HALF_UP
+import hashlib
+import logging
+import multiprocessing
+import os
+import sys
+from typing import (Callable, Dict, FrozenSet, Iterable, Iterator, List,
+                    Optional, Tuple)
+
+from dotenv import load_dotenv
+import psycopg2
+
+import load_data
+import parsers
+import quarantine
+
+DEFAULT_PREFIX = 2
+NULL_TEXT = '\\N'
+_SEPARATOR = '\t'
+_FLOAT_PRECISION = Decimal('0.000001')
+_SAMPLE_SIZE = 10
+
+# Bucket: (rows, sum of row hashes)
+Digests = Dict[str, Tuple[int, int]]
+
+# The same text of a value in PostgreSQL and in Python
+_PG_NORMALIZERS = {
+    'uuid': '{0}::text',
+    'text': '{0}',
+    'timestamptz': 'to_char({0} AT TIME ZONE \'UTC\', '
+                   '\'YYYY-MM-DD"T"HH24:MI:SS.US\')',
+    'date': 'to_char({0}, \'YYYY-MM-DD\')',
+    'float8': 'round({0}::numeric, 6)::text',
+}
+_PY_NORMALIZERS = {
+    'uuid': str,
+    'text': str,
+    'timestamptz': lambda value: value.astimezone(timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%S.%f'),
+    'date': date.isoformat,
+    'float8': lambda value: str(Decimal(repr(value)).quantize(
+        _FLOAT_PRECISION, ROUND_HALF_UP)),
+}
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TableReport:
+    table: str
+    sqlite_rows: int = 0
+    postgres_rows: int = 0
+    buckets: int = 0
+    mismatched_buckets: List[str] = field(default_factory=list)
+    # Ids of rows, which are only in SQLite, only in PostgreSQL or differ
+    missing: List[str] = field(default_factory=list)
+    extra: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.mismatched_buckets
+
+    def summary(self, sample: int = _SAMPLE_SIZE) -> str:
+        if self.ok:
+            return (f'{self.table}: {self.postgres_rows} rows '
+                    f'in {self.buckets} buckets are equal')
+        return (f'{self.table}: {len(self.mismatched_buckets)} of '
+                f'{self.buckets} buckets differ, '
+                f'missing {len(self.missing)} {self.missing[:sample]}, '
+                f'extra {len(self.extra)} {self.extra[:sample]}, '
+                f'changed {len(self.changed)} {self.changed[:sample]}')
+
+
+def bucket_of(id_: str, prefix: int) -> str:
+    return hashlib.md5(id_.encode('utf-8')).hexdigest()[:prefix]
+
+
+def _sqlite_bucket(prefix: int) -> Callable[[str], Optional[str]]:
+    """SQLite function of the bucket of a loaded (normalised) id."""
+    def bucket(id_: str) -> Optional[str]:
+        try:
+            return bucket_of(parsers.uuid_text(id_), prefix)
+        except (AttributeError, TypeError, ValueError):
+            return None
+    return bucket
+
+
+def quarantined_ids(path: Optional[str]) -> Dict[str, FrozenSet[str]]:
+    """Loaded (normalised) ids of quarantined rows by SQLite table."""
+    layouts = {conv.psql_table: conv for conv in load_data.CONVERTORS}
+    ids: Dict[str, set] = {}
+    for entry in quarantine.read(path) if path else ():
+        conv = layouts.get(entry.get('table'))
+        if conv is None:
+            continue
+        try:
+            id_ = parsers.uuid_text(
+                entry['row'][conv.layout.sqlite_columns.index('id')])
+        except (AttributeError, IndexError, KeyError, TypeError,
+                ValueError):
+            continue
+        ids.setdefault(conv.sqlite_table, set()).add(id_)
+    return {table: frozenset(table_ids) for table, table_ids in ids.items()}
+
+
+def _row_hash(line: str) -> int:
+    """The first 64 bits of md5, like '('x' || md5)::bit(64)::bigint'."""
+    return int.from_bytes(hashlib.md5(line.encode('utf-8')).digest()[:8],
+                          'big', signed=True)
+
+
+def _pg_rows_query(conv: load_data.Convertor, prefix: int) -> str:
+    """PostgreSQL query of (bucket, id, row hash)."""
+    line = "concat_ws(E'\\t', {values})".format(values=', '.join(
+        "COALESCE({value}, '{null}')".format(
+            value=_PG_NORMALIZERS[pg_type].format(column), null=NULL_TEXT)
+        for column, pg_type in zip(conv.columns, conv.layout.pg_types)))
+    return (
+        'SELECT left(md5(id::text), {prefix}) AS bucket, id::text AS id, '
+        "('x' || left(md5({line}), 16))::bit(64)::bigint AS hash "
+        'FROM {table}'.format(prefix=prefix, line=line,
+                              table=conv.psql_table))
+
+
+def _sqlite_rows(sqlite_path: str,
+                 conv: load_data.Convertor,
+                 prefix: int,
+                 buckets: Iterable[str] = (),
+                 skipped: FrozenSet[str] = frozenset()
+                 ) -> Iterator[Tuple[str, str, int]]:
+    """(bucket, id, row hash) of the rows the loader would copy.
+
+        'skipped' are ids of quarantined rows.
+    """
+    normalizers = [_PY_NORMALIZERS[pg_type]
+                   for pg_type in conv.layout.pg_types]
+    id_index = conv.columns.index('id')
+    buckets = set(buckets)
+    with load_data.sqlite_conn_context(sqlite_path) as sqlite:
+        sqlite.create_function('bucket_of', 1, _sqlite_bucket(prefix),
+                               deterministic=True)
+        cursor = sqlite.cursor()
+        cursor.row_factory = None
+        condition = '1'
+        if buckets:
+            # A temporary table: there may be more buckets than
+            # parameters of a statement
+            cursor.execute('CREATE TEMP TABLE buckets '
+                           '(bucket TEXT PRIMARY KEY) WITHOUT ROWID;')
+            cursor.executemany('INSERT INTO buckets VALUES (?);',
+                               ((bucket,) for bucket in buckets))
+            condition = 'bucket_of(id) IN (SELECT bucket FROM buckets)'
+        cursor.execute(load_data.select_query(conv, condition))
+        for entries in iter(
+                lambda: cursor.fetchmany(load_data.DEFAULT_BATCH_SIZE), []):
+            for entry in entries:
+                try:
+                    values = conv.layout.convert(entry)
+                except Exception:
+                    # Rejected by the loader as well
+                    continue
+                line = _SEPARATOR.join([
+                    NULL_TEXT if value is None else normalize(value)
+                    for normalize, value in zip(normalizers, values)])
+                id_ = values[id_index]
+                if id_ in skipped:
+                    continue
+                yield bucket_of(id_, prefix), id_, _row_hash(line)
+
+
+def _pg_digests(dsl: dict, conv: load_data.Convertor, prefix: int) -> Digests:
+    with closing(psycopg2.connect(**dsl)) as pg_conn, \
+            pg_conn, pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute(
+            'SELECT bucket, count(*), sum(hash) FROM ({rows}) AS rows '
+            'GROUP BY bucket;'.format(rows=_pg_rows_query(conv, prefix)))
+        return {bucket: (count, int(total))
+                for bucket, count, total in pg_cursor.fetchall()}
+
+
+def _table_digests(sqlite_path: str,
+                   dsl: dict,
+                   sqlite_table: str,
+                   prefix: int,
+                   skipped: FrozenSet[str]) -> Tuple[Digests, Digests]:
+    """Worker process: SQLite and PostgreSQL digests of a table."""
+    conv = load_data.get_convertor(sqlite_table)
+    # The aggregate query runs in PostgreSQL meanwhile SQLite is read
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pg_digests = pool.submit(_pg_digests, dsl, conv, prefix)
+        digests: Dict[str, List[int]] = {}
+        for bucket, _, row_hash in _sqlite_rows(sqlite_path, conv, prefix,
+                                                skipped=skipped):
+            digest = digests.setdefault(bucket, [0, 0])
+            digest[0] += 1
+            digest[1] += row_hash
+        return ({bucket: tuple(digest) for bucket, digest in digests.items()},
+                pg_digests.result())
+
+
+def _compare_buckets(sqlite_path: str,
+                     dsl: dict,
+                     sqlite_table: str,
+                     prefix: int,
+                     buckets: List[str],
+                     skipped: FrozenSet[str]
+                     ) -> Tuple[List[str], List[str], List[str]]:
+    """Worker process: missing, extra and changed rows of the buckets."""
+    conv = load_data.get_convertor(sqlite_table)
+    with closing(psycopg2.connect(**dsl)) as pg_conn, \
+            pg_conn, pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute(
+            'SELECT id, hash FROM ({rows}) AS rows '
+            'WHERE bucket = ANY(%s);'.format(
+                rows=_pg_rows_query(conv, prefix)),
+            (buckets,))
+        pg_hashes = dict(pg_cursor.fetchall())
+    missing, changed = [], []
+    for _, id_, row_hash in _sqlite_rows(sqlite_path, conv, prefix, buckets,
+                                         skipped):
+        pg_hash = pg_hashes.pop(id_, None)
+        if pg_hash is None:
+            missing.append(id_)
+        elif pg_hash != row_hash:
+            changed.append(id_)
+    return missing, sorted(pg_hashes), changed
+
+
+def _split(items: List[str], parts: int) -> List[List[str]]:
+    return [chunk for chunk in (items[i::parts] for i in range(parts))
+            if chunk]
+
+
+def verify(sqlite_path: str,
+           dsl: dict,
+           workers: int = 1,
+           prefix: int = DEFAULT_PREFIX,
+           quarantine_path: Optional[str] = None) -> List[TableReport]:
+    """Compare all the loader tables of SQLite and PostgreSQL.
+
+        Rows of the 'quarantine_path' file are not expected in PostgreSQL.
+    """
+    if not 0 < prefix <= 32:
+        raise ValueError(f'Bucket prefix must be 1..32, got {prefix}')
+    skipped = quarantined_ids(quarantine_path)
+    reports = {conv.sqlite_table: TableReport(conv.psql_table)
+               for conv in load_data.CONVERTORS}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        digests = {
+            sqlite_table: pool.submit(_table_digests, sqlite_path, dsl,
+                                      sqlite_table, prefix,
+                                      skipped.get(sqlite_table, frozenset()))
+            for sqlite_table in reports}
+        drill_downs = []
+        for sqlite_table, future in digests.items():
+            sqlite_digests, pg_digests = future.result()
+            report = reports[sqlite_table]
+            report.sqlite_rows = sum(
+                count for count, _ in sqlite_digests.values())
+            report.postgres_rows = sum(
+                count for count, _ in pg_digests.values())
+            buckets = set(sqlite_digests) | set(pg_digests)
+            report.buckets = len(buckets)
+            report.mismatched_buckets = sorted(
+                bucket for bucket in buckets
+                if sqlite_digests.get(bucket) != pg_digests.get(bucket))
+            drill_downs.extend(
+                (report, pool.submit(_compare_buckets, sqlite_path, dsl,
+                                     sqlite_table, prefix, chunk,
+                                     skipped.get(sqlite_table, frozenset())))
+                for chunk in _split(report.mismatched_buckets, workers))
+        for report, future in drill_downs:
+            missing, extra, changed = future.result()
+            report.missing.extend(missing)
+            report.extra.extend(extra)
+            report.changed.extend(changed)
+    return list(reports.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0].strip())
+    parser.add_argument('--prefix', type=int, default=DEFAULT_PREFIX,
+                        help='hex digits of the bucket id hash prefix')
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    load_dotenv()
+    db_path = os.environ.get('SQL_LITE_DB_PATH', 'db.sqlite')
+    reports = verify(db_path, load_data.get_dsl(), args.workers, args.prefix,
+                     os.environ.get('LOAD_QUARANTINE_PATH'))
+    for report in reports:
+        if report.ok:
+            logger.info(report.summary())
+        else:
+            logger.error(report.summary())
+    sys.exit(0 if all(report.ok for report in reports) else 1)
+
+
+if __name__ == '__main__':
+    main()